@@ -0,0 +1,148 @@
+# admission.py
+import os
+import shutil
+import threading
+
+from cancellation import partials_of
+from probe import probe_media
+
+ADMITTED = "Admitted"
+WAIT = "Wait"
+REJECTED = "Rejected"
+
+DEFAULT_RESERVE_BYTES = 5 * 1024 ** 3
+DEFAULT_RESERVE_FRACTION = 0.02
+
+# Rough bytes per pixel per frame of each command's output. MJPG intermediates
+# from RemoveBlackBarsCommand are an order of magnitude bigger than x264.
+MJPG_BYTES_PER_PIXEL = 0.2
+X264_BYTES_PER_PIXEL = 0.02
+AAC_320K_BYTES_PER_SECOND = 320000 / 8
+
+
+def _crop_area(command, info):
+    crop = getattr(command, 'crop_dimensions', None)
+    if isinstance(crop, (tuple, list)) and len(crop) == 4:
+        x1, y1, x2, y2 = crop
+        return max(0, x2 - x1) * max(0, y2 - y1)
+    return (info.get('width') or 0) * (info.get('height') or 0)
+
+
+def estimate_output_size(command, info):
+    """
+    Estimates the bytes a command writes, from the probed metadata of the job's source.
+    """
+    name = command.__class__.__name__
+    duration = info.get('duration') or 0
+    frames = duration * (info.get('fps') or 30)
+    if name == 'RemuxCommand':
+        return info['size']
+    if name == 'JoinPartsCommand':
+        return sum(os.path.getsize(path) for path in command.part_paths if os.path.isfile(path))
+    if name == 'DeadAirTrimCommand':
+        # At most a copy of the video and its WAV
+        return info['size'] + (os.path.getsize(command.audio_path) if os.path.isfile(command.audio_path) else 0)
+    if name == 'PrepareAudioCommand':
+        return duration * AAC_320K_BYTES_PER_SECOND
+    if name == 'ReplaceAudioCommand':
+        return info['size'] + duration * AAC_320K_BYTES_PER_SECOND
+    if name == 'RemoveBlackBarsCommand':
+        return _crop_area(command, info) * frames * MJPG_BYTES_PER_PIXEL
+    if name == 'FanOutCommand':
+        # Upper bound: every sink at the size of the full repaired frame
+        return _crop_area(command, info) * frames * (MJPG_BYTES_PER_PIXEL + len(command.sinks) * X264_BYTES_PER_PIXEL)
+    if name in ('AVItoMP4Command', 'VideoCropperCommand'):
+        return _crop_area(command, info) * frames * X264_BYTES_PER_PIXEL + duration * AAC_320K_BYTES_PER_SECOND
+    return 0
+
+
+def job_source(commands):
+    command = commands[0]
+    return getattr(command, 'file_path', None) or command.video_path
+
+
+def job_output_paths(commands):
+    return [command.output_path for command in commands
+            if getattr(command, 'output_path', None)]
+
+
+def estimate_job_footprint(commands):
+    """
+    Peak bytes written by a chain of commands. Intermediates are kept beside the
+    source, so the peak is the sum of every stage's output.
+    """
+    source = job_source(commands)
+    if not os.path.isfile(source):
+        return 0
+    info = probe_media(source)
+    return int(sum(estimate_output_size(command, info) for command in commands))
+
+
+class DiskAdmissionController:
+    def __init__(self, reserve_bytes=DEFAULT_RESERVE_BYTES, reserve_fraction=DEFAULT_RESERVE_FRACTION):
+        """
+        Admits jobs only while their projected output fits the free space of the
+        target device, keeping a reserve margin free.
+        :param reserve_bytes: Absolute space always left free on the device.
+        :param reserve_fraction: Fraction of the device's size always left free.
+        """
+        self.reserve_bytes = reserve_bytes
+        self.reserve_fraction = reserve_fraction
+        self.lock = threading.Lock()
+        self.estimates = {}
+        self.admitted = {}
+
+    def _estimate(self, job_id, commands):
+        if job_id not in self.estimates:
+            target_dir = os.path.dirname(os.path.abspath(job_source(commands)))
+            try:
+                footprint = estimate_job_footprint(commands)
+            except Exception:
+                footprint = 0  # let the command itself report the problem
+            self.estimates[job_id] = (target_dir, os.stat(target_dir).st_dev if os.path.isdir(target_dir) else None,
+                                      footprint, job_output_paths(commands))
+        return self.estimates[job_id]
+
+    def _outstanding(self, device):
+        # Space admitted jobs still have to write: their estimate minus what is already
+        # on disk, in the outputs or the partials they are written to first
+        outstanding = 0
+        for _, job_device, footprint, output_paths in self.admitted.values():
+            if job_device != device:
+                continue
+            written = 0
+            for path in output_paths:
+                for written_path in [path] + partials_of(path):
+                    try:
+                        written += os.path.getsize(written_path)
+                    except OSError:
+                        pass  # committed or discarded meanwhile
+            outstanding += max(0, footprint - written)
+        return outstanding
+
+    def try_admit(self, job_id, commands):
+        with self.lock:
+            target_dir, device, footprint, output_paths = self._estimate(job_id, commands)
+            if device is None or footprint == 0:
+                self.admitted[job_id] = self.estimates[job_id]
+                return ADMITTED
+            usage = shutil.disk_usage(target_dir)
+            reserve = max(self.reserve_bytes, usage.total * self.reserve_fraction)
+            available = usage.free - self._outstanding(device) - reserve
+            if footprint <= available:
+                self.admitted[job_id] = self.estimates[job_id]
+                return ADMITTED
+            if not any(admitted[1] == device for admitted in self.admitted.values()):
+                # Nothing is running on this device, so no space will ever be released
+                return REJECTED
+            return WAIT
+
+    def release(self, job_id):
+        with self.lock:
+            self.admitted.pop(job_id, None)
+            self.estimates.pop(job_id, None)
+
+    def reject_reason(self, job_id):
+        target_dir, _, footprint, _ = self.estimates[job_id]
+        free = shutil.disk_usage(target_dir).free
+        return f"Insufficient disk space: job needs ~{footprint / 1024 ** 3:.1f} GiB, {free / 1024 ** 3:.1f} GiB free on {target_dir}"
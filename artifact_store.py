@@ -0,0 +1,178 @@
+# artifact_store.py
+import hashlib
+import json
+import os
+import shutil
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows: the index isn't shared between runs safely
+
+DEFAULT_MAX_BYTES = 200 * 1024 ** 3
+FINGERPRINT_CHUNK_BYTES = 1024 * 1024
+
+_fingerprints = {}
+
+
+def fingerprint(path):
+    """
+    Content fingerprint of a file: a hash of all of it. Duplicate copies of a
+    file share a fingerprint whatever their name or mtime. Sampling parts of
+    the file isn't enough: same-length WAVs padded with silence differ only in
+    the middle. Remembered per path, size and mtime for the life of the process.
+    """
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if memo_key not in _fingerprints:
+        digest = hashlib.sha256(str(stat.st_size).encode())
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(FINGERPRINT_CHUNK_BYTES), b''):
+                digest.update(chunk)
+        _fingerprints[memo_key] = digest.hexdigest()
+    return _fingerprints[memo_key]
+
+
+def _link_or_copy(source, destination):
+    os.makedirs(os.path.dirname(os.path.abspath(destination)), exist_ok=True)
+    tmp_path = destination + ".store-tmp"
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        # Different device or no hard link support
+        shutil.copy2(source, tmp_path)
+    os.replace(tmp_path, destination)
+
+
+class ArtifactStore:
+    def __init__(self, root, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        Content-addressed store for command outputs with LRU eviction.
+        :param root: Store folder; keep it on the same device as the videos so outputs are hard links.
+        :param max_bytes: Size cap; least recently used artifacts are evicted beyond it.
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(root, "index.json")
+        self.lock_path = os.path.join(root, "index.lock")
+        self.index = None
+        self.index_mtime = None
+        # Hits since the index was last written, {key: time}; LRU order is only
+        # kept in memory and written with the next put
+        self.accessed = {}
+
+    def __getstate__(self):
+        # Worker processes reload the index themselves
+        state = self.__dict__.copy()
+        state['index'] = None
+        state['index_mtime'] = None
+        state['accessed'] = {}
+        return state
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(self.root, exist_ok=True)
+        if fcntl is None:
+            self._reload()
+            yield
+            return
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._reload()
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _reload(self):
+        mtime = os.path.getmtime(self.index_path) if os.path.exists(self.index_path) else None
+        if self.index is not None and mtime == self.index_mtime:
+            return
+        entries = []
+        if mtime is not None:
+            with open(self.index_path, 'r') as f:
+                entries = json.load(f)
+        self.index = OrderedDict((entry['key'], entry) for entry in entries)
+        self.index_mtime = mtime
+        for key, accessed in sorted(self.accessed.items(), key=lambda item: item[1]):
+            self._touch(key, accessed)
+
+    def _touch(self, key, accessed):
+        entry = self.index.get(key)
+        if entry is not None and entry['last_access'] < accessed:
+            entry['last_access'] = accessed
+            self.index.move_to_end(key)
+
+    def _save(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(list(self.index.values()), f, indent=4)
+        os.replace(tmp_path, self.index_path)
+        self.index_mtime = os.path.getmtime(self.index_path)
+        self.accessed = {}
+
+    def _artifact_path(self, entry):
+        return os.path.join(self.root, entry['key'][:2], entry['file'])
+
+    @staticmethod
+    def make_key(command_name, input_paths, params):
+        payload = json.dumps([command_name, [fingerprint(p) for p in input_paths], params],
+                             sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def command_key(self, command):
+        input_paths = command.cache_inputs()
+        if not input_paths or not all(os.path.isfile(p) for p in input_paths):
+            return None
+        return self.make_key(command.__class__.__name__, input_paths, command.cache_params())
+
+    def total_bytes(self):
+        return sum(entry['size'] for entry in self.index.values())
+
+    def fetch(self, key, destination):
+        """
+        Places the stored artifact at destination. Returns False on a miss.
+        """
+        with self._locked():
+            entry = self.index.get(key)
+            if entry is None:
+                return False
+            artifact_path = self._artifact_path(entry)
+            if not os.path.isfile(artifact_path):
+                del self.index[key]
+                self._save()
+                return False
+            self.accessed[key] = time.time()
+            self._touch(key, self.accessed[key])
+        if os.path.abspath(destination) != os.path.abspath(artifact_path):
+            _link_or_copy(artifact_path, destination)
+        return True
+
+    def put(self, key, source_path):
+        with self._locked():
+            if key in self.index:
+                self._touch(key, time.time())
+                self._save()
+                return
+            entry = {'key': key,
+                     'file': key + os.path.splitext(source_path)[1],
+                     'size': os.path.getsize(source_path),
+                     'source_name': os.path.basename(source_path),
+                     'last_access': time.time()}
+            _link_or_copy(source_path, self._artifact_path(entry))
+            self.index[key] = entry
+            self._evict()
+            self._save()
+
+    def _evict(self):
+        total = self.total_bytes()
+        while total > self.max_bytes and len(self.index) > 1:
+            _, entry = self.index.popitem(last=False)
+            total -= entry['size']
+            try:
+                os.remove(self._artifact_path(entry))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,157 @@
+# async_runner.py
+import asyncio
+import os
+import re
+import signal
+from collections import deque
+from multiprocessing import cpu_count
+
+from container_headers import read_header
+from thread_budget import with_threads
+import profiling
+import thread_budget
+
+STDERR_TAIL_LINES = 20
+DURATION_PATTERN = re.compile(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)")
+
+
+class FfmpegError(Exception):
+    def __init__(self, args, returncode, stderr_tail):
+        self.returncode = returncode
+        self.stderr_tail = stderr_tail
+        super().__init__(f"{args[0]} exited with code {returncode}: {stderr_tail[-1] if stderr_tail else ''}")
+
+
+class FfmpegTimeout(Exception):
+    pass
+
+
+async def _kill_group(process):
+    # ffmpeg runs in its own session; take down anything it spawned as well
+    try:
+        if hasattr(os, 'killpg'):
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            # No process groups on Windows: stop ffmpeg itself
+            process.kill()
+    except ProcessLookupError:
+        pass
+    await process.wait()
+
+
+class AsyncFfmpegRunner:
+    def __init__(self, max_concurrent=None, timeout=None, show_progress=True):
+        """
+        Launches and supervises ffmpeg/ffprobe subprocesses from one event loop.
+        :param max_concurrent: Number of subprocesses allowed to run at once.
+        :param timeout: Default wall-clock limit in seconds for one ffmpeg call.
+        :param show_progress: Print a combined progress line for running jobs.
+        """
+        self.semaphore = asyncio.Semaphore(max_concurrent or cpu_count())
+        self.timeout = timeout
+        self.show_progress = show_progress
+        self.progress = {}
+
+    def report_progress(self, label, seconds, duration):
+        if duration:
+            self.progress[label] = min(100.0, seconds * 100 / duration)
+        if self.show_progress and self.progress:
+            line = "  ".join(f"{name[:24]}: {value:5.1f}%" for name, value in self.progress.items())
+            print(f"\r {line}", end="")
+
+    async def _read_progress(self, stream, label, state):
+        # -progress pipe:1 emits blocks of key=value lines ending with progress=...
+        while True:
+            line = await stream.readline()
+            if not line:
+                break
+            key, _, value = line.decode(errors='replace').strip().partition('=')
+            if key == 'out_time_us' and value.isdigit():
+                self.report_progress(label, int(value) / 1e6, state['duration'])
+
+    async def _read_stderr(self, stream, state):
+        while True:
+            line = await stream.readline()
+            if not line:
+                break
+            text = line.decode(errors='replace').rstrip()
+            state['stderr'].append(text)
+            if state['duration'] is None:
+                match = DURATION_PATTERN.search(text)
+                if match:
+                    hours, minutes, seconds = match.groups()
+                    state['duration'] = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+    async def run(self, args, label=None, timeout=None, threaded=False):
+        """
+        Runs one ffmpeg command, raising FfmpegError on failure and FfmpegTimeout on timeout.
+        A threaded command holds a share of the thread budget while it runs.
+        """
+        label = label or os.path.basename(args[-1])
+        timeout = timeout if timeout is not None else self.timeout
+        args = [args[0], '-nostdin', '-progress', 'pipe:1', '-nostats'] + list(args[1:])
+        state = {'duration': None, 'stderr': deque(maxlen=STDERR_TAIL_LINES)}
+        async with self.semaphore:
+            with thread_budget.allocation(threaded) as threads, \
+                    profiling.span("ffmpeg", tid=label, output=args[-1]):
+                args = with_threads(args, threads)
+                process = await asyncio.create_subprocess_exec(
+                    *args, stdin=asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                    start_new_session=True)
+                readers = asyncio.gather(self._read_progress(process.stdout, label, state),
+                                         self._read_stderr(process.stderr, state))
+                try:
+                    await asyncio.wait_for(process.wait(), timeout)
+                except asyncio.TimeoutError:
+                    await _kill_group(process)
+                    raise FfmpegTimeout(f"{label}: ffmpeg timed out after {timeout} s")
+                except asyncio.CancelledError:
+                    await _kill_group(process)
+                    raise
+                finally:
+                    await readers
+                    self.progress.pop(label, None)
+        if process.returncode != 0:
+            raise FfmpegError(args, process.returncode, list(state['stderr']))
+        return process.returncode
+
+    async def check_output(self, args, timeout=None):
+        timeout = timeout if timeout is not None else self.timeout
+        async with self.semaphore:
+            with profiling.span(args[0], tid=args[-1], file=args[-1]):
+                process = await asyncio.create_subprocess_exec(
+                    *args, stdin=asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                    start_new_session=True)
+                try:
+                    stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+                except asyncio.TimeoutError:
+                    await _kill_group(process)
+                    raise FfmpegTimeout(f"{args[0]} timed out after {timeout} s")
+                except asyncio.CancelledError:
+                    await _kill_group(process)
+                    raise
+        if process.returncode != 0:
+            raise FfmpegError(args, process.returncode,
+                              stderr.decode(errors='replace').splitlines()[-STDERR_TAIL_LINES:])
+        return stdout
+
+    async def probe_duration(self, path):
+        info = read_header(path)
+        if info is not None and info['duration']:
+            return info['duration']
+        output = await self.check_output(['ffprobe', '-v', 'error', '-show_entries',
+                                          'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1',
+                                          path])
+        return float(output)
+
+    async def run_job(self, commands, invoker):
+        # Commands of one job run in order, like FileOperationInvoker.execute_commands
+        for command in commands:
+            await invoker.run_command_async(command, self)
+        invoker.remove_intermediates(commands)
+
+
+def is_ffmpeg_job(commands):
+    return all(hasattr(command, 'execute_async') for command in commands)
@@ -0,0 +1,130 @@
+# av_sync.py
+#
+# Checks that a replacement WAV lines up with a video's own audio before the
+# mux. Both are reduced to loudness envelopes at ENVELOPE_RATE (the video's
+# track decoded by ffmpeg at a low sample rate, the WAV read through a
+# memory map in chunks), and an FFT cross-correlation of the two envelopes
+# gives the offset of the WAV and how well it matches at that offset.
+import os
+import subprocess
+import numpy as np
+
+from container_headers import wav_data_layout
+from probe import probe_media
+import profiling
+
+ENVELOPE_RATE = 100  # envelope samples per second, i.e. 10 ms resolution
+EXTRACT_RATE = 8000  # sample rate the video's audio is decoded at
+CHUNK_SECONDS = 60
+MAX_OFFSET = 30.0  # largest offset searched, in seconds
+MIN_CONFIDENCE = 0.4  # correlation below this means a different take or recording
+SYNC_TOLERANCE = 0.02  # offsets smaller than this are left alone
+
+
+def envelope(samples, sample_rate, rate=ENVELOPE_RATE, chunk_seconds=CHUNK_SECONDS):
+    """
+    Mean absolute amplitude per block of sample_rate / rate samples, over all channels.
+    Works through samples (frames[, channels]) in chunks so memory maps stay paged out.
+    Returns (envelope, actual_rate).
+    """
+    block = max(1, int(round(sample_rate / rate)))
+    blocks = len(samples) // block
+    result = np.empty(blocks, np.float32)
+    step = max(1, int(chunk_seconds * rate))
+    for start in range(0, blocks, step):
+        stop = min(blocks, start + step)
+        chunk = np.abs(np.asarray(samples[start * block:stop * block], dtype=np.float32))
+        result[start:stop] = chunk.reshape(stop - start, block, -1).mean(axis=(1, 2))
+    return result, sample_rate / block
+
+
+def wav_samples(path):
+    """
+    Memory-mapped (frames, channels) view of a PCM WAV. Integer samples wider
+    than 16 bits are viewed through their top 16 bits, which is plenty for an
+    envelope and avoids converting 24-bit data.
+    Returns (samples, sample_rate).
+    """
+    layout = wav_data_layout(path)
+    width = layout['bits'] // 8
+    if layout['float']:
+        dtype, skip = f'<f{width}', 0
+    elif width >= 2:
+        dtype, skip = '<i2', width - 2
+    else:
+        raise ValueError(f"8-bit WAV is not supported: {path}")
+    data = np.memmap(path, dtype=np.uint8, mode='r')
+    samples = np.ndarray((layout['frames'], layout['channels']), dtype=dtype, buffer=data,
+                         offset=layout['offset'] + skip, strides=(layout['block_align'], width))
+    return samples, layout['sample_rate']
+
+
+def video_audio_envelope(video_path, rate=ENVELOPE_RATE):
+    """
+    Envelope of a video's first audio track, or None if it has no audio.
+    """
+    # ffmpeg fails rather than write an empty output when there is nothing to map
+    if probe_media(video_path)['audio_codec'] is None:
+        return None
+    args = ['ffmpeg', '-v', 'error', '-nostdin', '-i', video_path, '-map', '0:a:0?', '-vn',
+            '-ac', '1', '-ar', str(EXTRACT_RATE), '-f', 's16le', 'pipe:1']
+    with profiling.span("audio envelope", file=os.path.basename(video_path)):
+        raw = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True).stdout
+    if not raw:
+        return None
+    return envelope(np.frombuffer(raw, np.int16), EXTRACT_RATE, rate)[0]
+
+
+def cross_correlate(reference, candidate, rate, max_offset=MAX_OFFSET):
+    """
+    Finds the lag at which candidate best matches reference.
+    Returns (offset, confidence): offset in seconds by which the candidate must be
+    delayed (negative: its head must be cut) and the correlation coefficient at
+    that offset over the overlapping part.
+    """
+    if len(reference) < 2 or len(candidate) < 2:
+        return 0.0, 0.0
+    a = reference - reference.mean()
+    b = candidate - candidate.mean()
+    if not a.std() or not b.std():
+        return 0.0, 0.0
+    a, b = a / a.std(), b / b.std()
+    size = 1 << (len(a) + len(b) - 1).bit_length()
+    # corr[k] = sum(a[i + k] * b[i]), negative lags wrap to the end
+    corr = np.fft.irfft(np.fft.rfft(a, size) * np.conj(np.fft.rfft(b, size)), size)
+    max_lag = int(max_offset * rate)
+    lags = np.arange(-min(max_lag, len(b) - 1), min(max_lag, len(a) - 1) + 1)
+    values = corr[lags % size]
+    best = int(np.argmax(values))
+    lag = int(lags[best])
+    overlap = min(len(a) - lag, len(b)) if lag >= 0 else min(len(a), len(b) + lag)
+    return lag / rate, float(values[best] / max(overlap, 1))
+
+
+def measure_offset(video_path, wav_path, max_offset=MAX_OFFSET):
+    """
+    Returns (offset, confidence) of a WAV against a video's own audio, or None
+    when the video has no audio track to compare with.
+    """
+    reference = video_audio_envelope(video_path)
+    if reference is None:
+        return None
+    with profiling.span("wav envelope", file=os.path.basename(wav_path)):
+        samples, sample_rate = wav_samples(wav_path)
+        candidate, rate = envelope(samples, sample_rate)
+    if rate != ENVELOPE_RATE:
+        # Sample rates that don't divide evenly give a slightly different envelope rate
+        times = np.arange(int(len(candidate) * ENVELOPE_RATE / rate)) * (rate / ENVELOPE_RATE)
+        candidate = np.interp(times, np.arange(len(candidate)), candidate).astype(np.float32)
+    return cross_correlate(reference, candidate, ENVELOPE_RATE, max_offset)
+
+
+def offset_args(offset):
+    """
+    ffmpeg input options placed before the WAV's -i to compensate an offset.
+    """
+    if abs(offset) < SYNC_TOLERANCE:
+        return []
+    if offset > 0:
+        return ['-itsoffset', f"{offset:.3f}"]
+    return ['-ss', f"{-offset:.3f}"]
@@ -0,0 +1,61 @@
+# bar_geometry.py
+#
+# Measures dark bands on all four sides of a frame. A column profile (mean of
+# each column) and a row profile (mean of each row) are built once per frame
+# from a fixed set of evenly spaced sample lines, so the cost is
+# O(rows + cols) rather than O(rows * cols). The width of each band then
+# follows from a cumulative sum over the profile from that edge.
+import numpy as np
+
+SIDES = ('left', 'right', 'top', 'bottom')
+SAMPLE_LINES = 48  # rows (and columns) sampled for the profiles
+MAX_BAR_FRACTION = 0.5  # bands are measured up to this fraction of the frame
+
+
+def leading_extent(dark):
+    # Length of the run of True at the start: positions where no False has been seen yet
+    return int(np.count_nonzero(np.cumsum(~dark) == 0))
+
+
+class BarDetector:
+    def __init__(self, threshold=10, sample_lines=SAMPLE_LINES, max_fraction=MAX_BAR_FRACTION):
+        """
+        :param threshold: Mean intensity below which a row or column is dark.
+        :param sample_lines: Rows/columns averaged into the column/row profiles.
+        :param max_fraction: Largest band measured, as a fraction of the frame's width or height.
+        """
+        self.threshold = threshold
+        self.sample_lines = sample_lines
+        self.max_fraction = max_fraction
+        self.shape = None
+
+    def _prepare(self, height, width):
+        self.shape = (height, width)
+        self.row_index = np.unique(np.linspace(0, height - 1, min(self.sample_lines, height)).astype(np.intp))
+        self.column_index = np.unique(np.linspace(0, width - 1, min(self.sample_lines, width)).astype(np.intp))
+        self.max_columns = max(1, int(width * self.max_fraction))
+        self.max_rows = max(1, int(height * self.max_fraction))
+
+    def profiles(self, frame):
+        """
+        Returns (column_profile, row_profile): mean intensity of each column and
+        of each row over the sampled lines and all channels.
+        """
+        if frame.shape[:2] != self.shape:
+            self._prepare(*frame.shape[:2])
+        axes = (0, 2) if frame.ndim == 3 else 0
+        columns = frame[self.row_index].mean(axis=axes)
+        rows = frame[:, self.column_index].mean(axis=(1, 2) if frame.ndim == 3 else 1)
+        return columns, rows
+
+    def measure(self, frame):
+        """
+        Returns {side: width in pixels of the dark band on that side}.
+        """
+        columns, rows = self.profiles(frame)
+        dark_columns = columns < self.threshold
+        dark_rows = rows < self.threshold
+        return {'left': leading_extent(dark_columns[:self.max_columns]),
+                'right': leading_extent(dark_columns[::-1][:self.max_columns]),
+                'top': leading_extent(dark_rows[:self.max_rows]),
+                'bottom': leading_extent(dark_rows[::-1][:self.max_rows])}
@@ -0,0 +1,144 @@
+# cancellation.py
+#
+# Cooperative cancellation and timeouts. The parent hands each worker a
+# multiprocessing Event; commands poll it through check() and run_process(),
+# which starts ffmpeg in its own process group so the whole group can be
+# killed. Outputs are written under a temporary ".partial" name and renamed
+# into place only on success, so an aborted run never leaves a file that
+# looks like a finished output.
+import glob
+import os
+import signal
+import subprocess
+import time
+import uuid
+
+KILL_GRACE = 5
+POLL_INTERVAL = 0.2
+PARTIAL_MARKER = ".partial"
+
+_cancel_event = None
+
+
+class Cancelled(Exception):
+    pass
+
+
+class CommandTimeout(Exception):
+    pass
+
+
+def set_cancel_event(event):
+    global _cancel_event
+    _cancel_event = event
+
+
+def cancelled():
+    return _cancel_event is not None and _cancel_event.is_set()
+
+
+def deadline_for(timeout):
+    return time.monotonic() + timeout if timeout else None
+
+
+def check(deadline=None, label=""):
+    if cancelled():
+        raise Cancelled(f"{label} cancelled".strip())
+    if deadline is not None and time.monotonic() > deadline:
+        raise CommandTimeout(f"{label} timed out".strip())
+
+
+def kill_process_group(process, grace=KILL_GRACE):
+    """
+    Terminates a child started with start_new_session=True and everything it spawned.
+    Without process groups (Windows) only the child itself is stopped.
+    """
+    if not hasattr(os, 'killpg'):
+        if process.poll() is not None:
+            return
+        process.terminate()
+        try:
+            process.wait(grace)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        return
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+    try:
+        process.wait(grace)
+    except subprocess.TimeoutExpired:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        process.wait()
+
+
+def run_process(args, timeout=None, label=None):
+    """
+    subprocess.run(args, check=True) that honours cancellation and a wall-clock timeout.
+    """
+    label = label or os.path.basename(args[0])
+    deadline = deadline_for(timeout)
+    process = subprocess.Popen(args, start_new_session=True)
+    try:
+        while True:
+            try:
+                process.wait(POLL_INTERVAL)
+                break
+            except subprocess.TimeoutExpired:
+                check(deadline, label)
+    except BaseException:
+        # Cancelled, timed out or interrupted: don't leave the child running
+        kill_process_group(process)
+        raise
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, args)
+    return process.returncode
+
+
+def partial_path(path):
+    """
+    Temporary name for an output in progress; keeps the extension so muxers are chosen correctly.
+    """
+    base, ext = os.path.splitext(path)
+    return f"{base}.{uuid.uuid4().hex[:8]}{PARTIAL_MARKER}{ext}"
+
+
+def partials_of(path):
+    """
+    Partial outputs in progress for a final output path.
+    """
+    base, ext = os.path.splitext(path)
+    return glob.glob(f"{glob.escape(base)}.*{PARTIAL_MARKER}{glob.escape(ext)}")
+
+
+def commit_output(partial, final):
+    os.replace(partial, final)
+
+
+def discard(path):
+    if path and os.path.exists(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def cleanup_partials(folders, stems=None):
+    """
+    Removes leftover partial outputs from the given folders, or only those of
+    the given output stems. Returns the paths removed.
+    """
+    removed = []
+    for folder in folders:
+        for path in glob.glob(os.path.join(glob.escape(folder), f"*{PARTIAL_MARKER}.*")):
+            # partial_path() inserts ".<token>.partial" after the stem
+            if stems is not None and os.path.basename(path).split(PARTIAL_MARKER)[0].rsplit('.', 1)[0] not in stems:
+                continue
+            discard(path)
+            removed.append(path)
+    return removed
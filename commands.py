@@ -1,19 +1,257 @@
 # commands.py
-import subprocess
+import asyncio
+import hashlib
 import os
+import re
+import shutil
+import subprocess
+import time
 import cv2
 import numpy as np
 from moviepy.editor import VideoFileClip
 import json
 from better_ffmpeg_progress import FfmpegProcess
+from crop_detection import resolve_crop_dimensions
+from bar_geometry import SIDES as BAR_SIDES, BarDetector
+from edge_stats import EdgeStatsRecorder, detect_from_stats, load_edge_stats
+from luma import LumaReader
+from frame_exporter import FrameExporter
+from rename_engine import BulkRenamer
+from fanout import FanOutWriter, FrameSink
+from probe import probe_duration, probe_media
+from dead_air import MIN_DEAD_AIR, PADDING, SILENCE_DB, find_content, keyframe_before
+from av_sync import MAX_OFFSET, MIN_CONFIDENCE, measure_offset, offset_args
+from thread_budget import with_threads
+import thread_budget
+from cancellation import check, commit_output, deadline_for, discard, partial_path, run_process
+from output_locks import OutputLocks, update_json
+from verify import VERIFY_TOLERANCE, start_counting, start_counting_async, verify_output, verify_output_async
+import profiling
+
+
+# Frames decoded between cancellation/timeout checks in the OpenCV loops
+CANCEL_CHECK_FRAMES = 100
 
 
 class Command:
+    # Outputs of intermediate commands are removed once the artifact store holds them
+    intermediate = False
+    # Wall-clock limit in seconds, None for no limit
+    timeout = None
+    # Stream kinds ('video', 'audio') whose packets and duration the output must keep (see verify.py)
+    verify_streams = ()
+
+    def __new__(cls, *args, **kwargs):
+        # Keep the constructor arguments so a command can be described as a
+        # plain job spec and rebuilt on another machine (see distributed.py).
+        instance = super().__new__(cls)
+        instance.init_args = (args, kwargs)
+        return instance
+
     def execute(self):
         pass
 
+    def to_spec(self):
+        args, kwargs = self.init_args
+        spec = {'command': self.__class__.__name__, 'args': list(args), 'kwargs': dict(kwargs)}
+        if self.timeout is not None:
+            # Set after construction (COMMAND_TIMEOUTS), so not among the arguments
+            spec['timeout'] = self.timeout
+        return spec
+
+    def cache_inputs(self):
+        """
+        Input files whose content determines the output, or None if the output
+        cannot be reused from the artifact store.
+        """
+        return None
+
+    def cache_params(self):
+        return {}
+
+    def planned_output_path(self):
+        return self.output_path
+
+    def finish_cached(self):
+        self.status = "Success"
+
+    def is_cached(self):
+        # True when the output already exists and execute() will do no work
+        return False
+
+    def output_paths(self):
+        """
+        Files this command writes, locked while it runs (see output_locks.py).
+        """
+        path = self.planned_output_path() if hasattr(self, 'output_path') else None
+        return [path] if path else []
 
-class RemuxCommand(Command):
+    def dry_run_outputs(self):
+        # Outputs listed by a dry run, without touching the file system
+        return self.output_paths()
+
+    def verify_sources(self):
+        return [getattr(self, 'file_path', None) or self.video_path]
+
+    def verify_tolerance(self):
+        return VERIFY_TOLERANCE
+
+    def adopt_output(self):
+        # Another run wrote the outputs while this command waited for their locks
+        self.output_path = self.planned_output_path()
+        self.status = "Success"
+
+
+class FfmpegCommand(Command):
+    """
+    A command whose work is a single ffmpeg invocation. Subclasses provide
+    ffmpeg_args() and finish(); the same command can then run blocking via
+    execute() or under an AsyncFfmpegRunner via execute_async().
+    Commands returned by stages() run first and must succeed, and is_cached()
+    lets a command skip ffmpeg when its output already exists.
+    ffmpeg writes to a temporary name that is renamed to the output path (the
+    last argument) only on success and once it passes verification, so
+    finish() never moves or deletes originals next to a broken output.
+    """
+    overwrite_output = False
+    # Encodes video and takes a share of the thread budget; stream copies don't
+    threaded = False
+
+    def ffmpeg_args(self):
+        raise NotImplementedError
+
+    def partial_ffmpeg_args(self):
+        args = list(self.ffmpeg_args())
+        self.final_output, self.partial_output = args[-1], partial_path(args[-1])
+        if not self.overwrite_output and os.path.exists(self.final_output):
+            raise FileExistsError(f"Output already exists: {self.final_output}")
+        args[-1] = self.partial_output
+        return args
+
+    def finish(self):
+        self.status = "Success"
+
+    def finish_cached(self):
+        self.finish()
+
+    def stages(self):
+        return []
+
+    def progress_label(self):
+        return os.path.basename(getattr(self, 'file_path', None) or self.video_path)
+
+    def fail_from_stage(self, stage):
+        self.status, self.reason = "Failed", f"{stage.__class__.__name__} failed: {stage.reason}"
+
+    def stage_locks(self, stage):
+        try:
+            return OutputLocks(stage.output_paths())
+        except OSError:
+            return OutputLocks([])  # inputs missing; the stage reports it when it runs
+
+    def run_stage(self, stage):
+        """
+        Runs a stage under the locks of its outputs, as the invoker runs a
+        command: the same output may be written by a job of its own (a
+        prepared audio stream queued beside the chain). If that job wrote it
+        while the stage waited, the stage takes it over.
+        """
+        locks = self.stage_locks(stage)
+        if not locks.acquire(stage.progress_label()):
+            stage.status, stage.reason = "Failed", "Cancelled"
+            return False
+        try:
+            if locks.written_by_holder():
+                stage.adopt_output()
+                return True
+            return stage.execute()
+        finally:
+            locks.release()
+
+    async def run_stage_async(self, stage, runner):
+        # The output path of a prepared audio stream is a hash of the whole WAV
+        locks = await asyncio.get_running_loop().run_in_executor(None, self.stage_locks, stage)
+        await locks.acquire_async(stage.progress_label())
+        try:
+            if locks.written_by_holder():
+                stage.adopt_output()
+                return True
+            return await stage.execute_async(runner)
+        finally:
+            locks.release()
+
+    async def is_valid_async(self, runner):
+        # Validation may probe inputs (JoinPartsCommand probes every part); keep it off the event loop
+        return await asyncio.get_running_loop().run_in_executor(None, self.is_valid)
+
+    def execute(self):
+        if not self.is_valid():
+            return False
+        for stage in self.stages():
+            if not self.run_stage(stage):
+                self.fail_from_stage(stage)
+                return False
+        self.partial_output = None
+        try:
+            if not self.is_cached():
+                counting = start_counting(self)
+                with thread_budget.allocation(self.threaded) as threads:
+                    args = with_threads(self.partial_ffmpeg_args(), threads)
+                    with profiling.span("ffmpeg", input=self.progress_label()):
+                        run_process(args, timeout=self.timeout, label=self.progress_label())
+                verify_output(self, self.partial_output, counting)
+                commit_output(self.partial_output, self.final_output)
+            self.finish()
+            return True
+        except BaseException as e:
+            discard(self.partial_output)
+            self.status, self.reason = "Failed", str(e) or e.__class__.__name__
+            if not isinstance(e, Exception):
+                raise
+            return False
+
+    async def execute_async(self, runner):
+        if not await self.is_valid_async(runner):
+            return False
+        for stage in self.stages():
+            if not await self.run_stage_async(stage, runner):
+                self.fail_from_stage(stage)
+                return False
+        self.partial_output = None
+        counting = None
+        try:
+            # A prepared audio stream's cache check hashes the whole WAV; keep it off the event loop
+            cached = await asyncio.get_running_loop().run_in_executor(None, self.is_cached)
+            if not cached:
+                counting = start_counting_async(self, runner)
+                args = self.partial_ffmpeg_args()
+                await runner.run(args, label=self.progress_label(), timeout=self.timeout,
+                                 threaded=self.threaded)
+                await verify_output_async(self, self.partial_output, counting, runner)
+                commit_output(self.partial_output, self.final_output)
+            self.finish()
+            return True
+        except BaseException as e:
+            # Also reached on task cancellation, which must propagate
+            if counting is not None:
+                counting.cancel()
+            discard(self.partial_output)
+            self.status, self.reason = "Failed", str(e) or e.__class__.__name__
+            if not isinstance(e, Exception):
+                raise
+            return False
+
+
+def command_from_spec(spec):
+    command_class = COMMANDS[spec['command']]
+    command = command_class(*spec.get('args', []), **spec.get('kwargs', {}))
+    if spec.get('timeout') is not None:
+        command.timeout = spec['timeout']
+    return command
+
+
+class RemuxCommand(FfmpegCommand):
+    verify_streams = ('video', 'audio')
 
     def __init__(self, file_path, delete_source_files=False, move_to_folder=None):
         self.file_path = file_path
@@ -31,30 +269,197 @@ class RemuxCommand(Command):
             return False
         return True
 
-    def execute(self):
-        if not self.is_valid():
+    def cache_inputs(self):
+        return [self.file_path]
+
+    def planned_output_path(self):
+        self.output_path = self.file_path.rsplit('.', 1)[0] + '.mp4'
+        return self.output_path
+
+    def ffmpeg_args(self):
+        return ['ffmpeg', '-i', self.file_path, '-c', 'copy', self.planned_output_path()]
+
+    def finish(self):
+        if self.delete_source_files:
+            os.remove(self.file_path)
+
+        else:
+            if self.move_to_folder is not None:
+                original_folder = os.path.join(
+                    os.path.dirname(self.file_path), self.move_to_folder)
+                os.makedirs(original_folder, exist_ok=True)
+                os.rename(self.file_path, os.path.join(
+                    original_folder, os.path.basename(self.file_path)))
+
+        self.status = "Success"
+
+
+PART_PATTERN = re.compile(r"^(?P<prefix>.+?)_Part(?P<number>\d+)-")
+# Stream properties that must be equal for the concat demuxer to copy parts back to back
+JOIN_FIELDS = ('video_codec', 'width', 'height', 'time_base', 'fps', 'pix_fmt',
+               'audio_codec', 'sample_rate', 'channels')
+VIDEO_ENCODERS = {'h264': 'libx264', 'hevc': 'libx265', 'mpeg4': 'mpeg4'}
+AUDIO_ENCODERS = {'aac': 'aac', 'mp3': 'libmp3lame', 'opus': 'libopus', 'ac3': 'ac3'}
+
+
+def group_parts(paths):
+    """
+    Groups files named <prefix>_Part<n>-... by folder and prefix.
+    Returns ({(folder, prefix): [paths ordered by part number]}, [paths that are not parts]).
+    """
+    groups, others = {}, []
+    for path in paths:
+        match = PART_PATTERN.match(os.path.basename(path))
+        if match is None:
+            others.append(path)
+            continue
+        key = (os.path.dirname(os.path.abspath(path)), match.group('prefix'))
+        groups.setdefault(key, []).append((int(match.group('number')), path))
+    return {key: [path for _, path in sorted(parts)] for key, parts in groups.items()}, others
+
+
+def join_mismatches(reference, info):
+    mismatches = []
+    for field in JOIN_FIELDS:
+        expected, actual = reference.get(field), info.get(field)
+        if field == 'fps' and expected and actual:
+            expected, actual = round(expected, 2), round(actual, 2)
+        if field == 'pix_fmt' and (expected is None or actual is None):
+            continue  # not known from the container header
+        if expected != actual:
+            mismatches.append(f"{field} {actual} != {expected}")
+    return mismatches
+
+
+class ConformPartCommand(FfmpegCommand):
+    threaded = True
+    # Leftover from an interrupted join
+    overwrite_output = True
+
+    def __init__(self, video_path, output_path, reference, mismatches=()):
+        """
+        Re-encodes one part to the stream properties of the reference part so it can be concatenated.
+        :param reference: probe_media() result of the reference part.
+        :param mismatches: The properties that differ, for the progress message.
+        """
+        self.video_path = video_path
+        self.output_path = output_path
+        self.reference = reference
+        self.mismatches = list(mismatches)
+        self.status = "Initialized"
+        self.reason = None
+
+    def is_valid(self):
+        reference = self.reference
+        if reference['video_codec'] not in VIDEO_ENCODERS:
+            self.status, self.reason = "Failed", f"Cannot encode {reference['video_codec']} to match the other parts"
             return False
-        try:
-            self.output_path = self.file_path.rsplit('.', 1)[0] + '.mp4'
-            subprocess.run(['ffmpeg', '-i', self.file_path, '-c',
-                           'copy', self.output_path], check=True)
+        if reference['audio_codec'] is not None and reference['audio_codec'] not in AUDIO_ENCODERS:
+            self.status, self.reason = "Failed", f"Cannot encode {reference['audio_codec']} to match the other parts"
+            return False
+        print(f"Re-encoding {os.path.basename(self.video_path)} to match: {', '.join(self.mismatches)}")
+        return True
 
-            if self.delete_source_files:
-                os.remove(self.file_path)
+    def ffmpeg_args(self):
+        os.makedirs(os.path.dirname(self.output_path), exist_ok=True)
+        reference = self.reference
+        width, height = reference['width'], reference['height']
+        timescale = reference['time_base'].split('/')[1] if reference['time_base'] else '90000'
+        args = ['ffmpeg', '-i', self.video_path,
+                '-vf', f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+                       f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,fps={reference['fps']:.6g}",
+                '-c:v', VIDEO_ENCODERS[reference['video_codec']], '-crf', '18', '-preset', 'slow',
+                '-pix_fmt', reference['pix_fmt'] or 'yuv420p',
+                '-video_track_timescale', timescale]
+        if reference['audio_codec'] is None:
+            args += ['-an']
+        else:
+            args += ['-c:a', AUDIO_ENCODERS[reference['audio_codec']],
+                     '-ar', str(reference['sample_rate']), '-ac', str(reference['channels'])]
+        return args + [self.output_path]
 
-            else:
-                if self.move_to_folder is not None:
-                    original_folder = os.path.join(
-                        os.path.dirname(self.file_path), self.move_to_folder)
-                    os.makedirs(original_folder, exist_ok=True)
-                    os.rename(self.file_path, os.path.join(
-                        original_folder, os.path.basename(self.file_path)))
+    def finish(self):
+        self.status = "Success"
 
-            self.status = "Success"
-            return True
-        except Exception as e:
-            self.status, self.reason = "Failed", str(e)
+
+class JoinPartsCommand(FfmpegCommand):
+    verify_streams = ('video', 'audio')
+
+    def __init__(self, part_paths, output_path=None, output_folder="joined"):
+        """
+        Joins the parts of a recording (<prefix>_Part1-..., <prefix>_Part2-...) with the
+        concat demuxer as a stream copy. Parts whose codec, resolution, frame rate,
+        timebase or audio layout differ from the first part are re-encoded to match first.
+        :param part_paths: Paths of the parts in order.
+        :param output_path: Joined file, by default <output_folder>/<prefix>.<ext> beside the parts.
+        """
+        self.part_paths = list(part_paths)
+        self.video_path = self.part_paths[0]
+        match = PART_PATTERN.match(os.path.basename(self.video_path))
+        prefix = match.group('prefix') if match else os.path.basename(self.video_path).rsplit('.', 1)[0]
+        self.output_path = os.path.join(os.path.dirname(self.video_path), output_folder,
+                                        prefix + os.path.splitext(self.video_path)[1]) if output_path is None else output_path
+        self.conform_stages = []
+        self.inputs = list(self.part_paths)
+        self.status = "Initialized"
+        self.reason = None
+
+    def is_valid(self):
+        if len(self.part_paths) < 2:
+            self.status, self.reason = "Failed", f"Nothing to join for {self.video_path}"
+            return False
+        for path in self.part_paths:
+            if not os.path.isfile(path):
+                self.status, self.reason = "Failed", f"File not found: {path}"
+                return False
+        numbers = [int(match.group('number')) for match in
+                   (PART_PATTERN.match(os.path.basename(path)) for path in self.part_paths) if match]
+        missing = sorted(set(range(min(numbers), max(numbers) + 1)) - set(numbers)) if numbers else []
+        if missing:
+            self.status, self.reason = "Failed", f"Missing part {missing[0]} of {os.path.basename(self.video_path)}"
             return False
+        infos = [probe_media(path) for path in self.part_paths]
+        reference = infos[0]
+        work_folder = os.path.join(os.path.dirname(self.output_path), ".conformed")
+        self.conform_stages = []
+        self.inputs = []
+        for path, info in zip(self.part_paths, infos):
+            mismatches = join_mismatches(reference, info)
+            if not mismatches:
+                self.inputs.append(path)
+                continue
+            stage = ConformPartCommand(path, os.path.join(work_folder, os.path.basename(path)), reference,
+                                       mismatches)
+            self.conform_stages.append(stage)
+            self.inputs.append(stage.output_path)
+        return True
+
+    def stages(self):
+        return self.conform_stages
+
+    def cache_inputs(self):
+        return self.part_paths
+
+    def verify_sources(self):
+        # What the concat reads: conformed parts have their new frame rate and audio codec
+        return self.inputs
+
+    def ffmpeg_args(self):
+        os.makedirs(os.path.dirname(self.output_path), exist_ok=True)
+        self.list_path = self.output_path.rsplit('.', 1)[0] + ".concat.txt"
+        with open(self.list_path, 'w') as f:
+            for path in self.inputs:
+                escaped = os.path.abspath(path).replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        return ['ffmpeg', '-f', 'concat', '-safe', '0', '-i', self.list_path,
+                '-map', '0', '-c', 'copy', self.output_path]
+
+    def finish(self):
+        discard(getattr(self, 'list_path', None))
+        for stage in self.conform_stages:
+            discard(stage.output_path)
+        print(f"Joined {len(self.part_paths)} parts into {self.output_path}")
+        self.status = "Success"
 
 
 class CorrectNameCommand(Command):
@@ -73,10 +478,14 @@ class CorrectNameCommand(Command):
         if not self.is_valid():
             return False
         try:
+            renamer = BulkRenamer()
+            plan = renamer.plan([self.file_path])
+            if plan.conflicts:
+                _, target, reason = plan.conflicts[0]
+                self.status, self.reason = "Failed", f"Cannot rename to {target}: {reason}"
+                return False
             new_name = self.file_path
-            if "Copy of " in self.file_path:
-                new_name = self.file_path.replace("Copy of ", "")
-                os.rename(self.file_path, new_name)
+            for _, new_name in renamer.apply(plan):
                 print(f"Renamed: {self.file_path}")
             self.output_path = new_name
             self.status = "Success"
@@ -86,17 +495,130 @@ class CorrectNameCommand(Command):
             return False
 
 
-class ReplaceAudioCommand(Command):
+def matching_audio_path(video_path, audio_subfolder):
+    return os.path.join(os.path.dirname(video_path), audio_subfolder,
+                        os.path.basename(video_path).rsplit('.', 1)[0] + '.wav')
+
+
+def file_content_hash(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class PrepareAudioCommand(FfmpegCommand):
+    # Jobs and ReplaceAudioCommand stages preparing the same stream take turns on
+    # its output lock; whoever comes second finds it cached or adopts it
+    # Re-encoded, so only the duration is compared
+    verify_streams = ('audio',)
+    AUDIO_CACHE_FOLDER = "prepared_audio"
+    ENCODING = {'filter': 'loudnorm=I=-16:TP=-1', 'sample_rate': '48000', 'codec': 'aac', 'bitrate': '320k'}
+
+    def __init__(self, audio_path, cache_folder=None, encoding=None):
+        """
+        Normalises and encodes a WAV into an AAC stream, cached by WAV content and encoding parameters.
+        :param audio_path: Path to the source WAV file.
+        :param cache_folder: Folder holding prepared streams, by default a subfolder beside the WAV.
+        :param encoding: Overrides for the filter, sample rate, codec and bitrate.
+        """
+        self.file_path = audio_path
+        self.audio_path = audio_path
+        self.cache_folder = cache_folder or os.path.join(os.path.dirname(audio_path), self.AUDIO_CACHE_FOLDER)
+        self.encoding = dict(self.ENCODING, **(encoding or {}))
+        self.output_path = None
+        self.status = "Initialized"
+        self.reason = None
+
+    def is_valid(self):
+        if not os.path.isfile(self.audio_path):
+            self.status, self.reason = "Failed", f"File not found: {self.audio_path}"
+            return False
+        if not self.audio_path.lower().endswith('.wav'):
+            self.status, self.reason = "Failed", f"Invalid audio file type: {self.audio_path.rsplit('.', 1)[1]}"
+            return False
+        return True
+
+    def content_hash(self):
+        # Hashing a long WAV takes a while, so remember it per size and mtime
+        os.makedirs(self.cache_folder, exist_ok=True)
+        index_path = os.path.join(self.cache_folder, "index.json")
+        stat = os.stat(self.audio_path)
+        index_key = f"{os.path.abspath(self.audio_path)}|{stat.st_size}|{int(stat.st_mtime)}"
+        index = {}
+        if os.path.exists(index_path):
+            try:
+                with open(index_path, 'r') as f:
+                    index = json.load(f)
+            except ValueError:
+                index = {}
+        if index_key in index:
+            return index[index_key]
+        digest = file_content_hash(self.audio_path)
+        # Other runs add their WAVs to the same index
+        update_json(index_path, lambda index: index.update({index_key: digest}))
+        return digest
+
+    def cache_key(self):
+        params = json.dumps(self.encoding, sort_keys=True)
+        return hashlib.sha256((self.content_hash() + params).encode()).hexdigest()[:32]
+
+    def resolve_output_path(self):
+        if self.output_path is None:
+            self.output_path = os.path.join(self.cache_folder, self.cache_key() + ".m4a")
+        return self.output_path
+
+    def is_cached(self):
+        return os.path.isfile(self.resolve_output_path())
+
+    def output_paths(self):
+        return [self.resolve_output_path()]
+
+    def dry_run_outputs(self):
+        # The name is a hash of the WAV's content, which isn't worth reading for a dry run
+        return [self.output_path or os.path.join(self.cache_folder, "<content hash>.m4a")]
 
-    def __init__(self, video_path, audio_path, auto_match_audio=False, audio_subfolder=None, move_old_mp4=None):
+    def ffmpeg_args(self):
+        return ['ffmpeg',
+                '-i', self.audio_path,
+                '-vn',
+                '-af', self.encoding['filter'],
+                '-ar', self.encoding['sample_rate'],
+                '-c:a', self.encoding['codec'],
+                '-b:a', self.encoding['bitrate'],
+                self.resolve_output_path()]
+
+
+class ReplaceAudioCommand(FfmpegCommand):
+    # The audio is new; -shortest may cut the video by as much as the lengths may differ
+    verify_streams = ('video',)
+
+    def __init__(self, video_path, audio_path, auto_match_audio=False, audio_subfolder=None, move_old_mp4=None,
+                 prepare_audio=True, sync_check=True, max_offset=MAX_OFFSET, min_confidence=MIN_CONFIDENCE):
+        """
+        :param sync_check: Align the WAV against the video's own audio before muxing,
+            rejecting a different take and compensating an offset. Videos without
+            audio fall back to comparing durations.
+        :param max_offset: Largest offset in seconds that is searched for and compensated.
+        :param min_confidence: Lowest correlation accepted as the same recording.
+        """
         self.video_path = video_path
+        if audio_path is None and auto_match_audio and audio_subfolder is not None:
+            audio_path = matching_audio_path(video_path, audio_subfolder)
         self.audio_path = audio_path
         self.output_path = None
         self.move_old_mp4 = move_old_mp4
+        # Encode the audio in its own cacheable stage so the mux is a stream copy
+        self.audio_stage = PrepareAudioCommand(audio_path) if prepare_audio and audio_path else None
+        self.sync_check = sync_check
+        self.max_offset = max_offset
+        self.min_confidence = min_confidence
+        self.audio_offset = 0.0
         self.status = "Initialized"
         self.reason = None
 
-    def is_valid(self):
+    def validate_files(self):
         if not os.path.isfile(self.video_path):
             self.status, self.reason = "Failed", f"Video file not found: {self.video_path}"
             return False
@@ -105,7 +627,7 @@ class ReplaceAudioCommand(Command):
             self.status, self.reason = "Failed", f"Invalid video file type: {self.video_path.rsplit('.', 1)[1]}"
             return False
 
-        if not os.path.isfile(self.audio_path):
+        if self.audio_path is None or not os.path.isfile(self.audio_path):
             self.status, self.reason = "Failed", f"File not found: {self.audio_path}"
             return False
 
@@ -113,65 +635,258 @@ class ReplaceAudioCommand(Command):
             self.status, self.reason = "Failed", f"Invalid audio file type: {self.audio_path.rsplit('.', 1)[1]}"
             return False
 
-        video_length = float(subprocess.check_output(['ffprobe', '-v', 'error', '-show_entries',
-                                                      'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1',
-                                                      self.video_path]))
+        return True
+
+    def length_tolerance(self):
+        # With the sync check an offset up to max_offset is found and compensated later
+        return self.max_offset if self.sync_check else 1
 
-        audio_length = float(subprocess.check_output(['ffprobe', '-v', 'error', '-show_entries',
-                                                      'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1',
-                                                      self.audio_path]))
+    def verify_tolerance(self):
+        return self.length_tolerance() + VERIFY_TOLERANCE
 
-        if abs(video_length - audio_length) > 1:
+    def check_lengths(self, video_length, audio_length, tolerance=None):
+        if tolerance is None:
+            tolerance = self.length_tolerance()
+        if abs(video_length - audio_length) > tolerance:
             self.status, self.reason = "Failed", f"Video and audio length mismatch: {video_length} vs {audio_length}"
             return False
+        return True
 
+    def is_valid(self):
+        if not self.validate_files():
+            return False
+
+        # Header reads for WAV/MP4, ffprobe for anything else
+        try:
+            video_length = probe_duration(self.video_path)
+            audio_length = probe_duration(self.audio_path)
+        except Exception as e:
+            self.status, self.reason = "Failed", str(e)
+            return False
+        if video_length is None or audio_length is None:
+            self.status, self.reason = "Failed", "Could not determine video or audio length"
+            return False
+
+        return self.check_lengths(video_length, audio_length) and self.check_sync(video_length, audio_length)
+
+    def check_sync(self, video_length, audio_length):
+        if not self.sync_check:
+            return True
+        try:
+            result = measure_offset(self.video_path, self.audio_path, self.max_offset)
+        except Exception as e:
+            self.status, self.reason = "Failed", f"Sync check failed: {e}"
+            return False
+        if result is None:
+            # Nothing to align against, only the durations can be compared
+            return self.check_lengths(video_length, audio_length, tolerance=1)
+        offset, confidence = result
+        if confidence < self.min_confidence:
+            self.status, self.reason = "Failed", \
+                f"Audio does not match the video's recording (confidence {confidence:.2f})"
+            return False
+        self.audio_offset = offset
+        if offset_args(offset):
+            print(f"Compensating audio offset of {offset:+.2f} s for {os.path.basename(self.video_path)}")
         return True
 
+    def stages(self):
+        return [self.audio_stage] if self.audio_stage is not None else []
+
+    def cache_inputs(self):
+        return [self.video_path, self.audio_path]
+
+    def cache_params(self):
+        return {'encoding': PrepareAudioCommand.ENCODING, 'prepared': self.audio_stage is not None,
+                'sync_check': self.sync_check, 'max_offset': self.max_offset}
+
+    def planned_output_path(self):
+        output_folder = os.path.join(
+            os.path.dirname(self.video_path), "ready")
+        self.pending_output_path = os.path.join(output_folder, os.path.basename(
+            self.video_path).rsplit('.', 1)[0] + ".mp4")
+        return self.pending_output_path
+
+    def ffmpeg_args(self):
+        os.makedirs(os.path.dirname(self.planned_output_path()), exist_ok=True)
+        if self.audio_stage is not None:
+            return ['ffmpeg',
+                    '-i', self.video_path,
+                    *offset_args(self.audio_offset),
+                    '-i', self.audio_stage.output_path,
+                    '-map', '0:v:0',
+                    '-map', '1:a:0',
+                    '-c', 'copy',
+                    '-shortest',
+                    self.pending_output_path]
+        return ['ffmpeg',
+                '-i', self.video_path,
+                *offset_args(self.audio_offset),
+                '-i', self.audio_path,
+                '-c:v', 'copy',
+                '-c:a', 'aac',
+                '-ar', '48000',
+                '-ab', '320k',
+                '-af', 'loudnorm=I=-16:TP=-1',
+                '-shortest',
+                self.pending_output_path]
+
+    def finish(self):
+        print(f"Processed: {self.video_path}")
+        if self.move_old_mp4 is not None:
+            print(f"Moving old mp4 to {self.move_old_mp4} folder...")
+            old_folder = os.path.join(os.path.dirname(
+                self.video_path), self.move_old_mp4)
+            os.makedirs(old_folder, exist_ok=True)
+            os.rename(self.video_path, os.path.join(
+                old_folder, os.path.basename(self.video_path)))
+            print(
+                f"\n Moved: {os.path.basename(self.video_path)} successfully.")
+
+        self.output_path = self.pending_output_path
+        self.status = "Success"
+
+    async def is_valid_async(self, runner):
+        if not self.validate_files():
+            return False
+        try:
+            video_length, audio_length = await asyncio.gather(
+                runner.probe_duration(self.video_path), runner.probe_duration(self.audio_path))
+        except Exception as e:
+            self.status, self.reason = "Failed", str(e)
+            return False
+        if not self.check_lengths(video_length, audio_length):
+            return False
+        # Decoding the envelope and the FFT block, keep them off the event loop
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.check_sync, video_length, audio_length)
+
+
+class DeadAirTrimCommand(Command):
+    def __init__(self, video_path, audio_subfolder, output_folder="trimmed", silence_db=SILENCE_DB,
+                 min_dead_air=MIN_DEAD_AIR, padding=PADDING):
+        """
+        Cuts leading and trailing dead air (silent WAV and idle screen) from a
+        recording with stream copies, so later stages process less media.
+        The trimmed video goes to <output_folder>/ and the WAV, trimmed to the
+        same span, to <output_folder>/<audio_subfolder>/, where
+        ReplaceAudioCommand's auto-match finds it.
+        :param video_path: Path to the input video file.
+        :param audio_subfolder: Subfolder holding the matching WAV (e.g. Auphonic results).
+        :param silence_db: RMS level in dBFS below which audio counts as silence.
+        :param min_dead_air: Shorter dead air at either end is left in place.
+        :param padding: Seconds kept before the first and after the last activity.
+        """
+        self.video_path = video_path
+        self.audio_path = matching_audio_path(video_path, audio_subfolder)
+        self.output_path = os.path.join(os.path.dirname(video_path), output_folder,
+                                        os.path.basename(video_path))
+        self.audio_output_path = matching_audio_path(self.output_path, audio_subfolder)
+        self.silence_db = silence_db
+        self.min_dead_air = min_dead_air
+        self.padding = padding
+        self.trim = None
+        self.status = "Initialized"
+        self.reason = None
+
+    def is_valid(self):
+        for path in (self.video_path, self.audio_path):
+            if not os.path.isfile(path):
+                self.status, self.reason = "Failed", f"File not found: {path}"
+                return False
+        return True
+
+    def cache_inputs(self):
+        # Two outputs per run; the artifact store keeps one
+        return None
+
+    def output_paths(self):
+        return [self.output_path, self.audio_output_path]
+
+    def trim_args(self, source, start, duration, output, codec_args):
+        return ['ffmpeg', '-v', 'error', '-ss', f"{start:.3f}", '-i', source, '-t', f"{duration:.3f}",
+                *codec_args, output]
+
     def execute(self):
         if not self.is_valid():
             return False
+        partials = []
         try:
-            output_folder = os.path.join(
-                os.path.dirname(self.video_path), "ready")
-            os.makedirs(output_folder, exist_ok=True)
-            output_path = os.path.join(output_folder, os.path.basename(
-                self.video_path).rsplit('.', 1)[0] + ".mp4")
-            subprocess.run(['ffmpeg',
-                            '-i', self.video_path,
-                            '-i', self.audio_path,
-                            '-c:v', 'copy',
-                            '-c:a', 'aac',
-                            '-ar', '48000',
-                            '-ab', '320k',
-                            '-af', 'loudnorm=I=-16:TP=-1',
-                            '-shortest',
-                            output_path], check=True)
-            print(f"Processed: {self.video_path}")
-            if self.move_old_mp4 is not None:
-                print(f"Moving old mp4 to {self.move_old_mp4} folder...")
-                old_folder = os.path.join(os.path.dirname(
-                    self.video_path), self.move_old_mp4)
-                os.makedirs(old_folder, exist_ok=True)
-                os.rename(self.video_path, os.path.join(
-                    old_folder, os.path.basename(self.video_path)))
-                print(
-                    f"\n Moved: {os.path.basename(self.video_path)} successfully.")
-
-            self.output_path = output_path
+            video_info, audio_info = probe_media(self.video_path), probe_media(self.audio_path)
+            start, end = find_content(self.video_path, self.audio_path, video_info['duration'],
+                                      silence_db=self.silence_db, min_dead_air=self.min_dead_air,
+                                      padding=self.padding)
+            # Stream copies can only start on a keyframe; start at the one before the cut
+            start = keyframe_before(self.video_path, start)
+            self.trim = (start, end)
+            os.makedirs(os.path.dirname(self.audio_output_path), exist_ok=True)
+            if start == 0.0 and end >= video_info['duration']:
+                print(f"No dead air in {os.path.basename(self.video_path)}")
+                for source, output in ((self.video_path, self.output_path), (self.audio_path, self.audio_output_path)):
+                    link_or_copy(source, output)
+            else:
+                print(f"Trimming {os.path.basename(self.video_path)} to {start:.1f}-{end:.1f} s "
+                      f"of {video_info['duration']:.1f} s")
+                # Input seeking with copy snaps to the keyframe; PCM is re-encoded to cut the WAV sample-exactly
+                jobs = [(self.video_path, self.output_path, ['-map', '0', '-c', 'copy', '-avoid_negative_ts', 'make_zero']),
+                        (self.audio_path, self.audio_output_path, ['-c:a', audio_info['audio_codec']])]
+                for source, output, codec_args in jobs:
+                    partials.append(partial_path(output))
+                    run_process(self.trim_args(source, start, end - start, partials[-1], codec_args),
+                                timeout=self.timeout)
+                for partial, (_, output, _) in zip(partials, jobs):
+                    commit_output(partial, output)
             self.status = "Success"
             return True
-        except Exception as e:
-            self.status, self.reason = "Failed", str(e)
+        except BaseException as e:
+            for partial in partials:
+                discard(partial)
+            self.status, self.reason = "Failed", str(e) or e.__class__.__name__
+            if not isinstance(e, Exception):
+                raise
             return False
 
 
+def link_or_copy(source, destination):
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
 class RemoveBlackBarsCommand(Command):
-    def __init__(self, video_path, output_path=None, crop_dimensions=None, export_frames=False):
+    verify_streams = ('video',)
+    # A file without bad frames is cropped and encoded by ffmpeg alone; subclasses
+    # that need every frame in Python turn this off
+    ffmpeg_clean_copy = True
+
+    def __init__(self, video_path, output_path=None, crop_dimensions=None, export_frames=False,
+                 threshold=10, min_bar_width=1, sides=BAR_SIDES, save_edge_stats=False,
+                 frames_format='jpg', contact_sheet=False, luma_analysis=True, analysis_width=None):
         self.video_path = video_path
+        self.frames_format = frames_format
+        self.contact_sheet = contact_sheet
+        self.frame_exporter = None
+        self.threads = None
+        self.threshold = threshold
+        # Bars are measured on every side at once; a frame is bad if a band in `sides`
+        # is at least min_bar_width pixels wide
+        self.min_bar_width = min_bar_width
+        self.sides = tuple(sides)
+        self.bar_detector = BarDetector(threshold)
+        self.geometry = None
+        # Keep per-frame edge statistics beside the source for re-tuning (see edge_stats.py)
+        self.save_edge_stats = save_edge_stats
+        # Detect on the decoder's luma plane (see luma.py), optionally downscaled to
+        # analysis_width, before any frame is decoded in colour
+        self.luma_analysis = luma_analysis
+        self.analysis_width = analysis_width
         self.output_path = os.path.join(os.path.dirname(video_path), "processed_black_bars", os.path.basename(
             video_path).rsplit('.', 1)[0] + ".avi") if output_path is None else output_path
         self.export_frames = export_frames
-        self.frames_folder = self.create_frames_folder()
+        self.frames_folder = None
         self.status = "Initialized"
         self.reason = None
         self.crop_dimensions = crop_dimensions
@@ -183,48 +898,73 @@ class RemoveBlackBarsCommand(Command):
     def add_to_history(self):
         pass
 
+    def cache_inputs(self):
+        return [self.video_path]
+
+    def cache_params(self):
+        return {'crop_dimensions': self.crop_dimensions, 'threshold': self.threshold,
+                'min_bar_width': self.min_bar_width, 'sides': self.sides, 'analysis_width': self.analysis_width}
+
     def create_frames_folder(self):
-        pass
         if self.export_frames:
-            # Extract the filename without extension to create a subfolder
-            os.makedirs(os.path.dirname(self.output_path), exist_ok=True)
+            # Extract the filename without extension to create a subfolder beside the output
             base_name = os.path.splitext(os.path.basename(self.output_path))[0]
-            folder_name = f"{base_name}_frames"
-            if not os.path.exists(folder_name):
-                os.makedirs(folder_name)
+            folder_name = os.path.join(os.path.dirname(self.output_path), f"{base_name}_frames")
+            os.makedirs(folder_name, exist_ok=True)
             return folder_name
 
     def has_black_bar(self, frame):
-        threshold = 10
+        self.geometry = self.bar_detector.measure(frame)
         self.detected = None
-        self.intensity = None
-        if np.any(np.mean(frame[:, :5], axis=(0, 2)) < threshold):
-            self.detected, self.intensity = "left", np.mean(
-                frame[:, :5], axis=(0, 2))
-            return True
-        if np.any(np.mean(frame[:, -5:], axis=(0, 2)) < threshold):
-            self.detected, self.intensity = "right", np.mean(
-                frame[:, -5:], axis=(0, 2))
-            return True
-        if np.any(np.mean(frame[:5, :], axis=(0, 2)) < threshold):
-            self.detected, self.intensity = "top", np.mean(
-                frame[:5, :], axis=(0, 2))
-            return True
+        for side in self.sides:
+            if self.geometry[side] >= self.min_bar_width:
+                self.detected = side
+                return True
         return False
 
-    def save_frame_with_black_bar(self, frame, current_time):
+    def save_frame_with_black_bar(self, frame, current_time, frame_index=None):
         minutes = int(current_time // 60)
         seconds = int(current_time % 60)
         # print(f"Black bar detected at {minutes:02d}:{seconds:02d} on {self.detected} side.")
-        self.detection_log['detection'].append(
-            {'time': f"{minutes:02d}:{seconds:02d}", 'side': self.detected})
-        if self.export_frames:
-            filename = f"{self.frames_folder}/{minutes:02d}-{seconds:02d}.png"
-            cv2.imwrite(filename, frame)
+        entry = {'time': f"{minutes:02d}:{seconds:02d}", 'side': self.detected}
+        if self.geometry is not None:
+            entry['frame'] = frame_index
+            entry['bars'] = {side: self.geometry[side] for side in self.sides if self.geometry[side]}
+        self.detection_log['detection'].append(entry)
+        if self.frame_exporter is not None:
+            # Encoding happens on the exporter's thread, off the decode loop
+            self.frame_exporter.submit(frame_index, current_time, frame)
 
     def execute(self):
         self.status = "Processing"
         print(f"Processing: {self.video_path}")
+        # Write under a temporary name so an interrupted run leaves no truncated AVI behind
+        self.partial_output = partial_path(self.output_path)
+        try:
+            os.makedirs(os.path.dirname(self.output_path), exist_ok=True)
+            with thread_budget.allocation() as threads:
+                self.threads = threads
+                if threads:
+                    cv2.setNumThreads(threads)
+                self.remove_black_bars(deadline_for(self.timeout))
+            return True
+        except BaseException as e:
+            discard(self.partial_output)
+            if self.frame_exporter is not None:
+                try:
+                    self.frame_exporter.close()
+                except Exception:
+                    pass  # keep the reason the command failed with
+                self.frame_exporter = None
+            self.status, self.reason = "Failed", str(e) or e.__class__.__name__
+            print(f"\n {self.reason}")
+            if not isinstance(e, Exception):
+                raise
+            return False
+
+    def remove_black_bars(self, deadline=None):
+        # Counted while the frames are filtered, checked before the output is committed
+        counting = start_counting(self)
         cap = cv2.VideoCapture(self.video_path)
         fps = cap.get(cv2.CAP_PROP_FPS)
         width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
@@ -232,54 +972,178 @@ class RemoveBlackBarsCommand(Command):
         codec = cv2.VideoWriter_fourcc(*'MJPG')
         total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
 
+        self.crop_dimensions = resolve_crop_dimensions(
+            self.video_path, self.crop_dimensions)
         left, top, right, bottom = self.crop_dimensions if self.crop_dimensions else (
-            0, height, 0, width)
+            0, 0, width, height)
 
-        out = cv2.VideoWriter(self.output_path, codec,
-                              fps, (right-left, bottom-top))
+        # Cached edge statistics turn detection into a lookup; otherwise detect on
+        # luma first, or measure (and optionally record) while decoding in colour
+        recorder, cached = None, None
+        stats, _ = load_edge_stats(self.video_path, (left, top, right, bottom),
+                                   self.bar_detector.sample_lines)
+        if stats is not None and stats.shape[0] > 0 and self.min_bar_width <= stats.shape[2]:
+            cached = detect_from_stats(stats, self.threshold, self.min_bar_width, self.sides)
+        elif self.luma_analysis and self.ffmpeg_clean_copy and not self.save_edge_stats:
+            # Only worth a decode when a clean file can skip the colour loop
+            try:
+                cached = self.detect_from_luma((left, top, right, bottom), deadline)
+            except (OSError, subprocess.CalledProcessError) as e:
+                # No usable ffmpeg: detect on the colour frames instead
+                print(f"Luma analysis unavailable ({e}), detecting on colour frames")
+        if self.ffmpeg_clean_copy and cached is not None and len(cached[0]) and not cached[0][1:].any():
+            # Nothing to repair (frame 0 never is): no frame needs decoding in colour here
+            cap.release()
+            self.copy_clean((left, top, right, bottom), deadline)
+            self.finish(counting)
+            return
+
+        out = self.open_writer(codec, fps, (left, top, right, bottom))
+        if not out.isOpened():
+            cap.release()
+            out.release()
+            raise ValueError(f"Could not open a video writer for {self.partial_output}")
 
         success, frame = cap.read()
         if not success:
             cap.release()
             out.release()
-            return
+            raise ValueError(f"Could not read frames from {self.video_path}")
 
         # Initialize the last good frame with the first frame
         last_good_frame = frame[top:bottom, left:right]
-        frame_count = 1  # Initialize frame count to handle timecode calculations
+        if cached is None and self.save_edge_stats:
+            recorder = EdgeStatsRecorder(self.video_path, fps, (left, top, right, bottom),
+                                         sample_lines=self.bar_detector.sample_lines)
+            recorder.add(last_good_frame)
+        if self.export_frames:
+            self.frames_folder = self.create_frames_folder()
+            self.frame_exporter = FrameExporter(self.frames_folder, image_format=self.frames_format,
+                                                contact_sheet=self.contact_sheet)
+        laps = profiling.laps(self.__class__.__name__)
+        laps.start()
+
+        try:
+            self.filter_frames(cap, out, fps, total_frames, (left, top, right, bottom), last_good_frame,
+                               recorder, cached, laps, deadline)
+        finally:
+            cap.release()
+            out.release()
+        laps.close()
+        if recorder is not None:
+            recorder.save()
+        if self.frame_exporter is not None:
+            self.frame_exporter.close()
+            self.frame_exporter = None
+        self.finish(counting)
+
+    def finish(self, counting):
+        verify_output(self, self.partial_output, counting)
+        commit_output(self.partial_output, self.output_path)
+        self.status = "Success"
+        detection_log_path = os.path.join(os.path.dirname(self.output_path), 'detection_logs',
+                                          self.output_path.rsplit('.', 1)[0] + ".json")
+        with profiling.span("detection log json.dump"):
+            with open(detection_log_path, 'w') as f:
+                json.dump(self.detection_log, f, indent=4)
+        # self.combine_audio()
 
+    def detect_from_luma(self, crop, deadline=None):
+        """
+        Measures the bars of every frame on its luma plane, cropped and
+        optionally downscaled by ffmpeg, up to the first frame that needs
+        repair. Returns (flags, side_index, widths) for the frames analysed,
+        like edge_stats.detect_from_stats, with widths in source pixels.
+        """
+        left, top, right, bottom = crop
+        width, height = right - left, bottom - top
+        analysis_width = min(self.analysis_width or width, width)
+        scale = width / analysis_width
+        analysis_height = height if scale == 1 else max(2, int(round(height / scale / 2)) * 2)
+        flags, side_index, widths = [], [], []
+        print(f"Analysing luma: {os.path.basename(self.video_path)}")
+        with profiling.span("luma analysis", file=os.path.basename(self.video_path)):
+            with LumaReader(self.video_path, analysis_width, analysis_height, crop,
+                            threads=self.threads) as reader:
+                for frame_index, frame in enumerate(reader):
+                    if frame_index % CANCEL_CHECK_FRAMES == 0:
+                        check(deadline, os.path.basename(self.video_path))
+                    geometry = self.bar_detector.measure(frame)
+                    row = [int(round(geometry[side] * scale)) for side in self.sides]
+                    tripped = [side_width >= self.min_bar_width for side_width in row]
+                    flags.append(any(tripped))
+                    side_index.append(tripped.index(True) if any(tripped) else -1)
+                    widths.append(row)
+                    if frame_index > 0 and flags[-1]:
+                        # The colour loop runs anyway and measures the rest itself, so
+                        # the extra decode stops at the first bad frame
+                        break
+        return (np.array(flags, dtype=bool), np.array(side_index, dtype=np.intp),
+                np.array(widths, dtype=np.int32).reshape(-1, len(self.sides)))
+
+    def copy_clean(self, crop, deadline=None):
+        # The same MJPEG AVI the OpenCV writer would produce, one output frame per decoded frame
+        left, top, right, bottom = crop
+        args = ['ffmpeg', '-v', 'error', '-y', '-i', self.video_path, '-map', '0:v:0',
+                '-vf', f"crop={right - left}:{bottom - top}:{left}:{top}", '-fps_mode', 'passthrough',
+                '-c:v', 'mjpeg', '-q:v', '2', '-an', self.partial_output]
+        with profiling.span("ffmpeg clean copy", file=os.path.basename(self.video_path)):
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0.001)
+            run_process(with_threads(args, self.threads), timeout, "ffmpeg")
+
+    def open_writer(self, codec, fps, frame_box):
+        left, top, right, bottom = frame_box
+        return cv2.VideoWriter(self.partial_output, codec, fps, (right-left, bottom-top))
+
+    def filter_frames(self, cap, out, fps, total_frames, crop, last_good_frame, recorder,
+                      cached, laps, deadline=None):
+        left, top, right, bottom = crop
+        frame_count = 1  # Frame 0 seeded the last good frame
         while True:
+            if frame_count % CANCEL_CHECK_FRAMES == 0:
+                check(deadline, os.path.basename(self.video_path))
+                if self.threads:
+                    # Follow the budget as other jobs start and finish
+                    cv2.setNumThreads(thread_budget.current_share(self.threads))
             success, frame = cap.read()
+            laps("cap.read")
             if not success:
                 break
 
             frame = frame[top:bottom, left:right]  # Crop the frame
 
-            if self.has_black_bar(frame):
+            if recorder is not None:
+                recorder.add(frame)
+            if cached is not None and frame_count < len(cached[0]):
+                flags, side_index, widths = cached
+                black_bar = bool(flags[frame_count])
+                self.detected = self.sides[side_index[frame_count]] if black_bar else None
+                self.geometry = dict(zip(self.sides, widths[frame_count].tolist()))
+            else:
+                black_bar = self.has_black_bar(frame)
+
+            if black_bar:
+                laps("has_black_bar")
                 # If the current frame has a black bar, replace it with the last good frame
                 out.write(last_good_frame)
+                laps("out.write")
                 current_time = frame_count / fps
-                self.save_frame_with_black_bar(frame, current_time)
+                self.save_frame_with_black_bar(frame, current_time, frame_count)
+                laps("save_frame")
             else:
+                laps("has_black_bar")
                 # Update the last good frame and write it to the output
                 last_good_frame = frame
                 out.write(frame)
+                laps("out.write")
 
             frame_count += 1  # Increment frame count after processing each frame
             # print progress in percentage in the console in the same line
             progress = frame_count * 100 / total_frames
             print(f"\r Processing: {progress:.2f}%", end="")
+            laps("progress")
         print("\n")
 
-        cap.release()
-        out.release()
-        self.status = "Success"
-        detection_log_path = os.path.join(os.path.dirname(self.output_path), 'detection_logs',
-                                          self.output_path.rsplit('.', 1)[0] + ".json")
-        with open(detection_log_path, 'w') as f:
-            json.dump(self.detection_log, f, indent=4)
-        # self.combine_audio()
-
     def combine_audio(self):
         original_clip = VideoFileClip(self.video_path)
         if self.crop_dimensions:
@@ -292,13 +1156,69 @@ class RemoveBlackBarsCommand(Command):
                                    audio_codec='aac', rewrite_audio=False, remove_temp=True, threads=8)
 
 
+class FanOutCommand(RemoveBlackBarsCommand):
+    # The sinks are fed from the colour loop, so it always runs
+    ffmpeg_clean_copy = False
+
+    def __init__(self, video_path, sinks, output_path=None, crop_dimensions=None, **kwargs):
+        """
+        Removes black bars like RemoveBlackBarsCommand and, from the same decode,
+        encodes the repaired frames into further outputs (a cropped master, a
+        review proxy, ...). N outputs cost one decode plus N encodes.
+        :param video_path: Path to the input video file.
+        :param sinks: List of FrameSink keyword dicts, e.g. {'output_path': ..., 'crop': "auto"}
+            or {'output_path': ..., 'width': 640, 'crf': '30', 'preset': 'veryfast'}.
+        Remaining arguments are those of RemoveBlackBarsCommand.
+        """
+        super().__init__(video_path, output_path=output_path, crop_dimensions=crop_dimensions, **kwargs)
+        self.sinks = [dict(sink) for sink in sinks]
+        self.frame_sinks = []
+
+    def cache_inputs(self):
+        # Several outputs per run; the artifact store keeps one
+        return None
+
+    def output_paths(self):
+        return super().output_paths() + [sink['output_path'] for sink in self.sinks]
+
+    def open_writer(self, codec, fps, frame_box):
+        primary = super().open_writer(codec, fps, frame_box)
+        self.frame_sinks = [FrameSink(**sink) for sink in self.sinks]
+        for sink in self.frame_sinks:
+            if self.threads:
+                # The encoders split this job's share
+                sink.threads = max(1, self.threads // len(self.frame_sinks))
+            if sink.crop is not None:
+                sink.crop = resolve_crop_dimensions(self.video_path, sink.crop)
+            sink.open(frame_box, fps, self.video_path)
+        return FanOutWriter(primary, self.frame_sinks)
+
+    def execute(self):
+        try:
+            super().execute()
+        except BaseException:
+            for sink in self.frame_sinks:
+                sink.abort()
+            raise
+        errors = [sink.error for sink in self.frame_sinks if sink.error]
+        if self.status == "Success" and not errors:
+            for sink in self.frame_sinks:
+                sink.commit()
+            return True
+        for sink in self.frame_sinks:
+            sink.abort()
+        if errors:
+            self.status, self.reason = "Failed", "; ".join(errors)
+        return False
+
+
 class VideoCropperCommand(Command):
     def __init__(self, video_path, output_path, crop_dimensions):
         """
         Initializes the VideoCropper class with the input video path, output video path, and crop dimensions.
         :param video_path: Path to the input video file.
         :param output_path: Path where the cropped video will be saved.
-        :param crop_dimensions: A tuple of (x1, y1, x2, y2) representing the crop area.
+        :param crop_dimensions: A tuple of (x1, y1, x2, y2) representing the crop area, or "auto" to detect it.
         """
         self.video_path = video_path
         self.output_path = os.path.join(os.path.dirname(video_path), "cropped", os.path.basename(
@@ -310,6 +1230,12 @@ class VideoCropperCommand(Command):
     def add_to_history(self):
         pass
 
+    def cache_inputs(self):
+        return [self.video_path]
+
+    def cache_params(self):
+        return {'crop_dimensions': self.crop_dimensions}
+
     def execute(self):
         """
         Crops the video based on the specified dimensions and saves the output.
@@ -318,7 +1244,8 @@ class VideoCropperCommand(Command):
         clip = VideoFileClip(self.video_path)
 
         # Crop the video
-        x1, y1, x2, y2 = self.crop_dimensions
+        x1, y1, x2, y2 = resolve_crop_dimensions(
+            self.video_path, self.crop_dimensions)
         cropped_clip = clip.crop(x1=x1, y1=y1, x2=x2, y2=y2)
 
         # Get the audio from the original video
@@ -327,17 +1254,28 @@ class VideoCropperCommand(Command):
         # Create the output folder if it doesn't exist
         os.makedirs(os.path.dirname(self.output_path), exist_ok=True)
 
-        # Write the output video file
-        final_clip.write_videofile(self.output_path, codec='libx264', audio=True, audio_fps=48000, preset='slow',
-                                   audio_codec='aac', rewrite_audio=False, remove_temp=True, threads=8)
+        # Write the output video file under a temporary name, renamed once complete
+        partial = partial_path(self.output_path)
+        try:
+            with thread_budget.allocation() as threads:
+                final_clip.write_videofile(partial, codec='libx264', audio=True, audio_fps=48000, preset='slow',
+                                           audio_codec='aac', rewrite_audio=False, remove_temp=True,
+                                           threads=threads or 8)
+            commit_output(partial, self.output_path)
+        except BaseException:
+            discard(partial)
+            raise
+        finally:
+            clip.close()
 
 
-class AVItoMP4Command(Command):
+class AVItoMP4Command(FfmpegCommand):
+    threaded = True
+    verify_streams = ('video', 'audio')
+
     def __init__(self, video_path, output_path=None, move_old_avi='avi_old'):
         self.video_path = video_path
         self.move_old_avi = move_old_avi
-        os.makedirs(os.path.join(os.path.dirname(
-            video_path), "converted"), exist_ok=True)
         self.output_path = os.path.join(os.path.dirname(video_path), "converted",
                                         os.path.basename(video_path).rsplit('.', 1)[0] + ".mp4") if output_path is None else output_path
         self.status = "Initialized"
@@ -352,25 +1290,32 @@ class AVItoMP4Command(Command):
             return False
         return True
 
-    def execute(self):
-        if not self.is_valid():
-            return False
-        try:
-            subprocess.run(['ffmpeg',
-                            '-i', self.video_path,
-                            '-c:v', 'libx264',
-                            '-crf', '18',
-                            '-preset', 'slow',
-                            '-c:a', 'copy',
-                            self.output_path], check=True)
-            if self.move_old_avi is not None:
-                old_folder = os.path.join(os.path.dirname(
-                    self.video_path), self.move_old_avi)
-                os.makedirs(old_folder, exist_ok=True)
-                os.rename(self.video_path, os.path.join(
-                    old_folder, os.path.basename(self.video_path)))
-            self.status = "Success"
-            return True
-        except Exception as e:
-            self.status, self.reason = "Failed", str(e)
-            return False
+    def cache_inputs(self):
+        return [self.video_path]
+
+    def cache_params(self):
+        return {'crf': '18', 'preset': 'slow'}
+
+    def ffmpeg_args(self):
+        os.makedirs(os.path.dirname(self.output_path), exist_ok=True)
+        return ['ffmpeg',
+                '-i', self.video_path,
+                '-c:v', 'libx264',
+                '-crf', '18',
+                '-preset', 'slow',
+                '-c:a', 'copy',
+                self.output_path]
+
+    def finish(self):
+        if self.move_old_avi is not None:
+            old_folder = os.path.join(os.path.dirname(
+                self.video_path), self.move_old_avi)
+            os.makedirs(old_folder, exist_ok=True)
+            os.rename(self.video_path, os.path.join(
+                old_folder, os.path.basename(self.video_path)))
+        self.status = "Success"
+
+
+COMMANDS = {command_class.__name__: command_class for command_class in (
+    RemuxCommand, JoinPartsCommand, CorrectNameCommand, PrepareAudioCommand, ReplaceAudioCommand, DeadAirTrimCommand,
+    RemoveBlackBarsCommand, FanOutCommand, VideoCropperCommand, AVItoMP4Command)}
@@ -0,0 +1,234 @@
+# container_headers.py
+#
+# In-process readers for the containers we see most: WAV (RIFF/RF64) and
+# MP4/MOV. They seek through the chunk/box headers and read only the few
+# small structures holding duration, timescale and stream parameters, so
+# getting metadata costs microseconds instead of an ffprobe process.
+# read_header() returns None for anything it can't answer confidently, and
+# callers fall back to ffprobe.
+import os
+import struct
+
+MP4_FORMAT_NAME = "mov,mp4,m4a,3gp,3g2,mj2"
+MP4_TOP_LEVEL = (b'ftyp', b'moov', b'mdat', b'free', b'wide', b'skip')
+
+# Sample entry fourcc -> ffprobe codec_name
+MP4_CODECS = {
+    b'avc1': 'h264', b'avc3': 'h264', b'hvc1': 'hevc', b'hev1': 'hevc', b'av01': 'av1',
+    b'vp09': 'vp9', b'mp4v': 'mpeg4', b'mjpa': 'mjpeg', b'jpeg': 'mjpeg',
+    b'mp4a': 'aac', b'ac-3': 'ac3', b'ec-3': 'eac3', b'Opus': 'opus', b'alac': 'alac',
+    b'sowt': 'pcm_s16le', b'twos': 'pcm_s16be',
+}
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+def _empty_info(path, size, format_name):
+    return {'path': path, 'size': size, 'duration': None, 'format': format_name, 'bit_rate': None,
+            'video_codec': None, 'width': None, 'height': None, 'fps': None,
+            'time_base': None, 'pix_fmt': None,
+            'audio_codec': None, 'sample_rate': None, 'channels': None}
+
+
+def _wav_codec(audio_format, bits):
+    if audio_format == WAVE_FORMAT_PCM:
+        return 'pcm_u8' if bits == 8 else f"pcm_s{bits}le"
+    if audio_format == WAVE_FORMAT_IEEE_FLOAT:
+        return f"pcm_f{bits}le"
+    return None
+
+
+def _wav_layout(f, size):
+    # Returns ((format, channels, sample_rate, byte_rate, block_align, bits), data_offset, data_size)
+    riff, _, wave = struct.unpack('<4sI4s', f.read(12))
+    if riff not in (b'RIFF', b'RF64') or wave != b'WAVE':
+        return None
+    fmt, data_size, ds64_data_size = None, None, None
+    position = 12
+    while position + 8 <= size:
+        f.seek(position)
+        chunk_id, chunk_size = struct.unpack('<4sI', f.read(8))
+        if chunk_id == b'ds64':
+            # RF64: the real sizes of files over 4 GB
+            _, ds64_data_size = struct.unpack('<QQ', f.read(16))
+        elif chunk_id == b'fmt ':
+            fmt = struct.unpack('<HHIIHH', f.read(16))
+            if fmt[0] == WAVE_FORMAT_EXTENSIBLE and chunk_size >= 40:
+                f.seek(position + 8 + 24)
+                fmt = (struct.unpack('<H', f.read(2))[0],) + fmt[1:]
+        elif chunk_id == b'data':
+            data_size = ds64_data_size if chunk_size == 0xFFFFFFFF and ds64_data_size else chunk_size
+            # Recorders that never finalised the header leave a size past the end of the file
+            data_size = min(data_size, size - position - 8)
+            break
+        position += 8 + chunk_size + (chunk_size & 1)
+    if fmt is None or data_size is None:
+        return None
+    return fmt, position + 8, data_size
+
+
+def read_wav_header(f, path, size):
+    layout = _wav_layout(f, size)
+    if layout is None:
+        return None
+    (audio_format, channels, sample_rate, byte_rate, _, bits), _, data_size = layout
+    codec = _wav_codec(audio_format, bits)
+    if codec is None or not byte_rate:
+        return None  # compressed payloads only state an average byte rate
+    info = _empty_info(path, size, 'wav')
+    info.update(duration=data_size / byte_rate, bit_rate=byte_rate * 8.0,
+                audio_codec=codec, sample_rate=sample_rate, channels=channels)
+    return info
+
+
+def _boxes(f, start, end):
+    # Yields (type, payload_start, box_end) for the boxes between start and end
+    position = start
+    while position + 8 <= end:
+        f.seek(position)
+        box_size, box_type = struct.unpack('>I4s', f.read(8))
+        header = 8
+        if box_size == 1:
+            box_size = struct.unpack('>Q', f.read(8))[0]
+            header = 16
+        elif box_size == 0:
+            box_size = end - position
+        if box_size < header:
+            return
+        yield box_type, position + header, min(position + box_size, end)
+        position += box_size
+
+
+def _find(f, start, end, box_type):
+    for found, payload, box_end in _boxes(f, start, end):
+        if found == box_type:
+            return payload, box_end
+    return None
+
+
+def _read_times(f, payload):
+    # mvhd/mdhd: (timescale, duration) for version 0 and 1 boxes
+    f.seek(payload)
+    version = f.read(1)[0]
+    if version == 1:
+        f.seek(payload + 4 + 16)
+        return struct.unpack('>IQ', f.read(12))
+    f.seek(payload + 4 + 8)
+    return struct.unpack('>II', f.read(8))
+
+
+def _read_track(f, start, end):
+    track = {}
+    mdia = _find(f, start, end, b'mdia')
+    if mdia is None:
+        return None
+    mdhd = _find(f, *mdia, b'mdhd')
+    hdlr = _find(f, *mdia, b'hdlr')
+    if mdhd is None or hdlr is None:
+        return None
+    track['timescale'], track['duration'] = _read_times(f, mdhd[0])
+    f.seek(hdlr[0] + 8)
+    track['handler'] = f.read(4)
+    stbl = None
+    minf = _find(f, *mdia, b'minf')
+    if minf is not None:
+        stbl = _find(f, *minf, b'stbl')
+    if stbl is None:
+        return track
+    stsd = _find(f, *stbl, b'stsd')
+    if stsd is not None:
+        entry = stsd[0] + 8
+        f.seek(entry + 4)
+        track['codec'] = f.read(4)
+        if track['handler'] == b'vide':
+            f.seek(entry + 32)
+            track['width'], track['height'] = struct.unpack('>HH', f.read(4))
+        elif track['handler'] == b'soun':
+            f.seek(entry + 24)
+            track['channels'] = struct.unpack('>H', f.read(2))[0]
+            f.seek(entry + 32)
+            track['sample_rate'] = struct.unpack('>I', f.read(4))[0] >> 16
+    stts = _find(f, *stbl, b'stts')
+    if stts is not None:
+        f.seek(stts[0] + 4)
+        count = struct.unpack('>I', f.read(4))[0]
+        entries = struct.unpack(f'>{2 * count}I', f.read(8 * count))
+        track['samples'] = sum(entries[0::2])
+    return track
+
+
+def read_mp4_header(f, path, size):
+    f.seek(4)
+    if f.read(4) not in MP4_TOP_LEVEL:
+        return None
+    moov = _find(f, 0, size, b'moov')
+    if moov is None:
+        return None
+    mvhd = _find(f, *moov, b'mvhd')
+    if mvhd is None:
+        return None
+    timescale, duration = _read_times(f, mvhd[0])
+    if not timescale or not duration:
+        return None  # fragmented files keep their durations in the fragments
+    info = _empty_info(path, size, MP4_FORMAT_NAME)
+    info.update(duration=duration / timescale, bit_rate=size * 8.0 * timescale / duration)
+    for box_type, payload, box_end in _boxes(f, *moov):
+        if box_type != b'trak':
+            continue
+        track = _read_track(f, payload, box_end)
+        if not track:
+            continue
+        if track['handler'] == b'vide' and info['video_codec'] is None:
+            if track.get('codec') not in MP4_CODECS:
+                return None
+            seconds = track['duration'] / track['timescale'] if track['timescale'] else 0
+            info.update(video_codec=MP4_CODECS[track['codec']],
+                        width=track.get('width'), height=track.get('height'),
+                        fps=track['samples'] / seconds if track.get('samples') and seconds else None,
+                        time_base=f"1/{track['timescale']}")
+        elif track['handler'] == b'soun' and info['audio_codec'] is None:
+            if track.get('codec') not in MP4_CODECS:
+                return None
+            info.update(audio_codec=MP4_CODECS[track['codec']],
+                        sample_rate=track.get('sample_rate') or track['timescale'],
+                        channels=track.get('channels'))
+    return info
+
+
+def wav_data_layout(path):
+    """
+    Where the samples of a PCM WAV are: a dict with offset, frames, channels,
+    sample_rate, bits, block_align and float, for memory-mapping the data chunk.
+    """
+    with open(path, 'rb') as f:
+        layout = _wav_layout(f, os.path.getsize(path))
+    if layout is None:
+        raise ValueError(f"Not a WAV file: {path}")
+    (audio_format, channels, sample_rate, _, block_align, bits), offset, data_size = layout
+    if _wav_codec(audio_format, bits) is None:
+        raise ValueError(f"Unsupported WAV encoding in {path}")
+    return {'offset': offset, 'frames': data_size // block_align, 'channels': channels,
+            'sample_rate': sample_rate, 'bits': bits, 'block_align': block_align,
+            'float': audio_format == WAVE_FORMAT_IEEE_FLOAT}
+
+
+def read_header(path, size=None):
+    """
+    Returns metadata in the shape of probe.probe_media() for WAV and MP4/MOV
+    files, or None when the container isn't supported or the header is incomplete.
+    pix_fmt is never known from the header.
+    """
+    size = os.path.getsize(path) if size is None else size
+    if size < 12:
+        return None
+    try:
+        with open(path, 'rb') as f:
+            magic = f.read(12)
+            f.seek(0)
+            if magic[:4] in (b'RIFF', b'RF64'):
+                return read_wav_header(f, path, size)
+            return read_mp4_header(f, path, size)
+    except (struct.error, IndexError, OSError):
+        return None
@@ -0,0 +1,120 @@
+# crop_detection.py
+import os
+import json
+import cv2
+import numpy as np
+
+from output_locks import update_json
+
+
+CROP_CACHE_FILE = ".crop_cache.json"
+
+
+class CropDetector:
+    def __init__(self, samples=32, threshold=16, min_presence=0.05, margin=0.05):
+        """
+        Detects the stable content rectangle of a video from a sparse set of frames.
+        :param samples: Number of frames sampled across the file.
+        :param threshold: Luma value above which a row/column counts as content.
+        :param min_presence: Fraction of sampled frames in which a row/column must be bright to be kept.
+        :param margin: Fraction of the file skipped at the head and tail (fades, title cards).
+        """
+        self.samples = samples
+        self.threshold = threshold
+        self.min_presence = min_presence
+        self.margin = margin
+
+    def params(self):
+        return {'samples': self.samples, 'threshold': self.threshold,
+                'min_presence': self.min_presence, 'margin': self.margin}
+
+    def sample_frames(self, video_path):
+        cap = cv2.VideoCapture(video_path)
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        frames = []
+        if total_frames > 0:
+            start = int(total_frames * self.margin)
+            stop = max(start + 1, int(total_frames * (1 - self.margin)))
+            positions = np.unique(np.linspace(
+                start, stop - 1, self.samples).astype(int))
+            for position in positions:
+                # Seeking lands on the nearest keyframe and decodes forward from
+                # there, so each sample costs a handful of frames, not the file.
+                cap.set(cv2.CAP_PROP_POS_FRAMES, int(position))
+                success, frame = cap.read()
+                if success:
+                    frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+        cap.release()
+        return frames, width, height
+
+    def content_rectangle(self, frames, width, height):
+        if not frames:
+            return (0, 0, width, height)
+        stack = np.stack(frames)
+        # Per-frame row/column maxima, then the fraction of frames in which
+        # each row/column carries content.
+        row_presence = (stack.max(axis=2) > self.threshold).mean(axis=0)
+        col_presence = (stack.max(axis=1) > self.threshold).mean(axis=0)
+        rows = np.flatnonzero(row_presence >= self.min_presence)
+        cols = np.flatnonzero(col_presence >= self.min_presence)
+        if rows.size == 0 or cols.size == 0:
+            return (0, 0, stack.shape[2], stack.shape[1])
+        x1, y1 = int(cols[0]), int(rows[0])
+        x2, y2 = int(cols[-1]) + 1, int(rows[-1]) + 1
+        # Encoders want even dimensions
+        x2 -= (x2 - x1) % 2
+        y2 -= (y2 - y1) % 2
+        return (x1, y1, x2, y2)
+
+    def detect(self, video_path):
+        frames, width, height = self.sample_frames(video_path)
+        return self.content_rectangle(frames, width, height)
+
+
+def _cache_path(video_path):
+    return os.path.join(os.path.dirname(os.path.abspath(video_path)), CROP_CACHE_FILE)
+
+
+def _cache_key(video_path, detector):
+    stat = os.stat(video_path)
+    return json.dumps([os.path.basename(video_path), stat.st_size, int(stat.st_mtime),
+                       detector.params()])
+
+
+def detect_crop(video_path, detector=None, use_cache=True):
+    """
+    Returns the (x1, y1, x2, y2) content rectangle of a video, cached per source.
+    """
+    detector = detector or CropDetector()
+    cache_path = _cache_path(video_path)
+    key = _cache_key(video_path, detector)
+    cache = {}
+    if use_cache and os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'r') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            cache = {}
+        if key in cache:
+            return tuple(cache[key])
+
+    crop = detector.detect(video_path)
+    if use_cache:
+        try:
+            # Jobs in the same folder share the file; merge under its lock
+            update_json(cache_path, lambda cache: cache.update({key: list(crop)}))
+        except OSError:
+            pass
+    print(f"Detected crop for {os.path.basename(video_path)}: {crop}")
+    return crop
+
+
+def resolve_crop_dimensions(video_path, crop_dimensions):
+    """
+    Resolves a crop setting to an (x1, y1, x2, y2) tuple; "auto" runs detection.
+    """
+    if crop_dimensions == "auto":
+        return detect_crop(video_path)
+    return crop_dimensions
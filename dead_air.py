@@ -0,0 +1,118 @@
+# dead_air.py
+#
+# Finds the leading and trailing dead air of a recording: silence in the
+# (memory-mapped) WAV, measured as windowed RMS, combined with an idle
+# screen, measured as the change between small gray frames sampled from the
+# video. Only the candidate head and tail of the video are decoded.
+import os
+import subprocess
+import numpy as np
+
+from av_sync import wav_samples
+from container_headers import wav_data_layout
+import profiling
+
+RMS_WINDOW = 0.5  # seconds per RMS window
+SILENCE_DB = -45.0  # windows quieter than this (dBFS) are silent
+MIN_DEAD_AIR = 5.0  # shorter stretches are not worth a cut
+PADDING = 1.0  # seconds kept before the first and after the last activity
+MOTION_SAMPLE_FPS = 1
+MOTION_SIZE = (64, 36)
+MOTION_THRESHOLD = 3.0  # mean absolute gray level change between samples
+KEYFRAME_SEARCH = 30  # seconds searched back for a keyframe before a cut
+
+
+def audio_activity(wav_path, window=RMS_WINDOW, silence_db=SILENCE_DB, chunk_windows=120):
+    """
+    Returns (active, window): a boolean per RMS window of the WAV.
+    """
+    samples, sample_rate = wav_samples(wav_path)
+    layout = wav_data_layout(wav_path)
+    # wav_samples views integers through their top 16 bits
+    full_scale = 1.0 if layout['float'] else 32768.0
+    window_frames = max(1, int(window * sample_rate))
+    windows = len(samples) // window_frames
+    rms = np.empty(windows, np.float32)
+    for start in range(0, windows, chunk_windows):
+        stop = min(windows, start + chunk_windows)
+        chunk = np.asarray(samples[start * window_frames:stop * window_frames], dtype=np.float32) / full_scale
+        rms[start:stop] = np.sqrt(np.square(chunk).reshape(stop - start, window_frames, -1).mean(axis=(1, 2)))
+    with np.errstate(divide='ignore'):
+        level = 20 * np.log10(rms)
+    return level > silence_db, window_frames / sample_rate
+
+
+def sample_gray_frames(video_path, start, end, fps=MOTION_SAMPLE_FPS, size=MOTION_SIZE):
+    """
+    Decodes [start, end) of a video as tiny gray frames. Returns (frames, times).
+    """
+    width, height = size
+    args = ['ffmpeg', '-v', 'error', '-nostdin', '-ss', f"{start:.3f}", '-t', f"{max(0.0, end - start):.3f}",
+            '-i', video_path, '-an', '-vf', f"fps={fps},scale={width}:{height}",
+            '-pix_fmt', 'gray', '-f', 'rawvideo', 'pipe:1']
+    with profiling.span("motion sample", file=os.path.basename(video_path)):
+        raw = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True).stdout
+    frames = np.frombuffer(raw, np.uint8)
+    frames = frames[:len(frames) // (width * height) * width * height].reshape(-1, height, width)
+    return frames, start + np.arange(len(frames)) / fps
+
+
+def motion_times(video_path, start, end):
+    """
+    Times in [start, end) at which the picture changes.
+    """
+    if end - start <= 0:
+        return np.zeros(0)
+    frames, times = sample_gray_frames(video_path, start, end)
+    if len(frames) < 2:
+        return np.zeros(0)
+    change = np.abs(np.diff(frames.astype(np.int16), axis=0)).mean(axis=(1, 2))
+    return times[1:][change > MOTION_THRESHOLD]
+
+
+def find_content(video_path, wav_path, duration, window=RMS_WINDOW, silence_db=SILENCE_DB,
+                 min_dead_air=MIN_DEAD_AIR, padding=PADDING):
+    """
+    Returns (start, end) of the part of the recording worth keeping, in seconds.
+    Sound anywhere keeps it; in the silent head and tail, so does any change on screen.
+    """
+    active, window = audio_activity(wav_path, window, silence_db)
+    if not active.any():
+        return 0.0, duration
+    indices = np.flatnonzero(active)
+    start, end = indices[0] * window, min(duration, (indices[-1] + 1) * window)
+    if start >= min_dead_air:
+        moving = motion_times(video_path, 0.0, start)
+        if len(moving):
+            start = min(start, float(moving[0]))
+    if duration - end >= min_dead_air:
+        moving = motion_times(video_path, end, duration)
+        if len(moving):
+            end = max(end, float(moving[-1]))
+    start, end = max(0.0, start - padding), min(duration, end + padding)
+    if start < min_dead_air:
+        start = 0.0
+    if duration - end < min_dead_air:
+        end = duration
+    return start, end
+
+
+def keyframe_before(video_path, time):
+    """
+    Presentation time of the last video keyframe at or before `time`, read from
+    packet flags without decoding.
+    """
+    if time <= 0:
+        return 0.0
+    for search_from in (max(0.0, time - KEYFRAME_SEARCH), 0.0):
+        output = subprocess.check_output(
+            ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+             '-read_intervals', f"{search_from:.3f}%{time + 0.001:.3f}",
+             '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', video_path]).decode()
+        keyframes = [float(pts) for pts, _, flags in (line.partition(',') for line in output.splitlines())
+                     if 'K' in flags and pts not in ('', 'N/A') and float(pts) <= time]
+        if keyframes:
+            return max(keyframes)
+        if search_from == 0.0:
+            break
+    return 0.0
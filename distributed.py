@@ -0,0 +1,308 @@
+# distributed.py
+#
+# Lease-based job queue on a shared filesystem. The coordinator enqueues job
+# specs, workers on any node that mounts the same storage claim them with an
+# atomic rename, keep their lease alive with heartbeats and write results back.
+#
+#   queue_dir/pending/<job_id>.json           waiting to be claimed
+#   queue_dir/leased/<job_id>@<worker>.json   claimed, mtime is the heartbeat
+#   queue_dir/done/<job_id>.json              finished, with history entries
+#   queue_dir/failed/<job_id>.json            gave up after MAX_ATTEMPTS leases
+#   queue_dir/collected/<job_id>.json         merged into the history file
+#
+# Source paths must be visible under the same mount point on every node.
+import argparse
+import itertools
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from multiprocessing import Process
+
+from cancellation import set_cancel_event
+from invoker import FileOperationInvoker
+from thread_budget import ThreadBudget, set_budget
+
+LEASE_TIMEOUT = 120
+HEARTBEAT_INTERVAL = LEASE_TIMEOUT / 4
+POLL_INTERVAL = 2
+MAX_ATTEMPTS = 3
+
+QUEUE_FOLDERS = ("pending", "leased", "done", "failed", "collected")
+
+# Workers claim pending jobs in name order; the sequence keeps that the enqueue order
+_sequence = itertools.count()
+
+
+def _write_json(path, data):
+    # Write beside the target and rename so readers never see a partial file
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=4)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+class JobQueue:
+    def __init__(self, queue_dir, lease_timeout=LEASE_TIMEOUT, max_attempts=MAX_ATTEMPTS):
+        self.queue_dir = queue_dir
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        for folder in QUEUE_FOLDERS:
+            os.makedirs(self.folder(folder), exist_ok=True)
+
+    def folder(self, name):
+        return os.path.join(self.queue_dir, name)
+
+    def _jobs_in(self, name):
+        return sorted(f for f in os.listdir(self.folder(name))
+                      if f.endswith('.json') and not f.startswith('.'))
+
+    # Coordinator side
+
+    def enqueue(self, commands, name=None):
+        job_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{next(_sequence):06d}-{uuid.uuid4().hex[:8]}"
+        job = {'id': job_id,
+               'name': name,
+               'commands': [command.to_spec() for command in commands],
+               'attempts': 0,
+               'enqueued_at': time.time()}
+        _write_json(os.path.join(self.folder("pending"), job_id + '.json'), job)
+        return job_id
+
+    def reap_expired(self):
+        """
+        Moves leases whose heartbeat is older than the lease timeout back to pending.
+        """
+        requeued = []
+        now = time.time()
+        for lease_name in self._jobs_in("leased"):
+            lease_path = os.path.join(self.folder("leased"), lease_name)
+            try:
+                if now - os.path.getmtime(lease_path) < self.lease_timeout:
+                    continue
+                # Take the lease away from the dead worker first; only one reaper wins
+                reclaim_path = os.path.join(self.folder("pending"), f".reclaim-{lease_name}")
+                os.rename(lease_path, reclaim_path)
+            except FileNotFoundError:
+                continue
+            job = _read_json(reclaim_path)
+            job['attempts'] = job.get('attempts', 0) + 1
+            job.pop('lease', None)
+            target = "pending" if job['attempts'] < self.max_attempts else "failed"
+            _write_json(os.path.join(self.folder(target), job['id'] + '.json'), job)
+            os.remove(reclaim_path)
+            requeued.append((job['id'], target))
+            print(f"Lease expired for job {job['id']}, moved to {target}")
+        return requeued
+
+    def collect(self, history_file, lock=None):
+        """
+        Merges finished job results into the history file.
+        """
+        invoker = FileOperationInvoker(lock=lock)
+        for name in self._jobs_in("done"):
+            path = os.path.join(self.folder("done"), name)
+            try:
+                result = _read_json(path)
+                os.rename(path, os.path.join(self.folder("collected"), name))
+            except FileNotFoundError:
+                continue
+            invoker.history.extend(result.get('history', []))
+        if invoker.history:
+            invoker.print_history(history_file)
+        return invoker.history
+
+    def status(self):
+        return {folder: len(self._jobs_in(folder)) for folder in QUEUE_FOLDERS}
+
+    def wait(self, history_file=None, poll_interval=POLL_INTERVAL):
+        """
+        Blocks until nothing is pending or leased, reaping and collecting on the way.
+        """
+        while True:
+            self.reap_expired()
+            if history_file is not None:
+                self.collect(history_file)
+            counts = self.status()
+            if counts['pending'] == 0 and counts['leased'] == 0:
+                return counts
+            time.sleep(poll_interval)
+
+    def watch(self, history_file=None, poll_interval=POLL_INTERVAL):
+        """
+        Reaps and collects for as long as the process runs, reporting each time
+        the queue drains. Meant for a daemon thread, so the coordinator stays usable.
+        """
+        busy = False
+        while True:
+            self.reap_expired()
+            if history_file is not None:
+                self.collect(history_file)
+            counts = self.status()
+            idle = counts['pending'] == 0 and counts['leased'] == 0
+            if busy and idle:
+                print(f"\nDistributed jobs finished: {counts}")
+            busy = not idle
+            time.sleep(poll_interval)
+
+    # Worker side
+
+    def claim(self, worker_id):
+        for name in self._jobs_in("pending"):
+            job_id = name[:-len('.json')]
+            lease_path = os.path.join(self.folder("leased"), f"{job_id}@{worker_id}.json")
+            try:
+                os.rename(os.path.join(self.folder("pending"), name), lease_path)
+            except FileNotFoundError:
+                continue  # another worker got there first
+            os.utime(lease_path)
+            return _read_json(lease_path), lease_path
+        return None, None
+
+    def heartbeat(self, lease_path):
+        try:
+            os.utime(lease_path)
+            return True
+        except FileNotFoundError:
+            return False  # the lease was reaped
+
+    def complete(self, job, lease_path, history):
+        job['history'] = history
+        job['finished_at'] = time.time()
+        # Only the worker that still holds the lease may publish a result
+        try:
+            os.rename(lease_path, lease_path + '.finishing')
+        except FileNotFoundError:
+            print(f"Lease for job {job['id']} was lost, discarding result")
+            return False
+        _write_json(os.path.join(self.folder("done"), job['id'] + '.json'), job)
+        os.remove(lease_path + '.finishing')
+        return True
+
+
+class _Heartbeat(threading.Thread):
+    def __init__(self, queue, lease_path, interval):
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.lease_path = lease_path
+        self.interval = interval
+        self.stopped = threading.Event()
+        # Set when the lease was reaped; the running commands see it as a cancellation
+        self.lost = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            if not self.queue.heartbeat(self.lease_path):
+                self.lost.set()
+                break
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class Worker:
+    def __init__(self, queue_dir, worker_id=None, heartbeat_interval=HEARTBEAT_INTERVAL,
+                 poll_interval=POLL_INTERVAL):
+        self.queue = JobQueue(queue_dir)
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.heartbeat_interval = heartbeat_interval
+        self.poll_interval = poll_interval
+
+    def run_job(self, job):
+        # Imported here so the coordinator side does not pull in cv2/moviepy
+        from commands import command_from_spec
+        invoker = FileOperationInvoker()
+        for spec in job['commands']:
+            invoker.add_command(command_from_spec(spec))
+        invoker.execute_commands()
+        for entry in invoker.history:
+            entry['worker'] = self.worker_id
+        return invoker.history
+
+    def run(self, exit_when_idle=False):
+        print(f"Worker {self.worker_id} polling {self.queue.queue_dir}")
+        while True:
+            self.queue.reap_expired()
+            job, lease_path = self.queue.claim(self.worker_id)
+            if job is None:
+                if exit_when_idle:
+                    return
+                time.sleep(self.poll_interval)
+                continue
+            print(f"Worker {self.worker_id} running job {job['id']}")
+            heartbeat = _Heartbeat(self.queue, lease_path, self.heartbeat_interval)
+            # Another worker runs the job once its lease is reaped, so this one stops
+            set_cancel_event(heartbeat.lost)
+            heartbeat.start()
+            try:
+                history = self.run_job(job)
+            except Exception as e:
+                history = [{'command': spec['command'], 'inputs': spec['args'][:2],
+                            'status': 'Failed', 'reason': str(e), 'output': None,
+                            'worker': self.worker_id} for spec in job['commands']]
+            finally:
+                heartbeat.stop()
+                set_cancel_event(None)
+            if heartbeat.lost.is_set():
+                print(f"Lease for job {job['id']} was lost, stopped running it")
+                continue
+            self.queue.complete(job, lease_path, history)
+
+
+def _run_worker(queue_dir, worker_id, exit_when_idle, budget=None):
+    set_budget(budget)
+    Worker(queue_dir, worker_id=worker_id).run(exit_when_idle=exit_when_idle)
+
+
+def start_local_workers(queue_dir, count, exit_when_idle=False):
+    """
+    Starts several workers on this machine, e.g. to try the queue without other nodes.
+    The workers of one node share a thread budget of the node's cores.
+    """
+    processes = []
+    budget = ThreadBudget()
+    for i in range(count):
+        worker_id = f"{socket.gethostname()}-{os.getpid()}-{i}"
+        p = Process(target=_run_worker, args=(queue_dir, worker_id, exit_when_idle, budget))
+        p.start()
+        processes.append(p)
+    return processes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared-filesystem job queue")
+    parser.add_argument("queue_dir")
+    sub = parser.add_subparsers(dest="action", required=True)
+    worker = sub.add_parser("worker", help="claim and run jobs")
+    worker.add_argument("--count", type=int, default=1, help="worker processes on this node")
+    worker.add_argument("--exit-when-idle", action="store_true")
+    sub.add_parser("status", help="show job counts")
+    sub.add_parser("reap", help="requeue expired leases")
+    collect = sub.add_parser("collect", help="merge results into the history file")
+    collect.add_argument("--history", default="history.json")
+    args = parser.parse_args()
+
+    if args.action == "worker":
+        for p in start_local_workers(args.queue_dir, args.count, args.exit_when_idle):
+            p.join()
+    elif args.action == "status":
+        print(JobQueue(args.queue_dir).status())
+    elif args.action == "reap":
+        JobQueue(args.queue_dir).reap_expired()
+    elif args.action == "collect":
+        history = JobQueue(args.queue_dir).collect(args.history)
+        print(f"Collected {len(history)} history entries")
+
+
+if __name__ == "__main__":
+    import multiprocessing
+    multiprocessing.set_start_method('spawn')
+    main()
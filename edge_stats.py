@@ -0,0 +1,150 @@
+# edge_stats.py
+#
+# Compact per-frame edge statistics for black bar detection, stored as a
+# float32 array of shape (frames, 4, STRIP_DEPTH) in <source>.edgestats.npy
+# with a JSON sidecar. They are the ends of the row and column profiles of
+# bar_geometry.BarDetector, over the same sampled lines: for each side, the
+# mean intensity of each of the STRIP_DEPTH outermost columns (left/right) or
+# rows (top/bottom), edge first. A threshold tuned on them is the threshold
+# the detector applies.
+# Any threshold, minimum bar width up to STRIP_DEPTH and set of sides can then
+# be evaluated over the memory-mapped array without decoding the video again;
+# bar widths read from the stats are capped at STRIP_DEPTH.
+import json
+import os
+import cv2
+import numpy as np
+
+from bar_geometry import SAMPLE_LINES, SIDES, BarDetector
+
+STRIP_DEPTH = 16
+STATS_VERSION = 3
+
+
+def edge_profile(frame, depth=STRIP_DEPTH, detector=None):
+    """
+    Returns the (4, depth) edge statistics of one BGR or gray frame, taken
+    from the detector's profiles.
+    """
+    columns, rows = (detector or BarDetector()).profiles(frame)
+    return np.stack([columns[:depth], columns[:-depth - 1:-1],
+                     rows[:depth], rows[:-depth - 1:-1]]).astype(np.float32)
+
+
+def stats_paths(video_path):
+    base = video_path.rsplit('.', 1)[0]
+    return base + ".edgestats.npy", base + ".edgestats.json"
+
+
+def _source_signature(video_path):
+    stat = os.stat(video_path)
+    return {'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+
+
+class EdgeStatsRecorder:
+    def __init__(self, video_path, fps, crop_dimensions, depth=STRIP_DEPTH, sample_lines=SAMPLE_LINES):
+        self.video_path = video_path
+        self.fps = fps
+        self.crop_dimensions = crop_dimensions
+        self.depth = depth
+        self.detector = BarDetector(sample_lines=sample_lines)
+        self.profiles = []
+
+    def add(self, frame):
+        self.profiles.append(edge_profile(frame, self.depth, self.detector))
+
+    def save(self):
+        array_path, meta_path = stats_paths(self.video_path)
+        stats = np.stack(self.profiles) if self.profiles else np.zeros((0, 4, self.depth), np.float32)
+        np.save(array_path, stats)
+        meta = dict(_source_signature(self.video_path), version=STATS_VERSION, fps=self.fps, depth=self.depth,
+                    sample_lines=self.detector.sample_lines, frames=len(self.profiles), sides=list(SIDES),
+                    crop_dimensions=list(self.crop_dimensions) if self.crop_dimensions else None)
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f, indent=4)
+        return array_path
+
+
+def load_edge_stats(video_path, crop_dimensions=None, sample_lines=SAMPLE_LINES):
+    """
+    Returns (stats, meta) with stats memory-mapped, or (None, None) if there are
+    no stats for the current file, crop and detector sampling.
+    """
+    array_path, meta_path = stats_paths(video_path)
+    if not (os.path.exists(array_path) and os.path.exists(meta_path)):
+        return None, None
+    with open(meta_path, 'r') as f:
+        meta = json.load(f)
+    if meta.get('version') != STATS_VERSION or meta.get('sample_lines') != sample_lines:
+        return None, None
+    signature = _source_signature(video_path)
+    if meta['size'] != signature['size'] or meta['mtime'] != signature['mtime']:
+        return None, None
+    if crop_dimensions is not None and meta['crop_dimensions'] != list(crop_dimensions):
+        return None, None
+    return np.load(array_path, mmap_mode='r'), meta
+
+
+def collect_edge_stats(video_path, crop_dimensions=None):
+    """
+    Decodes a video once and saves its edge statistics, without writing any output video.
+    """
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    if not crop_dimensions:
+        crop_dimensions = (0, 0, int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    recorder = EdgeStatsRecorder(video_path, fps, crop_dimensions)
+    while True:
+        success, frame = cap.read()
+        if not success:
+            break
+        left, top, right, bottom = crop_dimensions
+        recorder.add(frame[top:bottom, left:right])
+    cap.release()
+    return recorder.save()
+
+
+def bar_widths(stats, threshold=10, sides=SIDES):
+    """
+    Width of the dark band on each side of every frame, capped at the cached
+    depth: an array of shape (frames, len(sides)).
+    """
+    indices = [SIDES.index(side) for side in sides]
+    dark = np.asarray(stats[:, indices, :]) < threshold
+    # Leading run of dark lines from the edge, as in bar_geometry.leading_extent
+    return (np.cumsum(~dark, axis=2) == 0).sum(axis=2)
+
+
+def detect_from_stats(stats, threshold=10, min_width=1, sides=SIDES):
+    """
+    Evaluates black bar detection over cached stats.
+    Returns (flags, side_index, widths): a boolean per frame, for flagged frames
+    the index into `sides` of the first side with a bar (-1 otherwise), and the
+    (frames, len(sides)) bar widths.
+    """
+    if min_width > stats.shape[2]:
+        raise ValueError(f"min_width {min_width} exceeds the cached depth {stats.shape[2]}")
+    widths = bar_widths(stats, threshold, sides)
+    tripped = widths >= min_width
+    flags = tripped.any(axis=1)
+    side_index = np.where(flags, tripped.argmax(axis=1), -1)
+    return flags, side_index, widths
+
+
+def preview(video_path, threshold=10, min_width=1, sides=SIDES):
+    """
+    Lists the frames that would be replaced with the given parameters, in the
+    same form as the detection log.
+    """
+    stats, meta = load_edge_stats(video_path)
+    if stats is None:
+        raise FileNotFoundError(f"No edge statistics for {video_path}")
+    flags, side_index, widths = detect_from_stats(stats, threshold, min_width, sides)
+    frames = np.flatnonzero(flags)
+    # Frame 0 is never replaced, it seeds the last good frame
+    frames = frames[frames > 0]
+    fps = meta['fps'] or 30
+    return [{'frame': int(i),
+             'time': f"{int(i / fps // 60):02d}:{int(i / fps % 60):02d}",
+             'side': sides[side_index[i]],
+             'bars': {side: int(widths[i, j]) for j, side in enumerate(sides) if widths[i, j]}} for i in frames]
@@ -0,0 +1,220 @@
+# executor.py
+import itertools
+import json
+import os
+import signal
+import sys
+import time
+from multiprocessing import Event, Process, cpu_count
+
+from admission import ADMITTED, REJECTED
+from cancellation import KILL_GRACE, cleanup_partials, set_cancel_event
+from invoker import FileOperationInvoker
+from thread_budget import set_budget
+import profiling
+
+
+def process_files(commands, store=None, spawned_at=None, cancel_event=None, budget=None):
+    set_budget(budget)
+    if cancel_event is not None:
+        # Ctrl+C reaches the whole foreground group; let the parent decide and signal through the event
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        set_cancel_event(cancel_event)
+    if spawned_at is not None:
+        # Interpreter startup and imports of the spawn-mode child
+        profiling.record_span("process startup", spawned_at, profiling.now_us())
+        profiling.name_process(f"worker {os.getpid()}")
+    invoker = FileOperationInvoker(store=store)
+    for command in commands:
+        invoker.add_command(command)
+    try:
+        invoker.execute_commands()
+    finally:
+        # Process children exit without running atexit handlers
+        profiling.flush()
+    if any(command.status == "Failed" for command in commands):
+        # The parent only sees the exit code
+        sys.exit(1)
+
+
+class Job:
+    _ids = itertools.count(1)
+
+    def __init__(self, commands, priority=0, label=None):
+        self.id = next(self._ids)
+        self.commands = commands
+        self.key = job_key(commands)
+        self.priority = priority
+        self.label = label or job_label(commands)
+        self.process = None
+        self.cancel_event = None
+        self.cancel_deadline = None
+        self.status = "Queued"
+        self.reason = None
+        self.submitted_at = time.time()
+        self.started_at = None
+
+
+class BatchExecutor:
+    def __init__(self, max_workers=None, admission=None, store=None, poll_interval=0.5, budget=None):
+        """
+        Runs jobs (lists of commands) in worker processes.
+        :param max_workers: Number of jobs running at once.
+        :param admission: Optional DiskAdmissionController deciding when a queued job may start.
+        :param store: Optional ArtifactStore serving and keeping command outputs.
+        :param poll_interval: Seconds between scheduling passes.
+        :param budget: Optional ThreadBudget shared by the workers' encoders.
+        """
+        self.max_workers = max_workers or cpu_count()
+        self.admission = admission
+        self.store = store
+        self.budget = budget
+        self.poll_interval = poll_interval
+        self.queued = []
+        self.running = []
+        self.finished = []
+
+    def submit(self, commands, priority=0, label=None):
+        """
+        Queues a job. Jobs with a lower priority number start first. A job
+        identical to one already queued or running isn't queued again; the
+        existing job is returned instead.
+        """
+        key = job_key(commands)
+        for active in self.queued + self.running:
+            if active.key == key:
+                print(f"Already queued as job {active.id}: {active.label}")
+                return active
+        job = Job(commands, priority, label)
+        self.queued.append(job)
+        return job
+
+    def _reap(self):
+        for job in list(self.running):
+            if job.process.is_alive():
+                continue
+            job.process.join()
+            job.status = "Done" if job.process.exitcode == 0 else "Failed"
+            self.running.remove(job)
+            self.finished.append(job)
+            if self.admission is not None:
+                self.admission.release(job.id)
+
+    def _reject(self, job, reason):
+        job.status, job.reason = "Rejected", reason
+        for command in job.commands:
+            command.status, command.reason = "Failed", reason
+        print(f"Not starting {job.commands[0].__class__.__name__} job {job.id}: {reason}")
+        self.queued.remove(job)
+        self.finished.append(job)
+
+    def _start(self, job):
+        spawned_at = profiling.now_us() if profiling.enabled() else None
+        job.cancel_event = Event()
+        job.process = Process(target=process_files, args=(job.commands, self.store, spawned_at,
+                                                                 job.cancel_event, self.budget))
+        job.process.start()
+        job.started_at = time.time()
+        job.status = "Running"
+        self.queued.remove(job)
+        self.running.append(job)
+
+    def can_start(self, job):
+        return len(self.running) < self.max_workers
+
+    def step(self):
+        self._reap()
+        for job in sorted(self.queued, key=lambda job: (job.priority, job.id)):
+            if not self.can_start(job):
+                continue
+            if self.admission is not None:
+                decision = self.admission.try_admit(job.id, job.commands)
+                if decision == REJECTED:
+                    self._reject(job, self.admission.reject_reason(job.id))
+                    self.admission.release(job.id)
+                    continue
+                if decision != ADMITTED:
+                    continue  # wait for space; smaller jobs further back may still fit
+            self._start(job)
+        return bool(self.queued or self.running)
+
+    def run(self):
+        while self.step():
+            time.sleep(self.poll_interval)
+        return self.finished
+
+    def cancel(self, grace=KILL_GRACE):
+        """
+        Stops the batch: queued jobs never start, running workers are asked to
+        stop and terminated if they don't within `grace` seconds, and partial
+        outputs they leave behind are removed. Returns the partial files removed.
+        """
+        for job in self.running:
+            if job.cancel_event is not None:
+                job.cancel_event.set()
+        for job in list(self.queued):
+            self._cancel_queued(job)
+        deadline = time.monotonic() + grace
+        for job in self.running:
+            job.cancel_deadline = deadline
+            job.process.join(max(0, deadline - time.monotonic()))
+            if job.process.is_alive():
+                job.process.terminate()
+                job.process.join()
+        cancelled_jobs = list(self.running)
+        self._reap()
+        removed = []
+        for job in cancelled_jobs:
+            job.status, job.reason = "Cancelled", "Cancelled"
+            # Only this job's partials: other runs may be writing into the same folders
+            removed += cleanup_partials(job_folders([job.commands]), job_stems(job.commands))
+        return removed
+
+    def _cancel_queued(self, job):
+        job.status, job.reason = "Cancelled", "Cancelled"
+        for command in job.commands:
+            command.status, command.reason = "Failed", "Cancelled"
+        self.queued.remove(job)
+        self.finished.append(job)
+
+
+def job_key(commands):
+    # Identical command specs do identical work
+    return json.dumps([command.to_spec() for command in commands], sort_keys=True, default=str)
+
+
+def job_label(commands):
+    command = commands[0]
+    path = getattr(command, 'file_path', None) or getattr(command, 'video_path', None) or ''
+    return f"{command.__class__.__name__} {os.path.basename(path)}".strip()
+
+
+def job_folders(jobs):
+    """
+    Folders a set of jobs writes into: each source folder and every output folder.
+    """
+    folders = set()
+    for commands in jobs:
+        for command in commands:
+            for attribute in ('video_path', 'file_path', 'output_path', 'pending_output_path'):
+                path = getattr(command, attribute, None)
+                if isinstance(path, str):
+                    folders.add(os.path.dirname(os.path.abspath(path)))
+            cache_folder = getattr(command, 'cache_folder', None)
+            if cache_folder:
+                folders.add(os.path.abspath(cache_folder))
+    return sorted(folder for folder in folders if os.path.isdir(folder))
+
+
+def job_stems(commands):
+    """
+    Output file names of a job without their extensions, to tell its partial
+    outputs apart from those of other jobs writing into the same folders.
+    """
+    stems = set()
+    for command in commands:
+        for attribute in ('output_path', 'pending_output_path', 'audio_output_path'):
+            path = getattr(command, attribute, None)
+            if isinstance(path, str):
+                stems.add(os.path.splitext(os.path.basename(path))[0])
+    return stems
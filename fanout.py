@@ -0,0 +1,121 @@
+# fanout.py
+#
+# Broadcasts decoded frames to several encoders at once. Each FrameSink is an
+# ffmpeg process reading raw BGR frames on stdin (and the audio of the source
+# as a second input), so one decode in Python feeds N outputs and the encoders
+# run in parallel in their own processes.
+import os
+import subprocess
+
+from cancellation import commit_output, discard, kill_process_group, partial_path
+
+
+class FrameSink:
+    def __init__(self, output_path, crop=None, width=None, codec='libx264', crf='18', preset='slow',
+                 audio_bitrate='192k', extra_args=()):
+        """
+        One output of a fan-out.
+        :param output_path: Path of the encoded file.
+        :param crop: Optional (x1, y1, x2, y2) in source coordinates, or "auto" to detect the content area.
+        :param width: Optional output width; the height follows the aspect ratio.
+        :param codec: ffmpeg video encoder.
+        :param crf: Constant rate factor of the encoder.
+        :param preset: Encoder preset.
+        :param audio_bitrate: AAC bitrate of the audio copied from the source.
+        :param extra_args: Further ffmpeg output options.
+        """
+        self.output_path = output_path
+        self.crop = crop
+        self.width = width
+        self.codec = codec
+        self.crf = crf
+        self.preset = preset
+        self.audio_bitrate = audio_bitrate
+        self.extra_args = list(extra_args)
+        self.threads = None
+        self.process = None
+        self.partial_output = None
+        self.region = None
+        self.error = None
+
+    def ffmpeg_args(self, size, fps, audio_source):
+        width, height = size
+        args = ['ffmpeg', '-nostdin', '-loglevel', 'error',
+                '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f"{width}x{height}", '-r', str(fps), '-i', 'pipe:0',
+                '-i', audio_source,
+                '-map', '0:v:0', '-map', '1:a:0?']
+        if self.width:
+            args += ['-vf', f"scale={self.width}:-2"]
+        args += ['-c:v', self.codec, '-crf', self.crf, '-preset', self.preset, '-pix_fmt', 'yuv420p',
+                 '-c:a', 'aac', '-b:a', self.audio_bitrate, '-shortest']
+        if self.threads:
+            args += ['-threads', str(self.threads)]
+        return args + self.extra_args + [self.partial_output]
+
+    def open(self, frame_box, fps, audio_source):
+        """
+        Starts the encoder. frame_box is the (x1, y1, x2, y2) area of the source
+        covered by the frames that will be written.
+        """
+        left, top, right, bottom = frame_box
+        x1, y1, x2, y2 = self.crop if self.crop else frame_box
+        # Translate to frame coordinates, clamped to what the frames contain
+        x1, x2 = max(x1, left) - left, min(x2, right) - left
+        y1, y2 = max(y1, top) - top, min(y2, bottom) - top
+        if x2 <= x1 or y2 <= y1:
+            raise ValueError(f"Crop {self.crop} lies outside the frame for {self.output_path}")
+        # yuv420p needs even dimensions
+        x2 -= (x2 - x1) % 2
+        y2 -= (y2 - y1) % 2
+        self.region = (x1, y1, x2, y2)
+        os.makedirs(os.path.dirname(os.path.abspath(self.output_path)), exist_ok=True)
+        self.partial_output = partial_path(self.output_path)
+        self.process = subprocess.Popen(self.ffmpeg_args((x2 - x1, y2 - y1), fps, audio_source),
+                                        stdin=subprocess.PIPE, start_new_session=True)
+
+    def write(self, frame):
+        x1, y1, x2, y2 = self.region
+        self.process.stdin.write(frame[y1:y2, x1:x2].tobytes())
+
+    def close(self):
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self.process.wait()
+        if self.process.returncode != 0:
+            self.error = f"encoder for {os.path.basename(self.output_path)} exited with code {self.process.returncode}"
+
+    def abort(self):
+        if self.process is not None and self.process.poll() is None:
+            kill_process_group(self.process)
+        discard(self.partial_output)
+
+    def commit(self):
+        commit_output(self.partial_output, self.output_path)
+
+
+class FanOutWriter:
+    """
+    Stands in for a cv2.VideoWriter: every written frame goes to the primary
+    writer and to each sink.
+    """
+
+    def __init__(self, primary, sinks):
+        self.primary = primary
+        self.sinks = sinks
+
+    def isOpened(self):
+        return self.primary.isOpened()
+
+    def write(self, frame):
+        self.primary.write(frame)
+        for sink in self.sinks:
+            sink.write(frame)
+
+    def release(self):
+        self.primary.release()
+        for sink in self.sinks:
+            sink.close()
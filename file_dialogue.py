@@ -34,3 +34,8 @@ class FileDialogue:
             )
         return file_paths
     
+
+    def open_folder_dialogue(self, title="Select folder"):
+        root = Tk()
+        root.withdraw()
+        return filedialog.askdirectory(title=title)
@@ -0,0 +1,114 @@
+# frame_exporter.py
+import os
+import queue
+import threading
+import cv2
+import numpy as np
+
+ENCODE_PARAMS = {
+    'jpg': lambda quality: [cv2.IMWRITE_JPEG_QUALITY, quality],
+    'webp': lambda quality: [cv2.IMWRITE_WEBP_QUALITY, quality],
+    # PNG stays lossless; the fastest zlib level keeps the encode cheap
+    'png': lambda quality: [cv2.IMWRITE_PNG_COMPRESSION, 1],
+}
+
+
+class FrameExporter:
+    def __init__(self, folder, image_format='jpg', quality=90, queue_size=64,
+                 contact_sheet=False, thumbnail_width=320, columns=8, max_thumbnails=240):
+        """
+        Writes frames to disk from a background thread fed by a bounded queue.
+        :param folder: Folder receiving the images.
+        :param image_format: 'jpg', 'webp' or 'png'.
+        :param quality: JPEG/WebP quality.
+        :param queue_size: Frames buffered before submit() blocks the decode loop.
+        :param contact_sheet: Also write one contact_sheet.jpg tiling thumbnails of the exported frames.
+        """
+        if image_format not in ENCODE_PARAMS:
+            raise ValueError(f"Unsupported frame format: {image_format}")
+        self.folder = folder
+        self.image_format = image_format
+        self.params = ENCODE_PARAMS[image_format](quality)
+        self.contact_sheet = contact_sheet
+        self.thumbnail_width = thumbnail_width
+        self.columns = columns
+        self.max_thumbnails = max_thumbnails
+        self.thumbnails = []
+        self.thumbnail_stride = 1
+        self.seen = set()
+        self.exported = 0
+        self.error = None
+        self.queue = queue.Queue(maxsize=queue_size)
+        os.makedirs(folder, exist_ok=True)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, frame_index, current_time, frame):
+        if frame_index in self.seen:
+            return False
+        if self.error is not None:
+            # The writer has stopped; fail the decode loop now rather than at close()
+            raise self.error
+        self.seen.add(frame_index)
+        self.queue.put((frame_index, current_time, frame))
+        return True
+
+    def _filename(self, frame_index, current_time):
+        minutes = int(current_time // 60)
+        seconds = int(current_time % 60)
+        return os.path.join(self.folder, f"{minutes:02d}-{seconds:02d}_{frame_index:07d}.{self.image_format}")
+
+    def _add_thumbnail(self, frame):
+        if self.exported % self.thumbnail_stride:
+            return
+        height = max(1, int(frame.shape[0] * self.thumbnail_width / frame.shape[1]))
+        self.thumbnails.append(cv2.resize(frame, (self.thumbnail_width, height), interpolation=cv2.INTER_AREA))
+        if len(self.thumbnails) > self.max_thumbnails:
+            # Keep the sheet bounded by thinning what we have and sampling sparser from now on
+            self.thumbnails = self.thumbnails[::2]
+            self.thumbnail_stride *= 2
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error is not None:
+                continue  # keep draining so submit() and close() never block on a full queue
+            frame_index, current_time, frame = item
+            path = self._filename(frame_index, current_time)
+            try:
+                if not cv2.imwrite(path, frame, self.params):
+                    raise OSError(f"Could not write frame {path}")
+                if self.contact_sheet:
+                    self._add_thumbnail(frame)
+            except Exception as e:
+                self.error = e
+                continue
+            self.exported += 1
+
+    def write_contact_sheet(self):
+        if not self.thumbnails:
+            return None
+        height = max(t.shape[0] for t in self.thumbnails)
+        rows = -(-len(self.thumbnails) // self.columns)
+        sheet = np.zeros((rows * height, self.columns * self.thumbnail_width, 3), np.uint8)
+        for i, thumbnail in enumerate(self.thumbnails):
+            row, column = divmod(i, self.columns)
+            sheet[row * height:row * height + thumbnail.shape[0],
+                  column * self.thumbnail_width:(column + 1) * self.thumbnail_width] = thumbnail
+        path = os.path.join(self.folder, "contact_sheet.jpg")
+        cv2.imwrite(path, sheet, [cv2.IMWRITE_JPEG_QUALITY, 85])
+        return path
+
+    def close(self):
+        """
+        Waits for the queued frames to be written. Raises the writer's error if it failed.
+        """
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+        if self.contact_sheet:
+            self.write_contact_sheet()
+        return self.exported
@@ -1,13 +1,22 @@
+import asyncio
 import os
 import json
+import time
 from multiprocessing import Lock
 
+from cancellation import cancelled
+from output_locks import OutputLocks
+import throughput
+import profiling
+
 
 class FileOperationInvoker:
-    def __init__(self, lock=None):
+    def __init__(self, lock=None, store=None):
         self.commands = []
         self.history = []
         self.lock = lock
+        self.store = store
+        self.stored_outputs = set()
 
     def add_to_history(self, command):
         self.history.append({'command': command.__class__.__name__,
@@ -23,10 +32,102 @@ class FileOperationInvoker:
     def add_command(self, command):
         self.commands.append(command)
 
+    def store_key(self, command):
+        if self.store is None:
+            return None
+        try:
+            return self.store.command_key(command)
+        except OSError:
+            return None
+
+    def restore_from_store(self, command, key):
+        if key is None:
+            return False
+        destination = command.planned_output_path()
+        if not self.store.fetch(key, destination):
+            return False
+        print(f"Reusing stored output for {command.__class__.__name__}: {destination}")
+        command.finish_cached()
+        self.stored_outputs.add(destination)
+        return True
+
+    def record_throughput(self, command, started, cached):
+        # A cached run did no work and would drag the learned rate towards zero
+        if command.status == "Success" and not cached:
+            throughput.record(command, time.monotonic() - started)
+
+    def save_to_store(self, command, key):
+        if key is None or command.status != "Success":
+            return
+        if command.output_path and os.path.isfile(command.output_path):
+            self.store.put(key, command.output_path)
+            self.stored_outputs.add(command.output_path)
+
+    def remove_intermediates(self, commands):
+        # The store keeps a link to each intermediate, so the scattered copy can go
+        for command in commands:
+            output_path = getattr(command, 'output_path', None)
+            if command.intermediate and output_path in self.stored_outputs and os.path.isfile(output_path):
+                os.remove(output_path)
+
+    def output_locks(self, command):
+        try:
+            return OutputLocks(command.output_paths())
+        except OSError:
+            return OutputLocks([])  # inputs missing; the command reports it when it runs
+
+    def adopt_output(self, command, locks):
+        if not locks.written_by_holder():
+            return False
+        print(f"Reusing output of a concurrent run for {command.__class__.__name__}: {command.planned_output_path()}")
+        command.adopt_output()
+        return True
+
+    def run_command(self, command):
+        name = command.__class__.__name__
+        with profiling.span(name, input=self.input_name(command)), profiling.profile_job(name):
+            key = self.store_key(command)
+            locks = self.output_locks(command)
+            if cancelled() or not locks.acquire(self.input_name(command)):
+                command.status, command.reason = "Failed", "Cancelled"
+            else:
+                try:
+                    if not self.adopt_output(command, locks) and not self.restore_from_store(command, key):
+                        started = time.monotonic()
+                        cached = command.is_cached()
+                        command.execute()
+                        self.record_throughput(command, started, cached)
+                        self.save_to_store(command, key)
+                finally:
+                    locks.release()
+        self.add_to_history(command)
+
+    async def run_command_async(self, command, runner):
+        label = self.input_name(command)
+        with profiling.span(command.__class__.__name__, tid=label, input=label):
+            # Keys and output paths may hash a whole input (PrepareAudioCommand); keep it off the event loop
+            loop = asyncio.get_running_loop()
+            key = await loop.run_in_executor(None, self.store_key, command)
+            locks = await loop.run_in_executor(None, self.output_locks, command)
+            await locks.acquire_async(label)
+            try:
+                if not self.adopt_output(command, locks) and not self.restore_from_store(command, key):
+                    started = time.monotonic()
+                    cached = command.is_cached()
+                    await command.execute_async(runner)
+                    self.record_throughput(command, started, cached)
+                    self.save_to_store(command, key)
+            finally:
+                locks.release()
+        self.add_to_history(command)
+
+    def input_name(self, command):
+        return os.path.basename(getattr(command, 'file_path', None) or command.video_path or '')
+
     def execute_commands(self):
         for command in self.commands:
-            command.execute()
-            self.add_to_history(command)
+            self.run_command(command)
+        self.remove_intermediates(self.commands)
 
     def print_history(self, file_path):
         if self.lock:
@@ -45,12 +146,13 @@ class FileOperationInvoker:
         # for command, inputfiles, reason in Failed_commands:
         #     print(f"{command}: {inputfiles} -> {reason}")
 
-        old_history = []
-        if os.path.exists(file_path):
-            with open(file_path, 'r') as f:
-                old_history = json.load(f)
-        with open(file_path, 'w') as f:
-            json.dump(self.history + old_history, f, indent=4)
+        with profiling.span("history json.dump"):
+            old_history = []
+            if os.path.exists(file_path):
+                with open(file_path, 'r') as f:
+                    old_history = json.load(f)
+            with open(file_path, 'w') as f:
+                json.dump(self.history + old_history, f, indent=4)
 
         if self.lock:
             self.lock.release()
@@ -0,0 +1,209 @@
+# job_manager.py
+#
+# Background job manager for the interactive menu. It is a BatchExecutor whose
+# scheduling loop runs on its own thread, so submitting work returns at once
+# and the menu stays usable while jobs run. Queued jobs start in priority
+# order (lower numbers first) and some ffmpeg slots are kept for interactive
+# jobs, so a remux picked during a long batch starts right away instead of
+# behind it. Jobs made only of ffmpeg-backed commands run on one asyncio event
+# loop thread, wrapped in a LoopTask that looks like a worker Process to the
+# executor.
+import asyncio
+import concurrent.futures
+import threading
+import time
+
+from async_runner import AsyncFfmpegRunner, is_ffmpeg_job
+from cancellation import KILL_GRACE, cleanup_partials
+from executor import BatchExecutor, job_folders, job_stems
+from invoker import FileOperationInvoker
+from planner import job_seconds
+from throughput import format_seconds
+
+INTERACTIVE_PRIORITY = 0  # quick jobs picked from the menu: remux, replace audio, join
+BATCH_PRIORITY = 10  # frame-level and re-encoding batches
+
+
+class LoopTask:
+    def __init__(self, commands, future):
+        """
+        A job running on the manager's event loop, with the parts of the
+        Process interface the executor uses.
+        """
+        self.commands = commands
+        self.future = future
+
+    def is_alive(self):
+        return not self.future.done()
+
+    def join(self, timeout=None):
+        concurrent.futures.wait([self.future], timeout=timeout)
+
+    def terminate(self):
+        # Cancels the task: the runner kills ffmpeg's process group and the partial output is discarded
+        self.future.cancel()
+
+    @property
+    def exitcode(self):
+        if not self.future.done():
+            return None
+        if self.future.cancelled() or self.future.exception() is not None:
+            return 1
+        return 0 if all(command.status == "Success" for command in self.commands) else 1
+
+
+class JobManager(BatchExecutor):
+    def __init__(self, max_workers=None, admission=None, store=None, poll_interval=0.5, budget=None,
+                 max_concurrent_ffmpeg=None, ffmpeg_timeout=None, reserved_slots=1):
+        """
+        :param max_concurrent_ffmpeg: ffmpeg-only jobs running at once on the event loop.
+        :param ffmpeg_timeout: Seconds per ffmpeg call, None for no limit.
+        :param reserved_slots: ffmpeg slots only jobs at INTERACTIVE_PRIORITY may use; the
+            interactive jobs (remux, replace audio, join) are all ffmpeg-only.
+        Other parameters as for BatchExecutor.
+        """
+        super().__init__(max_workers, admission, store, poll_interval, budget)
+        self.max_concurrent_ffmpeg = max_concurrent_ffmpeg or self.max_workers
+        self.ffmpeg_timeout = ffmpeg_timeout
+        self.reserved_slots = min(reserved_slots, self.max_concurrent_ffmpeg - 1)
+        self.invoker = FileOperationInvoker(store=store)
+        self.lock = threading.RLock()
+        self.stopping = threading.Event()
+        self.loop = None
+        self.runner = None
+        self.thread = None
+
+    def start(self):
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="ffmpeg jobs", daemon=True).start()
+        self.runner = asyncio.run_coroutine_threadsafe(self._make_runner(), self.loop).result()
+        self.thread = threading.Thread(target=self._schedule, name="job manager", daemon=True)
+        self.thread.start()
+        return self
+
+    async def _make_runner(self):
+        # Admission is decided by the manager before a job reaches the loop
+        return AsyncFfmpegRunner(max_concurrent=self.max_concurrent_ffmpeg, timeout=self.ffmpeg_timeout,
+                                 show_progress=False)
+
+    def _schedule(self):
+        while not self.stopping.is_set():
+            with self.lock:
+                self.step()
+            self.stopping.wait(self.poll_interval)
+
+    def submit(self, commands, priority=BATCH_PRIORITY, label=None):
+        with self.lock:
+            return super().submit(commands, priority, label)
+
+    def can_start(self, job):
+        if is_ffmpeg_job(job.commands):
+            slots = sum(isinstance(running.process, LoopTask) for running in self.running)
+            limit = self.max_concurrent_ffmpeg
+            if job.priority > INTERACTIVE_PRIORITY:
+                limit -= self.reserved_slots
+            return slots < limit
+        return sum(not isinstance(running.process, LoopTask) for running in self.running) < self.max_workers
+
+    def _start(self, job):
+        if not is_ffmpeg_job(job.commands):
+            super()._start(job)
+            return
+        future = asyncio.run_coroutine_threadsafe(self.runner.run_job(job.commands, self.invoker), self.loop)
+        job.process = LoopTask(job.commands, future)
+        job.started_at = time.time()
+        job.status = "Running"
+        self.queued.remove(job)
+        self.running.append(job)
+
+    def _reap(self):
+        for job in self.running:
+            if job.cancel_deadline is not None and time.monotonic() > job.cancel_deadline and job.process.is_alive():
+                job.process.terminate()
+        reaped = len(self.finished)
+        super()._reap()
+        for job in self.finished[reaped:]:
+            if job.cancel_deadline is None:
+                # Actual against predicted; each command's own times go to the throughput log
+                print(f"\nJob {job.id} {job.status.lower()} after {format_seconds(time.time() - job.started_at)} "
+                      f"(predicted {format_seconds(job_seconds(job.commands))}): {job.label}")
+                continue
+            job.status, job.reason = "Cancelled", "Cancelled"
+            cleanup_partials(job_folders([job.commands]), job_stems(job.commands))
+
+    def find(self, job_id):
+        for job in self.running + self.queued + self.finished:
+            if job.id == job_id:
+                return job
+        return None
+
+    def jobs(self):
+        with self.lock:
+            return list(self.running) + sorted(self.queued, key=lambda job: (job.priority, job.id)) + list(self.finished)
+
+    def set_priority(self, job_id, priority):
+        """
+        Changes the priority of a queued job. Returns False if no such job is queued.
+        """
+        with self.lock:
+            job = self.find(job_id)
+            if job is None or job.status != "Queued":
+                return False
+            job.priority = priority
+            return True
+
+    def cancel_job(self, job_id, grace=KILL_GRACE):
+        """
+        Cancels one job. A queued job is dropped; a running one is asked to stop
+        and terminated after `grace` seconds. Returns False if the job has already finished.
+        """
+        with self.lock:
+            job = self.find(job_id)
+            if job is None or job in self.finished:
+                return False
+            if job.status == "Queued":
+                self._cancel_queued(job)
+                return True
+            job.status = "Cancelling"
+            job.cancel_deadline = time.monotonic() + grace
+            if job.cancel_event is not None:
+                job.cancel_event.set()
+            else:
+                job.process.terminate()
+            return True
+
+    def active(self):
+        with self.lock:
+            return len(self.queued) + len(self.running)
+
+    def wait(self):
+        while self.active():
+            time.sleep(self.poll_interval)
+
+    def shutdown(self, cancel=False, grace=KILL_GRACE):
+        """
+        Stops the scheduling thread, after cancelling outstanding jobs if asked
+        to. Returns the partial files removed by the cancel.
+        """
+        removed = []
+        if cancel:
+            with self.lock:
+                removed = self.cancel(grace)
+        else:
+            self.wait()
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        return removed
+
+    def describe(self):
+        lines = []
+        now = time.time()
+        for job in self.jobs():
+            elapsed = int(now - job.submitted_at)
+            reason = f" ({job.reason})" if job.reason and job.reason != job.status else ""
+            lines.append(f"{job.id:>4}  {job.status:<10} p{job.priority:<3} {elapsed // 60:>4}m{elapsed % 60:02d}s  "
+                         f"{job.label}{reason}")
+        return "\n".join(lines) if lines else "No jobs"
@@ -0,0 +1,101 @@
+# luma.py
+#
+# Reads the brightness of a video and nothing else. ffmpeg decodes it and
+# hands over only the luma (Y) plane as a gray rawvideo pipe: one byte per
+# pixel instead of OpenCV's three, optionally cropped and downscaled by ffmpeg
+# before it reaches Python, and already uint8 for the detector. Luma is
+# expanded to full range on the way, so black is 0 as in OpenCV's BGR frames
+# rather than video-range 16. The analysis passes (triage, black bar
+# detection) read frames this way; only the code that writes frames decodes
+# them in colour.
+import re
+import subprocess
+import tempfile
+
+import numpy as np
+
+from cancellation import kill_process_group
+
+PTS_PATTERN = re.compile(r"pts_time:\s*(-?[\d.]+)")
+
+
+def luma_args(video_path, width, height, crop=None, keyframes_only=False, interval=None, timestamps=False,
+              threads=None):
+    filters = []
+    if interval is not None:
+        filters.append(f"fps=1/{interval}")
+    if crop is not None:
+        left, top, right, bottom = crop
+        filters.append(f"crop={right - left}:{bottom - top}:{left}:{top}")
+    filters.append(f"scale={width}:{height}:out_range=full")
+    filters.append("format=gray")
+    if timestamps:
+        filters.append("showinfo")
+    args = ['ffmpeg', '-hide_banner', '-nostats', '-nostdin']
+    if keyframes_only:
+        args += ['-skip_frame', 'nokey']
+    if threads:
+        # Decoding is the work here, so the budget's share goes to the decoder
+        args += ['-threads', str(threads)]
+    return args + ['-i', video_path, '-an', '-sn', '-vf', ",".join(filters), '-fps_mode', 'passthrough',
+                   '-pix_fmt', 'gray', '-f', 'rawvideo', 'pipe:1']
+
+
+class LumaReader:
+    def __init__(self, video_path, width, height, crop=None, keyframes_only=False, interval=None,
+                 timestamps=False, threads=None):
+        """
+        Iterates over a video's frames as (height, width) uint8 luma arrays.
+        Use it as a context manager; ffmpeg is stopped on exit if the frames
+        weren't all read.
+        :param video_path: Path to the video file.
+        :param width: Width of the frames handed out, after cropping.
+        :param height: Height of the frames handed out, after cropping.
+        :param crop: (left, top, right, bottom) in source pixels, or None for the whole frame.
+        :param keyframes_only: Decode only the keyframes.
+        :param interval: Keep one frame every `interval` seconds.
+        :param timestamps: Collect each frame's time in `times` (filled on exit).
+        :param threads: Decoder threads, None to let ffmpeg decide.
+        """
+        self.args = luma_args(video_path, width, height, crop, keyframes_only, interval, timestamps, threads)
+        self.width = width
+        self.height = height
+        self.timestamps = timestamps
+        self.times = []
+        self.frames = 0
+        self.exhausted = False
+        self.returncode = None
+        self.process = None
+        self.log = None
+
+    def __enter__(self):
+        # showinfo reports on stderr; a file keeps it from blocking the pipe
+        self.log = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(self.args, stdout=subprocess.PIPE, stderr=self.log,
+                                        start_new_session=True)
+        return self
+
+    def __iter__(self):
+        frame_size = self.width * self.height
+        while True:
+            raw = self.process.stdout.read(frame_size)
+            if len(raw) < frame_size:
+                self.exhausted = True
+                return
+            self.frames += 1
+            yield np.frombuffer(raw, np.uint8).reshape(self.height, self.width)
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.process.stdout.close()
+        if exc_type is not None or not self.exhausted:
+            # Failed or stopped early: don't let ffmpeg decode the rest
+            kill_process_group(self.process)
+        self.returncode = self.process.wait()
+        if self.timestamps:
+            self.log.seek(0)
+            self.times = [float(match.group(1))
+                          for match in PTS_PATTERN.finditer(self.log.read().decode(errors='replace'))]
+        self.log.close()
+        if exc_type is None and self.exhausted and self.returncode != 0 and not self.frames:
+            raise subprocess.CalledProcessError(self.returncode, self.args)
+        return False
@@ -1,11 +1,21 @@
 # main.py
 from file_dialogue import FileDialogue
 from invoker import FileOperationInvoker
-from commands import RemuxCommand, CorrectNameCommand, ReplaceAudioCommand, RemoveBlackBarsCommand, VideoCropperCommand, AVItoMP4Command
+from commands import RemuxCommand, JoinPartsCommand, group_parts, PrepareAudioCommand, ReplaceAudioCommand, DeadAirTrimCommand, RemoveBlackBarsCommand, FanOutCommand, VideoCropperCommand, AVItoMP4Command, matching_audio_path
+from distributed import JobQueue
+from admission import DiskAdmissionController
+from job_manager import JobManager, INTERACTIVE_PRIORITY, BATCH_PRIORITY
+from artifact_store import ArtifactStore
+from planner import COMMAND_COST, dry_run_report, plan_batch
+from throughput import THROUGHPUT_LOG, ThroughputModel
+import triage
+from rename_engine import BulkRenamer
+from thread_budget import ThreadBudget, set_budget
+import profiling
 import os
-from multiprocessing import Process, cpu_count
+import threading
+from multiprocessing import cpu_count
 import multiprocessing
-from multiprocessing import Lock
 
 OPTIONS = {
     "1": "Remux",
@@ -14,15 +24,61 @@ OPTIONS = {
     "4": "Remove Black Bars",
     "5": "Crop Video",
     "6": "Convert AVI to MP4",
-    "7": "Custom Command"
+    "7": "Custom Command",
+    "8": "Fan-out (repaired master + cropped + proxy)",
+    "9": "Join parts",
+    "10": "List jobs",
+    "11": "Reprioritise job",
+    "12": "Cancel job",
+    "13": "Dry run on/off",
+    "14": "Triage folder for black bars"
 }
 
+# List the jobs, their outputs and estimated time and disk space instead of running them
+DRY_RUN = False
 DELETE_ORIGINAL_FLV = False
 MOVE_FLV_TO_SUBFOLDER = "flv-originals"
 AUTOMATCH_AUDIO = True
 AUTOMATCH_AUDIOSUBFOLDER = "auphonic-results"
 MOVE_ORIG = "original-mp4"
-CROP_DIMENSIONS = (0, 0, 1680, 866)  # (x, y, width, height)
+# Custom chains first cut silent, idle heads and tails (into trimmed/) so later stages process less
+TRIM_DEAD_AIR = False
+# (x1, y1, x2, y2), or "auto" to detect the content area of each video
+CROP_DIMENSIONS = "auto"
+# Shared folder of a distributed job queue (see distributed.py). When set, jobs
+# are enqueued there and run by workers on any node instead of locally.
+DISTRIBUTED_QUEUE = None
+HISTORY_FILE = "history.json"
+# ffmpeg-only jobs run from one event loop instead of one Python process each
+MAX_CONCURRENT_FFMPEG = cpu_count()
+FFMPEG_TIMEOUT = None  # seconds per ffmpeg call, None for no limit
+# Wall-clock limit in seconds per command class, e.g. {"RemoveBlackBarsCommand": 4 * 3600}
+COMMAND_TIMEOUTS = {}
+MAX_WORKERS = cpu_count()  # worker processes for frame-level jobs
+# ffmpeg slots kept free of batch jobs so interactive ones (remux, replace audio, join) start at once
+RESERVED_INTERACTIVE_SLOTS = 1
+# Encoder threads shared by all running jobs (x264, OpenCV, moviepy); None lets each pick its own
+THREAD_BUDGET = cpu_count()
+# Most threads one job starts with; ffmpeg keeps them for its whole run. None for half the budget
+MAX_THREADS_PER_JOB = None
+# Jobs only start while their projected output fits the free disk space,
+# keeping at least this much free (bytes, and fraction of the device)
+DISK_RESERVE_BYTES = 5 * 1024 ** 3
+DISK_RESERVE_FRACTION = 0.02
+# Content-addressed store for command outputs, reused across reruns and
+# duplicate files. Keep it on the same device as the videos. None disables it.
+ARTIFACT_STORE = None
+ARTIFACT_STORE_MAX_BYTES = 200 * 1024 ** 3
+# Triage decodes only keyframes; files with fewer than this many get a sampled full decode instead
+TRIAGE_MIN_KEYFRAMES = 8
+TRIAGE_SAMPLE_INTERVAL = 10  # seconds between samples of that fallback
+TRIAGE_REPORT = "triage_report.json"
+# Width of the low-bitrate review copy written by the fan-out option
+PROXY_WIDTH = 640
+# Opt-in instrumentation: Chrome trace + summary table on exit
+PROFILE_DIR = None  # e.g. "profiles"
+PROFILE_CPROFILE = False  # also write a cProfile .prof per job
+PROFILE_TRACEMALLOC = False  # also write the top allocations per job
 
 
 def show_main_menu():
@@ -46,37 +102,169 @@ def get_selected_option():
         return "0"
 
 
-def process_files(commands):
-    invoker = FileOperationInvoker()
-    for command in commands:
-        invoker.add_command(command)
-    invoker.execute_commands()
+_manager = None
+
+
+def get_manager():
+    """
+    The background job manager, started on first use.
+    """
+    global _manager
+    if _manager is None:
+        admission = DiskAdmissionController(DISK_RESERVE_BYTES, DISK_RESERVE_FRACTION)
+        store = ArtifactStore(ARTIFACT_STORE, ARTIFACT_STORE_MAX_BYTES) if ARTIFACT_STORE else None
+        budget = ThreadBudget(THREAD_BUDGET, MAX_THREADS_PER_JOB) if THREAD_BUDGET else None
+        set_budget(budget)  # ffmpeg-only jobs run in this process
+        _manager = JobManager(max_workers=MAX_WORKERS, admission=admission, store=store, budget=budget,
+                              max_concurrent_ffmpeg=MAX_CONCURRENT_FFMPEG, ffmpeg_timeout=FFMPEG_TIMEOUT,
+                              reserved_slots=RESERVED_INTERACTIVE_SLOTS).start()
+    return _manager
+
+
+def run_jobs(jobs, priority=BATCH_PRIORITY):
+    """
+    Submits each job (a list of commands) to the background job manager and
+    returns at once, or hands the jobs to the distributed queue when
+    DISTRIBUTED_QUEUE is set. Jobs made only of ffmpeg-backed commands are
+    supervised by one asyncio event loop; worker processes are kept for the
+    frame-level NumPy work.
+    The batch is validated and ordered longest-first before anything starts.
+    With DRY_RUN, the plan is printed instead.
+    """
+    model = ThroughputModel(THROUGHPUT_LOG, prior=COMMAND_COST)
+    jobs, _ = plan_batch(jobs, model=model)
+    if not jobs:
+        return
+    if DRY_RUN:
+        slots = MAX_CONCURRENT_FFMPEG if priority <= INTERACTIVE_PRIORITY else max(
+            1, MAX_CONCURRENT_FFMPEG - RESERVED_INTERACTIVE_SLOTS)
+        print(dry_run_report(jobs, model, MAX_WORKERS, slots))
+        return
+    for commands in jobs:
+        for command in commands:
+            if command.__class__.__name__ in COMMAND_TIMEOUTS:
+                command.timeout = COMMAND_TIMEOUTS[command.__class__.__name__]
+    if DISTRIBUTED_QUEUE is not None:
+        queue = JobQueue(DISTRIBUTED_QUEUE)
+        for commands in jobs:
+            queue.enqueue(commands)
+        watch_queue(queue)
+        print(f"Enqueued {len(jobs)} jobs to {DISTRIBUTED_QUEUE}, results are collected in the background")
+        return
+    manager = get_manager()
+    # Duplicate selections attach to the job already doing the work
+    submitted = {manager.submit(commands, priority).id for commands in jobs}
+    print(f"Queued {len(submitted)} jobs at priority {priority}, see option 10 for progress")
+
+
+_queue_watcher = None
+
+
+def watch_queue(queue):
+    """
+    Starts reaping and collecting the distributed queue on a background thread, once.
+    """
+    global _queue_watcher
+    if _queue_watcher is None:
+        _queue_watcher = threading.Thread(target=queue.watch, kwargs={'history_file': HISTORY_FILE},
+                                          name="distributed queue", daemon=True)
+        _queue_watcher.start()
+
+
+def list_jobs():
+    print(get_manager().describe() if _manager is not None else "No jobs")
+
+
+def read_job_id():
+    try:
+        return int(input("Job id: "))
+    except ValueError:
+        print("Invalid job id")
+        return None
+
+
+def reprioritise_job():
+    list_jobs()
+    job_id = read_job_id()
+    if job_id is None:
+        return
+    try:
+        priority = int(input(f"New priority ({INTERACTIVE_PRIORITY} runs first, batches default to {BATCH_PRIORITY}): "))
+    except ValueError:
+        print("Invalid priority")
+        return
+    if not get_manager().set_priority(job_id, priority):
+        print(f"Job {job_id} is not queued")
+
+
+def cancel_job():
+    list_jobs()
+    job_id = read_job_id()
+    if job_id is None:
+        return
+    if get_manager().cancel_job(job_id):
+        print(f"Cancelling job {job_id}")
+    else:
+        print(f"Job {job_id} has already finished")
+
+
+def toggle_dry_run():
+    global DRY_RUN
+    DRY_RUN = not DRY_RUN
+    print(f"Dry run {'on: jobs are planned, not run' if DRY_RUN else 'off'}")
+
+
+def shutdown_jobs():
+    """
+    Before exiting, waits for outstanding jobs or cancels them.
+    """
+    if _manager is None:
+        return
+    outstanding = _manager.active()
+    cancel = False
+    if outstanding:
+        try:
+            cancel = input(f"{outstanding} jobs are still queued or running. Cancel them? [y/N] ").strip().lower() == "y"
+            if not cancel:
+                print("Waiting for jobs to finish, Ctrl+C cancels them...")
+                _manager.wait()
+        except KeyboardInterrupt:
+            cancel = True
+    if cancel:
+        print("\nCancelling jobs, waiting for running jobs to stop...")
+    removed = _manager.shutdown(cancel=cancel)
+    if cancel:
+        print(f"Jobs cancelled, removed {len(removed)} partial outputs")
+
+
+def report_profile():
+    if profiling.enabled():
+        profiling.write_report()
 
 
 def remux_files(file_paths):
-    processes = []
-    for file_path in file_paths:
-        p = Process(target=process_files, args=(
-            [RemuxCommand(file_path, DELETE_ORIGINAL_FLV, MOVE_FLV_TO_SUBFOLDER)],))
-        p.start()
-        processes.append(p)
-    for p in processes:
-        p.join()
+    run_jobs([[RemuxCommand(file_path, DELETE_ORIGINAL_FLV, MOVE_FLV_TO_SUBFOLDER)]
+              for file_path in file_paths], INTERACTIVE_PRIORITY)
 
 
 def correct_name_files(file_paths):
-    processes = []
-    for file_path in file_paths:
-        p = Process(target=process_files, args=(
-            [CorrectNameCommand(file_path)],))
-        p.start()
-        processes.append(p)
-    for p in processes:
-        p.join()
+    # Renaming is a metadata operation: plan and apply it in-process in one pass
+    renamer = BulkRenamer()
+    plan = renamer.plan(file_paths)
+    if not plan.renames and not plan.conflicts:
+        print("Nothing to rename")
+        return
+    print(plan.describe())
+    if DRY_RUN:
+        return
+    if not plan.renames or input(f"Apply {len(plan)} renames? [y/N] ").strip().lower() != "y":
+        return
+    applied = renamer.apply(plan)
+    print(f"Renamed {len(applied)} files")
 
 
 def replace_audio_files(video_paths):
-    processes = []
+    jobs = []
     for video_path in video_paths:
         if AUTOMATCH_AUDIO and (AUTOMATCH_AUDIOSUBFOLDER in os.listdir(os.path.dirname(video_path))):
             audio_folder_path = os.path.join(
@@ -87,61 +275,91 @@ def replace_audio_files(video_paths):
             file_dialogue = FileDialogue()
             audio_path = file_dialogue.open_file_dialogue(
                 "wav", multiple=False, title="Select audio file")
-        p = Process(target=process_files, args=([ReplaceAudioCommand(
-            video_path, audio_path, auto_match_audio=AUTOMATCH_AUDIO, audio_subfolder=AUTOMATCH_AUDIOSUBFOLDER, move_old_mp4=MOVE_ORIG)],))
-        p.start()
-        processes.append(p)
-    for p in processes:
-        p.join()
-    print("All processes finished for ReplaceAudioCommand")
+        jobs.append([ReplaceAudioCommand(
+            video_path, audio_path, auto_match_audio=AUTOMATCH_AUDIO, audio_subfolder=AUTOMATCH_AUDIOSUBFOLDER, move_old_mp4=MOVE_ORIG)])
+    run_jobs(jobs, INTERACTIVE_PRIORITY)
 
 
 def remove_black_bars_files(file_paths):
-    processes = []
-    for file_path in file_paths:
-        p = Process(target=process_files, args=([RemoveBlackBarsCommand(
-            video_path=file_path, crop_dimensions=CROP_DIMENSIONS)],))
-        p.start()
-        processes.append(p)
-    for p in processes:
-        p.join()
+    run_jobs([[RemoveBlackBarsCommand(video_path=file_path, crop_dimensions=CROP_DIMENSIONS)]
+              for file_path in file_paths])
 
 
 def crop_video_files(file_paths):
-    invoker = FileOperationInvoker()
+    run_jobs([[VideoCropperCommand(file_path, None, crop_dimensions=CROP_DIMENSIONS)]
+              for file_path in file_paths])
+
+
+def fan_out_files(file_paths):
+    # One decode per source feeds the repaired master, the cropped copy and the proxy
+    jobs = []
     for file_path in file_paths:
-        invoker.add_command(VideoCropperCommand(
-            file_path, None, crop_dimensions=CROP_DIMENSIONS))
-    invoker.execute_commands()
+        folder, name = os.path.dirname(file_path), os.path.basename(file_path).rsplit('.', 1)[0] + ".mp4"
+        sinks = [{'output_path': os.path.join(folder, "cropped", name), 'crop': CROP_DIMENSIONS},
+                 {'output_path': os.path.join(folder, "proxy", name), 'width': PROXY_WIDTH,
+                  'crf': '30', 'preset': 'veryfast', 'audio_bitrate': '96k'}]
+        jobs.append([FanOutCommand(file_path, sinks)])
+    run_jobs(jobs)
+
+
+def join_parts_files(file_paths):
+    groups, others = group_parts(file_paths)
+    for path in others:
+        print(f"Skipping {os.path.basename(path)}: not named <name>_Part<n>-...")
+    run_jobs([[JoinPartsCommand(parts)] for parts in groups.values()], INTERACTIVE_PRIORITY)
+
+
+def triage_folder(folder):
+    paths = triage.find_videos(folder)
+    if not paths:
+        print("No videos found")
+        return
+    get_manager()  # triage takes its decoder threads from the jobs' budget
+    print(f"Scanning keyframes of {len(paths)} videos...")
+    results = triage.triage(paths)
+    # Long-GOP files give too few keyframes to judge; sample them at a fixed interval instead
+    sparse = [result['path'] for result in results if 'error' not in result and result['samples'] < TRIAGE_MIN_KEYFRAMES]
+    if sparse:
+        resampled = {result['path']: result for result in triage.triage(sparse, interval=TRIAGE_SAMPLE_INTERVAL)}
+        results = triage.rank(resampled.get(result['path'], result) for result in results)
+    print(triage.describe(results))
+    triage.save_report(results, TRIAGE_REPORT)
+    print(f"Report saved to {TRIAGE_REPORT}")
+    suspected = [result['path'] for result in results if result['flagged']]
+    if suspected and input(f"Queue black bar removal for the {len(suspected)} suspected files? [y/N] ").strip().lower() == "y":
+        remove_black_bars_files(suspected)
 
 
 def convert_avi_to_mp4_files(file_paths):
-    processes = []
-    for file_path in file_paths:
-        p = Process(target=process_files, args=(
-            [AVItoMP4Command(file_path)],))
-        p.start()
-        processes.append(p)
-    for p in processes:
-        p.join()
-    print("All processes finished for AVItoMP4Command")
+    run_jobs([[AVItoMP4Command(file_path)] for file_path in file_paths])
 
 
 def custom_command_files(file_paths):
-    processes = []
+    # Audio preparation only needs the WAV, so it runs alongside the video work
+    # and the final ReplaceAudioCommand finds the encoded stream in the cache.
+    # A trimmed chain prepares its trimmed WAV itself.
+    jobs = [[PrepareAudioCommand(audio_path)] for audio_path in
+            (matching_audio_path(file_path, AUTOMATCH_AUDIOSUBFOLDER) for file_path in file_paths)
+            if AUTOMATCH_AUDIO and not TRIM_DEAD_AIR and os.path.isfile(audio_path)]
     for file_path in file_paths:
-        p = Process(target=process_files, args=([RemoveBlackBarsCommand(file_path, crop_dimensions=CROP_DIMENSIONS),
-                                                 AVItoMP4Command(os.path.join(os.path.dirname(
-                                                     file_path), "processed_black_bars", os.path.basename(file_path).rsplit('.', 1)[0] + ".avi")),
-                                                 ReplaceAudioCommand(os.path.join(os.path.dirname(file_path), "processed_black_bars/converted", os.path.basename(file_path).rsplit('.', 1)[0] + ".mp4"), None, auto_match_audio=AUTOMATCH_AUDIO, audio_subfolder=AUTOMATCH_AUDIOSUBFOLDER)],))
-        p.start()
-        processes.append(p)
-    for p in processes:
-        p.join()
-    print("All processes finished for command")
+        chain = []
+        if TRIM_DEAD_AIR:
+            chain.append(DeadAirTrimCommand(file_path, AUTOMATCH_AUDIOSUBFOLDER))
+            file_path = chain[-1].output_path
+        black_bars = RemoveBlackBarsCommand(file_path, crop_dimensions=CROP_DIMENSIONS)
+        # With a store, the intermediate AVI and MP4 live there instead of beside the source
+        to_mp4 = AVItoMP4Command(os.path.join(os.path.dirname(
+            file_path), "processed_black_bars", os.path.basename(file_path).rsplit('.', 1)[0] + ".avi"),
+            move_old_avi=None if ARTIFACT_STORE else 'avi_old')
+        black_bars.intermediate = to_mp4.intermediate = ARTIFACT_STORE is not None
+        jobs.append(chain + [black_bars, to_mp4,
+                     ReplaceAudioCommand(os.path.join(os.path.dirname(file_path), "processed_black_bars/converted", os.path.basename(file_path).rsplit('.', 1)[0] + ".mp4"), matching_audio_path(file_path, AUTOMATCH_AUDIOSUBFOLDER), auto_match_audio=AUTOMATCH_AUDIO, audio_subfolder=AUTOMATCH_AUDIOSUBFOLDER)])
+    run_jobs(jobs)
 
 
 def main():
+    if PROFILE_DIR is not None:
+        profiling.enable(PROFILE_DIR, cprofile=PROFILE_CPROFILE, tracemalloc=PROFILE_TRACEMALLOC)
     while True:
         show_main_menu()
         option = get_selected_option()
@@ -150,6 +368,7 @@ def main():
         file_dialogue = FileDialogue()
 
         if option == "0":
+            shutdown_jobs()
             break
 
         elif option == "1":  # Remux flv to mp4
@@ -183,8 +402,34 @@ def main():
                 "mp4", multiple=True, title="Select Files to process")
             custom_command_files(file_paths)
 
-        # invoker.execute_commands()
-        # invoker.print_history("history.json")
+        elif option == "8":  # Fan-out
+            file_paths = file_dialogue.open_file_dialogue(
+                "all", multiple=True, title="Select video files to fan out")
+            fan_out_files(file_paths)
+
+        elif option == "9":  # Join parts
+            file_paths = file_dialogue.open_file_dialogue(
+                "all", multiple=True, title="Select the parts to join")
+            join_parts_files(file_paths)
+
+        elif option == "10":  # List jobs
+            list_jobs()
+
+        elif option == "11":  # Reprioritise job
+            reprioritise_job()
+
+        elif option == "12":  # Cancel job
+            cancel_job()
+
+        elif option == "13":  # Dry run on/off
+            toggle_dry_run()
+
+        elif option == "14":  # Triage
+            folder = file_dialogue.open_folder_dialogue("Select a folder to triage")
+            if folder:
+                triage_folder(folder)
+
+    report_profile()
 
 
 if __name__ == "__main__":
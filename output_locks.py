@@ -0,0 +1,143 @@
+# output_locks.py
+#
+# Advisory per-output locks shared by every run of the tool on this machine.
+# A command holds an flock on each file it writes for as long as it runs, so
+# two runs processing the same folder can't encode into the same ready/,
+# converted/ or processed_black_bars/ path or race on moving the originals.
+# A command that finds its outputs locked waits, and if the holder wrote them
+# in the meantime it takes them over instead of doing the work again.
+# Lock files live in one folder under the temp directory, named by a hash of
+# the output path, so the video folders stay clean. Where fcntl isn't
+# available (Windows), locking is skipped.
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from cancellation import cancelled
+
+LOCK_FOLDER = os.path.join(tempfile.gettempdir(), "audiovideoassist-locks")
+POLL_INTERVAL = 0.5
+
+
+def lock_file(path):
+    key = hashlib.sha1(os.path.realpath(os.path.abspath(path)).encode()).hexdigest()
+    return os.path.join(LOCK_FOLDER, key + ".lock")
+
+
+def read_started(f):
+    f.seek(0)
+    try:
+        return float(f.read())
+    except ValueError:
+        # The holder hasn't written its start time yet
+        return time.time()
+
+
+class OutputLocks:
+    def __init__(self, paths):
+        """
+        :param paths: Output paths written by one command.
+        """
+        self.paths = sorted(set(os.path.abspath(path) for path in paths))
+        self.files = []
+        self.holder_started = None
+
+    def try_acquire(self):
+        """
+        Takes every lock without blocking, or none of them. Returns True on success.
+        """
+        if fcntl is None:
+            return True
+        os.makedirs(LOCK_FOLDER, exist_ok=True)
+        for path in self.paths:
+            f = open(lock_file(path), 'a+')
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                if self.holder_started is None:
+                    self.holder_started = read_started(f)
+                f.close()
+                self.release()
+                return False
+            self.files.append(f)
+        # The holder's start time tells a waiter which outputs are new
+        started = str(time.time())
+        for f in self.files:
+            f.seek(0)
+            f.truncate()
+            f.write(started)
+            f.flush()
+        return True
+
+    def acquire(self, label=None):
+        """
+        Blocks until every lock is held. Returns False if the batch is cancelled while waiting.
+        """
+        while not self.try_acquire():
+            if label is not None:
+                print(f"Waiting for another run writing the output of {label}")
+                label = None
+            if cancelled():
+                return False
+            time.sleep(POLL_INTERVAL)
+        return True
+
+    async def acquire_async(self, label=None):
+        while not self.try_acquire():
+            if label is not None:
+                print(f"Waiting for another run writing the output of {label}")
+                label = None
+            await asyncio.sleep(POLL_INTERVAL)
+        return True
+
+    def written_by_holder(self):
+        """
+        True if we had to wait and the run holding the locks wrote every output.
+        """
+        if self.holder_started is None or not self.paths:
+            return False
+        return all(os.path.isfile(path) and os.path.getmtime(path) >= self.holder_started
+                   for path in self.paths)
+
+    def release(self):
+        for f in self.files:
+            fcntl.flock(f, fcntl.LOCK_UN)
+            f.close()
+        self.files = []
+
+
+def update_json(path, update):
+    """
+    Read-modify-write of a JSON file shared by concurrent runs. update() changes
+    the loaded dict in place; it is called under the file's lock, and the file is
+    replaced in one rename so readers never see it half written. Returns the
+    updated dict, or None if the batch was cancelled while waiting.
+    """
+    locks = OutputLocks([path])
+    if not locks.acquire():
+        return None
+    try:
+        data = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    data = json.load(f)
+            except ValueError:
+                data = {}
+        update(data)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=4)
+        os.replace(tmp_path, path)
+        return data
+    finally:
+        locks.release()
@@ -0,0 +1,196 @@
+# planner.py
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from admission import estimate_output_size, job_source
+from async_runner import is_ffmpeg_job
+from probe import probe_media
+from throughput import ThroughputModel, format_seconds, work_units
+
+PROBE_THREADS = 16
+
+# Relative processing cost per second of media per megapixel. Stream copies
+# and audio-only stages are nearly free next to decoding every frame.
+COMMAND_COST = {
+    'RemoveBlackBarsCommand': 10.0,
+    'FanOutCommand': 14.0,
+    'VideoCropperCommand': 8.0,
+    'AVItoMP4Command': 6.0,
+    'PrepareAudioCommand': 0.3,
+    'ReplaceAudioCommand': 0.1,
+    'RemuxCommand': 0.05,
+    'JoinPartsCommand': 0.05,
+    'DeadAirTrimCommand': 0.2,
+    'CorrectNameCommand': 0.0,
+}
+DEFAULT_COMMAND_COST = 1.0
+
+
+def _paths_to_probe(commands):
+    paths = [job_source(commands)]
+    for command in commands:
+        audio_path = getattr(command, 'audio_path', None)
+        if audio_path and command.__class__.__name__ == 'ReplaceAudioCommand':
+            paths.append(audio_path)
+    return [path for path in paths if path and os.path.isfile(path)]
+
+
+def probe_all(jobs, max_threads=PROBE_THREADS):
+    """
+    Probes every source and replacement WAV of a batch concurrently.
+    Returns {path: info}; files that fail to probe map to None.
+    """
+    paths = sorted({path for commands in jobs for path in _paths_to_probe(commands)})
+
+    def _probe(path):
+        try:
+            return probe_media(path)
+        except Exception:
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_threads) as pool:
+        return dict(zip(paths, pool.map(_probe, paths)))
+
+
+def _fail(commands, reason):
+    for command in commands:
+        command.status, command.reason = "Failed", reason
+    return False
+
+
+def validate_job(commands, infos):
+    """
+    Checks a job before anything is spawned. Only the first command's input
+    exists yet, later stages are checked against the source's metadata.
+    """
+    first = commands[0]
+    source = job_source(commands)
+    if first.__class__.__name__ == 'ReplaceAudioCommand':
+        if not first.validate_files():
+            return _fail(commands, first.reason)
+    elif hasattr(first, 'is_valid'):
+        if not first.is_valid():
+            return _fail(commands, first.reason)
+    elif not os.path.isfile(source):
+        return _fail(commands, f"File not found: {source}")
+
+    source_info = infos.get(source)
+    produced = set()
+    for command in commands:
+        # Files written by an earlier command of the chain don't exist yet
+        produced.update(path for path in (getattr(command, 'output_path', None),
+                                          getattr(command, 'audio_output_path', None)) if path)
+        if command.__class__.__name__ != 'ReplaceAudioCommand':
+            continue
+        audio_path = command.audio_path
+        if audio_path in produced:
+            continue
+        if not audio_path or not os.path.isfile(audio_path):
+            return _fail(commands, f"File not found: {audio_path}")
+        if not audio_path.lower().endswith('.wav'):
+            return _fail(commands, f"Invalid audio file type: {audio_path.rsplit('.', 1)[1]}")
+        audio_info = infos.get(audio_path)
+        if source_info and audio_info and source_info['duration'] and audio_info['duration']:
+            if not command.check_lengths(source_info['duration'], audio_info['duration']):
+                return _fail(commands, command.reason)
+    return True
+
+
+def annotate(commands, info, model):
+    """
+    Attaches the work, predicted seconds and estimated output bytes of each
+    command of a job, which the invoker logs against the actual time.
+    """
+    units = work_units(info)
+    for command in commands:
+        command.work_units = units
+        command.predicted_seconds = model.predict(command.__class__.__name__, units)
+        try:
+            command.estimated_bytes = int(estimate_output_size(command, info)) if info else 0
+        except (KeyError, TypeError, OSError):
+            command.estimated_bytes = 0
+
+
+def job_seconds(commands):
+    return sum(getattr(command, 'predicted_seconds', 0) for command in commands)
+
+
+def plan_batch(jobs, max_threads=PROBE_THREADS, model=None):
+    """
+    Validates a batch and orders it longest-processing-time-first, which keeps
+    a long recording from starting last and becoming the tail of the batch.
+    Each job is annotated with its predicted run time from the throughput
+    model (see throughput.py).
+    Returns (planned_jobs, rejected_jobs).
+    """
+    model = model or ThroughputModel(prior=COMMAND_COST)
+    infos = probe_all(jobs, max_threads)
+    planned, rejected = [], []
+    for commands in jobs:
+        if validate_job(commands, infos):
+            planned.append(commands)
+        else:
+            rejected.append(commands)
+            print(f"Skipping {os.path.basename(job_source(commands))}: {commands[0].reason}")
+    for commands in planned:
+        annotate(commands, infos.get(job_source(commands)), model)
+    planned.sort(key=job_seconds, reverse=True)
+    return planned, rejected
+
+
+def simulate(jobs, max_workers, max_concurrent_ffmpeg):
+    """
+    Replays the batch on the pool: each job, in order, starts on the slot that
+    frees up first. ffmpeg-only jobs get their own slots on the event loop.
+    Returns (finish time of each job, wall time of the batch) in seconds.
+    """
+    slots = {True: [0.0] * max(1, max_concurrent_ffmpeg), False: [0.0] * max(1, max_workers)}
+    finished = []
+    for commands in jobs:
+        loads = slots[is_ffmpeg_job(commands)]
+        slot = loads.index(min(loads))
+        loads[slot] += job_seconds(commands)
+        finished.append(loads[slot])
+    return finished, max(slots[True] + slots[False])
+
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def dry_run_report(jobs, model, max_workers, max_concurrent_ffmpeg):
+    """
+    Describes a planned batch without running it: each job's outputs, predicted
+    time and output size, the batch's wall time on the pool and the disk space
+    it needs on each device.
+    """
+    finished, wall_time = simulate(jobs, max_workers, max_concurrent_ffmpeg)
+    lines = [f"Dry run: {len(jobs)} jobs, nothing is started"]
+    needed = {}
+    for number, (commands, finish) in enumerate(zip(jobs, finished), 1):
+        size = sum(getattr(command, 'estimated_bytes', 0) for command in commands)
+        lines.append(f"{number:>4}. {os.path.basename(job_source(commands))}: "
+                     f"{format_seconds(job_seconds(commands))}, {format_bytes(size)}, done after {format_seconds(finish)}")
+        for command in commands:
+            for path in command.dry_run_outputs():
+                lines.append(f"        {command.__class__.__name__} -> {path}")
+        folder = os.path.dirname(os.path.abspath(job_source(commands)))
+        device = os.stat(folder).st_dev
+        needed.setdefault(device, [folder, 0])[1] += size
+    lines.append(f"Wall time: {format_seconds(wall_time)} on {max_workers} workers and {max_concurrent_ffmpeg} "
+                 f"ffmpeg slots, done around {time.strftime('%H:%M', time.localtime(time.time() + wall_time))}")
+    for folder, size in needed.values():
+        free = shutil.disk_usage(folder).free
+        warning = "" if size < free else "  NOT ENOUGH SPACE"
+        lines.append(f"Disk: {format_bytes(size)} needed, {format_bytes(free)} free on {folder}{warning}")
+    unlearned = sorted({command.__class__.__name__ for commands in jobs for command in commands
+                        if not model.learned(command.__class__.__name__)})
+    if unlearned:
+        lines.append(f"No past runs yet, rough estimates for: {', '.join(unlearned)}")
+    return "\n".join(lines)
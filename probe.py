@@ -0,0 +1,70 @@
+# probe.py
+import json
+import os
+import subprocess
+from functools import lru_cache
+
+from container_headers import read_header
+import profiling
+
+
+def _parse_rate(rate):
+    if not rate or rate in ('0/0', 'N/A'):
+        return None
+    numerator, _, denominator = rate.partition('/')
+    if not denominator:
+        return float(numerator)
+    return float(numerator) / float(denominator) if float(denominator) else None
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+@lru_cache(maxsize=1024)
+def _probe(path, size, mtime):
+    # WAV and MP4 headers are read in-process; ffprobe only for other containers
+    info = read_header(path, size)
+    if info is not None:
+        return info
+    with profiling.span("ffprobe", file=os.path.basename(path)):
+        output = subprocess.check_output(['ffprobe', '-v', 'error', '-print_format', 'json',
+                                          '-show_format', '-show_streams', path])
+    data = json.loads(output)
+    info = {'path': path,
+            'size': size,
+            'duration': _to_float(data.get('format', {}).get('duration')),
+            'format': data.get('format', {}).get('format_name'),
+            'bit_rate': _to_float(data.get('format', {}).get('bit_rate')),
+            'video_codec': None, 'width': None, 'height': None, 'fps': None,
+            'time_base': None, 'pix_fmt': None,
+            'audio_codec': None, 'sample_rate': None, 'channels': None}
+    for stream in data.get('streams', []):
+        if stream.get('codec_type') == 'video' and info['video_codec'] is None:
+            info.update(video_codec=stream.get('codec_name'),
+                        width=stream.get('width'),
+                        height=stream.get('height'),
+                        fps=_parse_rate(stream.get('avg_frame_rate')) or _parse_rate(stream.get('r_frame_rate')),
+                        time_base=stream.get('time_base'),
+                        pix_fmt=stream.get('pix_fmt'))
+        elif stream.get('codec_type') == 'audio' and info['audio_codec'] is None:
+            info.update(audio_codec=stream.get('codec_name'),
+                        sample_rate=int(stream['sample_rate']) if stream.get('sample_rate') else None,
+                        channels=stream.get('channels'))
+    return info
+
+
+def probe_media(path):
+    """
+    Returns a dict of container and first video/audio stream metadata for a file.
+    Results are cached until the file's size or mtime changes.
+    """
+    stat = os.stat(path)
+    return dict(_probe(os.path.abspath(path), stat.st_size, stat.st_mtime))
+
+
+def probe_duration(path):
+    return probe_media(path)['duration']
@@ -0,0 +1,273 @@
+# profiling.py
+#
+# Opt-in spans, counters and per-stage timers. Everything is a no-op until
+# enable() is called; the settings travel to spawned workers through the
+# environment, and each process appends its events to its own file in the
+# trace folder. write_report() merges them into one Chrome trace-event file
+# (open in chrome://tracing or ui.perfetto.dev) and prints a summary table.
+import atexit
+import cProfile
+import glob
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+
+TRACE_DIR_ENV = "AVA_TRACE_DIR"
+CPROFILE_ENV = "AVA_TRACE_CPROFILE"
+TRACEMALLOC_ENV = "AVA_TRACE_TRACEMALLOC"
+LAP_COUNTER_INTERVAL = 1.0
+
+_tracer = None
+
+
+def _now_us():
+    return time.time_ns() // 1000
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _NullLaps:
+    def start(self):
+        pass
+
+    def __call__(self, stage):
+        pass
+
+    def close(self):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+_NULL_LAPS = _NullLaps()
+
+
+class _Span:
+    def __init__(self, tracer, name, tid, args):
+        self.tracer = tracer
+        self.name = name
+        self.tid = tid
+        self.args = args
+
+    def __enter__(self):
+        self.start = _now_us()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.emit({'name': self.name, 'ph': 'X', 'ts': self.start, 'dur': _now_us() - self.start,
+                          'tid': self.tid if self.tid is not None else threading.get_ident(),
+                          'args': self.args})
+        return False
+
+
+class Laps:
+    """
+    Accumulates time spent in the stages of a hot loop. Calling laps(stage)
+    charges the time since the previous call to that stage; totals are emitted
+    as counter events about once a second and as a summary on close().
+    """
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+        self.totals = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.last = None
+        self.last_emit = None
+
+    def start(self):
+        self.last = self.last_emit = time.perf_counter()
+
+    def __call__(self, stage):
+        now = time.perf_counter()
+        self.totals[stage] += now - self.last
+        self.counts[stage] += 1
+        self.last = now
+        if now - self.last_emit >= LAP_COUNTER_INTERVAL:
+            self.last_emit = now
+            self._emit_counter()
+
+    def _emit_counter(self):
+        self.tracer.emit({'name': self.name, 'ph': 'C', 'ts': _now_us(), 'tid': threading.get_ident(),
+                          'args': {stage: round(total, 3) for stage, total in self.totals.items()}})
+
+    def close(self):
+        self._emit_counter()
+        self.tracer.emit({'name': self.name, 'ph': 'i', 's': 'p', 'ts': _now_us(), 'tid': threading.get_ident(),
+                          'cat': 'laps',
+                          'args': {stage: {'seconds': self.totals[stage], 'count': self.counts[stage]}
+                                   for stage in self.totals}})
+
+
+class Tracer:
+    def __init__(self, trace_dir, cprofile=False, tracemalloc=False):
+        self.trace_dir = trace_dir
+        self.cprofile = cprofile
+        self.tracemalloc = tracemalloc
+        self.pid = os.getpid()
+        self.events = []
+        self.lock = threading.Lock()
+        os.makedirs(trace_dir, exist_ok=True)
+        self.path = os.path.join(trace_dir, f"trace-{self.pid}.jsonl")
+        atexit.register(self.flush)
+
+    def emit(self, event):
+        event['pid'] = self.pid
+        with self.lock:
+            self.events.append(event)
+
+    def flush(self):
+        with self.lock:
+            events, self.events = self.events, []
+        if events:
+            with open(self.path, 'a') as f:
+                for event in events:
+                    f.write(json.dumps(event, default=str) + "\n")
+
+
+def _tracer_from_env():
+    trace_dir = os.environ.get(TRACE_DIR_ENV)
+    if not trace_dir:
+        return None
+    return Tracer(trace_dir, cprofile=os.environ.get(CPROFILE_ENV) == "1",
+                  tracemalloc=os.environ.get(TRACEMALLOC_ENV) == "1")
+
+
+def enable(trace_dir, cprofile=False, tracemalloc=False):
+    """
+    Turns instrumentation on for this process and every worker it spawns afterwards.
+    """
+    global _tracer
+    for path in glob.glob(os.path.join(trace_dir, "trace-*.jsonl")):
+        os.remove(path)
+    os.environ[TRACE_DIR_ENV] = os.path.abspath(trace_dir)
+    os.environ[CPROFILE_ENV] = "1" if cprofile else "0"
+    os.environ[TRACEMALLOC_ENV] = "1" if tracemalloc else "0"
+    _tracer = _tracer_from_env()
+    _tracer.emit({'name': 'process_name', 'ph': 'M', 'tid': 0, 'args': {'name': 'main'}})
+
+
+def enabled():
+    return _tracer is not None
+
+
+def span(name, tid=None, **args):
+    if _tracer is None:
+        return _NULL_SPAN
+    return _Span(_tracer, name, tid, args)
+
+
+def counter(name, **values):
+    if _tracer is not None:
+        _tracer.emit({'name': name, 'ph': 'C', 'ts': _now_us(), 'tid': threading.get_ident(), 'args': values})
+
+
+def record_span(name, start_us, end_us, **args):
+    """
+    Records a span measured elsewhere, e.g. process startup timed from the parent's clock.
+    """
+    if _tracer is not None:
+        _tracer.emit({'name': name, 'ph': 'X', 'ts': start_us, 'dur': end_us - start_us,
+                      'tid': threading.get_ident(), 'args': args})
+
+
+def laps(name):
+    if _tracer is None:
+        return _NULL_LAPS
+    return Laps(_tracer, name)
+
+
+def name_process(name):
+    if _tracer is not None:
+        _tracer.emit({'name': 'process_name', 'ph': 'M', 'tid': 0, 'args': {'name': name}})
+
+
+def now_us():
+    return _now_us()
+
+
+@contextmanager
+def profile_job(label):
+    """
+    Optionally runs cProfile and/or tracemalloc around one job, writing
+    <label>-<pid>.prof and <label>-<pid>-memory.txt into the trace folder.
+    """
+    if _tracer is None or not (_tracer.cprofile or _tracer.tracemalloc):
+        yield
+        return
+    base = os.path.join(_tracer.trace_dir, f"{label}-{os.getpid()}")
+    profiler = cProfile.Profile() if _tracer.cprofile else None
+    if _tracer.tracemalloc:
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(base + ".prof")
+        if _tracer.tracemalloc:
+            _, peak = tracemalloc.get_traced_memory()
+            top = tracemalloc.take_snapshot().statistics('lineno')[:25]
+            tracemalloc.stop()
+            with open(base + "-memory.txt", 'w') as f:
+                f.write(f"peak: {peak / 1024 ** 2:.1f} MiB\n")
+                for stat in top:
+                    f.write(f"{stat}\n")
+            counter('tracemalloc peak MiB', **{label: round(peak / 1024 ** 2, 1)})
+        _tracer.flush()
+
+
+def flush():
+    if _tracer is not None:
+        _tracer.flush()
+
+
+def write_report(output_name="trace.json"):
+    """
+    Merges every process's events into one Chrome trace and prints a summary table.
+    """
+    if _tracer is None:
+        return None
+    _tracer.flush()
+    events = []
+    for path in sorted(glob.glob(os.path.join(_tracer.trace_dir, "trace-*.jsonl"))):
+        with open(path, 'r') as f:
+            events.extend(json.loads(line) for line in f if line.strip())
+    events.sort(key=lambda event: event.get('ts', 0))
+    output_path = os.path.join(_tracer.trace_dir, output_name)
+    with open(output_path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    spans = defaultdict(list)
+    stages = defaultdict(lambda: [0.0, 0])
+    for event in events:
+        if event['ph'] == 'X':
+            spans[event['name']].append(event['dur'] / 1e6)
+        elif event['ph'] == 'i' and event.get('cat') == 'laps':
+            for stage, totals in event['args'].items():
+                stages[f"{event['name']}.{stage}"][0] += totals['seconds']
+                stages[f"{event['name']}.{stage}"][1] += totals['count']
+    print(f"\n{'span':<40}{'count':>8}{'total s':>12}{'mean s':>12}{'max s':>12}")
+    for name, durations in sorted(spans.items(), key=lambda item: -sum(item[1])):
+        print(f"{name[:39]:<40}{len(durations):>8}{sum(durations):>12.3f}"
+              f"{sum(durations) / len(durations):>12.4f}{max(durations):>12.3f}")
+    if stages:
+        print(f"\n{'stage':<40}{'count':>8}{'total s':>12}{'mean ms':>12}")
+        for name, (total, count) in sorted(stages.items(), key=lambda item: -item[1][0]):
+            print(f"{name[:39]:<40}{count:>8}{total:>12.3f}{total * 1000 / max(count, 1):>12.3f}")
+    print(f"\nTrace written to {output_path}")
+    return output_path
+
+
+_tracer = _tracer_from_env()
@@ -0,0 +1,148 @@
+# rename_engine.py
+import os
+import re
+import uuid
+from collections import defaultdict
+
+
+class RenameRule:
+    def __init__(self, pattern, replacement, count=0):
+        """
+        A regular expression substitution applied to file names (never to folders).
+        :param pattern: Regular expression matched against the base name.
+        :param replacement: Replacement string, may use group references.
+        :param count: Maximum substitutions per name, 0 for all.
+        """
+        self.regex = re.compile(pattern)
+        self.replacement = replacement
+        self.count = count
+
+    def apply(self, name):
+        return self.regex.sub(self.replacement, name, count=self.count)
+
+
+DEFAULT_RULES = [RenameRule(r"Copy of ", "")]
+
+
+class RenamePlan:
+    def __init__(self):
+        self.renames = []    # (source, target) pairs that are safe to apply
+        self.conflicts = []  # (source, target, reason) pairs that will be skipped
+        self.chained = False  # some target is the current name of another source
+
+    def __len__(self):
+        return len(self.renames)
+
+    def describe(self):
+        lines = [f"{os.path.basename(source)} -> {os.path.basename(target)}" for source, target in self.renames]
+        lines += [f"SKIP {os.path.basename(source)} -> {os.path.basename(target)}: {reason}"
+                  for source, target, reason in self.conflicts]
+        return "\n".join(lines)
+
+
+class BulkRenamer:
+    def __init__(self, rules=None):
+        self.rules = rules if rules is not None else DEFAULT_RULES
+
+    def new_name(self, name):
+        for rule in self.rules:
+            name = rule.apply(name)
+        return name
+
+    def plan(self, paths):
+        """
+        Builds a rename plan for the given files with one directory scan per folder,
+        detecting collisions and chains before anything touches the disk.
+        """
+        by_folder = defaultdict(list)
+        for path in paths:
+            by_folder[os.path.dirname(os.path.abspath(path))].append(os.path.basename(path))
+        plan = RenamePlan()
+        for folder, names in by_folder.items():
+            with os.scandir(folder) as entries:
+                existing = {entry.name for entry in entries}
+            self._plan_folder(plan, folder, names, existing)
+        return plan
+
+    def plan_directory(self, folder):
+        with os.scandir(folder) as entries:
+            names = [entry.name for entry in entries if entry.is_file()]
+        plan = RenamePlan()
+        self._plan_folder(plan, os.path.abspath(folder), names, set(names))
+        return plan
+
+    def _plan_folder(self, plan, folder, names, existing):
+        proposed = {}
+        for name in dict.fromkeys(names):
+            if name not in existing:
+                plan.conflicts.append((os.path.join(folder, name), os.path.join(folder, name), "file not found"))
+                continue
+            target = self.new_name(name)
+            if target and target != name:
+                proposed[name] = target
+
+        claimed = defaultdict(list)
+        for name, target in proposed.items():
+            claimed[target].append(name)
+        sources = set(proposed)
+        for name, target in proposed.items():
+            source_path, target_path = os.path.join(folder, name), os.path.join(folder, target)
+            if len(claimed[target]) > 1:
+                plan.conflicts.append((source_path, target_path,
+                                       f"{len(claimed[target])} files would get this name"))
+            elif target in existing and target not in sources:
+                plan.conflicts.append((source_path, target_path, "target already exists"))
+            else:
+                if target in sources:
+                    plan.chained = True
+                plan.renames.append((source_path, target_path))
+
+        # A chain whose next link was skipped would overwrite that file
+        skipped = {source for source, _, _ in plan.conflicts}
+        blocked = [(s, t) for s, t in plan.renames if t in skipped]
+        while blocked:
+            for source, target in blocked:
+                plan.renames.remove((source, target))
+                plan.conflicts.append((source, target, "target is a file that cannot be renamed"))
+            skipped = {source for source, _, _ in plan.conflicts}
+            blocked = [(s, t) for s, t in plan.renames if t in skipped]
+
+    def apply(self, plan, dry_run=False):
+        """
+        Applies a plan in one pass. Chains and cycles go through temporary names
+        first; if any rename fails, the ones already done are rolled back.
+        Returns the list of (source, target) pairs applied.
+        """
+        if dry_run or not plan.renames:
+            return []
+        if plan.chained:
+            token = uuid.uuid4().hex[:8]
+            staged = [(source, os.path.join(os.path.dirname(source), f".rename-{token}-{i}"), target)
+                      for i, (source, target) in enumerate(plan.renames)]
+            steps = [(source, temp) for source, temp, _ in staged] + [(temp, target) for _, temp, target in staged]
+        else:
+            steps = list(plan.renames)
+        done = []
+        try:
+            for source, target in steps:
+                _rename_no_clobber(source, target)
+                done.append((source, target))
+        except OSError:
+            for source, target in reversed(done):
+                os.rename(target, source)
+            raise
+        return list(plan.renames)
+
+
+def _rename_no_clobber(source, target):
+    # link + unlink fails with FileExistsError instead of silently replacing target
+    try:
+        os.link(source, target)
+    except FileExistsError:
+        raise
+    except OSError:
+        if os.path.exists(target):
+            raise FileExistsError(target)
+        os.rename(source, target)
+        return
+    os.unlink(source)
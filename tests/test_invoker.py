@@ -0,0 +1,27 @@
+import pytest
+
+pytest.importorskip("cv2")
+pytest.importorskip("moviepy")
+
+from commands import CorrectNameCommand  # noqa: E402
+from invoker import FileOperationInvoker  # noqa: E402
+
+
+def test_plain_command_runs_through_invoker(tmp_path):
+    # CorrectNameCommand derives from Command, not FfmpegCommand
+    path = tmp_path / "Copy of recording.mp4"
+    path.write_bytes(b"")
+    command = CorrectNameCommand(str(path))
+    invoker = FileOperationInvoker()
+    invoker.run_command(command)
+    assert command.status == "Success"
+    assert (tmp_path / "recording.mp4").is_file()
+    assert [entry['status'] for entry in invoker.history] == ["Success"]
+
+
+def test_missing_input_fails_with_a_reason(tmp_path):
+    command = CorrectNameCommand(str(tmp_path / "missing.mp4"))
+    invoker = FileOperationInvoker()
+    invoker.run_command(command)
+    assert command.status == "Failed"
+    assert "File not found" in command.reason
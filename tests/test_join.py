@@ -0,0 +1,45 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
+pytest.importorskip("cv2")
+pytest.importorskip("moviepy")
+if not shutil.which("ffmpeg") or not shutil.which("ffprobe"):
+    pytest.skip("ffmpeg and ffprobe are required", allow_module_level=True)
+if "libx264" not in subprocess.run(["ffmpeg", "-hide_banner", "-encoders"], capture_output=True, text=True).stdout:
+    pytest.skip("ffmpeg is built without libx264", allow_module_level=True)
+
+from commands import JoinPartsCommand  # noqa: E402
+from invoker import FileOperationInvoker  # noqa: E402
+from verify import count_packets  # noqa: E402
+
+DURATION = 2
+
+
+def make_part(path, fps):
+    subprocess.run(['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y',
+                    '-f', 'lavfi', '-i', f"testsrc=size=320x240:rate={fps}:duration={DURATION}",
+                    '-f', 'lavfi', '-i', f"sine=frequency=440:sample_rate=48000:duration={DURATION}",
+                    '-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-c:a', 'aac', '-shortest', str(path)],
+                   check=True)
+
+
+def test_join_conforms_a_part_and_verifies_against_it(tmp_path):
+    first, second = tmp_path / "rec_Part1-a.mp4", tmp_path / "rec_Part2-b.mp4"
+    make_part(first, 30)
+    make_part(second, 25)
+    command = JoinPartsCommand([str(first), str(second)])
+    invoker = FileOperationInvoker()
+    invoker.run_command(command)
+    assert command.status == "Success", command.reason
+
+    # The second part was re-encoded to 30 fps and the output was verified against that copy
+    [stage] = command.conform_stages
+    assert stage.status == "Success"
+    assert command.verify_sources() == [str(first), stage.output_path]
+    assert not os.path.exists(stage.output_path)
+    video = count_packets(command.output_path)['video']
+    assert abs(video['packets'] - 2 * 30 * DURATION) <= 2
+    assert abs(count_packets(str(second))['video']['packets'] - 25 * DURATION) <= 1
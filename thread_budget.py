@@ -0,0 +1,83 @@
+# thread_budget.py
+#
+# Host-wide CPU thread budget. Every running job registers with a shared
+# counter and gets total // active threads, which it hands to its encoders
+# explicitly (ffmpeg/x264 -threads, cv2.setNumThreads, moviepy threads)
+# instead of each one sizing itself to every core. The counter lives in shared
+# memory, so worker processes started with the budget see the same numbers.
+# ffmpeg keeps the allocation it started with, so allocations are also capped
+# at max_share: a batch's first jobs would otherwise take every core and keep
+# them while the rest of the batch starts. A lone job still gets max_share,
+# half the cores by default. OpenCV loops call share() as they go and follow
+# the budget as jobs start and finish.
+from contextlib import contextmanager
+from multiprocessing import Value, cpu_count
+
+_budget = None
+
+
+class ThreadBudget:
+    def __init__(self, total=None, max_share=None, min_share=1):
+        """
+        :param total: Threads shared by all running jobs, defaults to the core count.
+        :param max_share: Most threads one allocation gets, defaults to half the total (at least 4).
+        :param min_share: Fewest threads one allocation gets, however many jobs run.
+        """
+        self.total = total or cpu_count()
+        self.max_share = max_share or min(self.total, max(4, self.total // 2))
+        self.min_share = min_share
+        self.active = Value('i', 0)
+
+    def share(self):
+        return max(self.min_share, self.total // max(1, self.active.value))
+
+    def acquire(self):
+        with self.active.get_lock():
+            self.active.value += 1
+        return min(self.share(), self.max_share)
+
+    def release(self):
+        with self.active.get_lock():
+            self.active.value = max(0, self.active.value - 1)
+
+    @contextmanager
+    def job(self):
+        threads = self.acquire()
+        try:
+            yield threads
+        finally:
+            self.release()
+
+
+def set_budget(budget):
+    global _budget
+    _budget = budget
+
+
+def get_budget():
+    return _budget
+
+
+@contextmanager
+def allocation(enabled=True):
+    """
+    Holds a share of the budget for the duration of a job. Yields the number of
+    threads to use, or None when no budget is set (or the job isn't CPU-bound)
+    and tools pick their own.
+    """
+    if _budget is None or not enabled:
+        yield None
+        return
+    with _budget.job() as threads:
+        yield threads
+
+
+def current_share(default=None):
+    return _budget.share() if _budget is not None else default
+
+
+def with_threads(args, threads):
+    # -threads as an output option, placed just before the output path
+    if not threads:
+        return list(args)
+    return list(args[:-1]) + ['-threads', str(threads), args[-1]]
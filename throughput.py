@@ -0,0 +1,89 @@
+# throughput.py
+#
+# Learns how long each command takes from past runs. Every command that runs
+# appends a line to the throughput log with the work it did (seconds of media
+# x megapixels of the job's source), the time the planner predicted and the
+# time it actually took. A command's rate is its total time over its total
+# work across its most recent runs. Commands without history fall back to a
+# prior scaled from their relative cost.
+import json
+import os
+import time
+from collections import defaultdict, deque
+
+THROUGHPUT_LOG = "throughput.jsonl"
+HISTORY_SAMPLES = 50  # most recent runs per command the rate is taken over
+SECONDS_PER_COST_UNIT = 0.05  # prior: seconds per unit of work per unit of relative cost
+DEFAULT_COST = 1.0
+
+
+def work_units(info):
+    """
+    Work in a source: seconds of media x megapixels (1 for audio-only files).
+    """
+    if not info:
+        return 0.0
+    duration = info.get('duration') or 0
+    megapixels = (info.get('width') or 0) * (info.get('height') or 0) / 1e6 or 1.0
+    return duration * megapixels
+
+
+def format_seconds(seconds):
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+class ThroughputModel:
+    def __init__(self, log_path=THROUGHPUT_LOG, prior=None, samples=HISTORY_SAMPLES):
+        """
+        :param log_path: JSON-lines log of past command runs.
+        :param prior: {command name: relative cost} for commands without history.
+        :param samples: Most recent runs per command the rate is taken over.
+        """
+        self.log_path = log_path
+        self.prior = prior or {}
+        self.history = defaultdict(lambda: deque(maxlen=samples))
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.log_path):
+            return
+        with open(self.log_path, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # a line cut short by a crash
+                if entry.get('units'):
+                    self.history[entry['command']].append((entry['units'], entry['actual']))
+
+    def learned(self, name):
+        return bool(self.history.get(name))
+
+    def seconds_per_unit(self, name):
+        runs = self.history.get(name)
+        if runs:
+            return sum(seconds for _, seconds in runs) / sum(units for units, _ in runs)
+        return self.prior.get(name, DEFAULT_COST) * SECONDS_PER_COST_UNIT
+
+    def predict(self, name, units):
+        return units * self.seconds_per_unit(name)
+
+
+def record(command, seconds, log_path=THROUGHPUT_LOG):
+    """
+    Logs a command run against the planner's prediction, which the next model learns from.
+    """
+    units = getattr(command, 'work_units', None)
+    if not units:
+        return
+    entry = {'time': time.time(), 'command': command.__class__.__name__,
+             'input': os.path.basename(getattr(command, 'file_path', None) or getattr(command, 'video_path', None) or ''),
+             'units': units, 'predicted': getattr(command, 'predicted_seconds', None), 'actual': seconds}
+    # One write of one short line, so concurrent workers don't interleave
+    with open(log_path, 'a') as f:
+        f.write(json.dumps(entry) + "\n")
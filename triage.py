@@ -0,0 +1,152 @@
+# triage.py
+#
+# Finds the recordings that need black bar repair without running the repair.
+# ffmpeg decodes only the keyframes (-skip_frame nokey), scaled down to small
+# gray frames, and pipes them here (luma.py); the same edge detector as
+# RemoveBlackBarsCommand measures each one. A letterbox that is there all the
+# time is a crop, not a defect, so each side's usual width is taken as the
+# border and only samples with bands beyond it are flagged. Files are scanned
+# in parallel, one ffmpeg each, and ranked by how much of them is flagged.
+import json
+import os
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import cpu_count
+
+import numpy as np
+
+from bar_geometry import SIDES, BarDetector
+from luma import LumaReader
+from probe import probe_media
+import profiling
+import thread_budget
+
+VIDEO_EXTENSIONS = ('.mp4', '.flv', '.avi', '.mkv', '.mov')
+# Folders the tool writes into; their contents are outputs, not recordings
+SKIP_FOLDERS = ('processed_black_bars', 'converted', 'ready', 'cropped', 'proxy', 'joined', 'trimmed',
+                'prepared_audio', 'avi_old', 'flv-originals', 'original-mp4')
+TRIAGE_WIDTH = 320
+BORDER_PERCENTILE = 10  # a side's border is the band it shows in all but this share of samples
+
+
+def find_videos(folder, skip_folders=SKIP_FOLDERS):
+    paths = []
+    for root, folders, files in os.walk(folder):
+        folders[:] = sorted(name for name in folders if name not in skip_folders and not name.startswith('.'))
+        paths.extend(os.path.join(root, name) for name in sorted(files)
+                     if name.lower().endswith(VIDEO_EXTENSIONS) and '.partial.' not in name)
+    return paths
+
+
+def scan_keyframes(video_path, width, height, measure, interval=None, threads=None):
+    """
+    Decodes every keyframe of a video as a width x height gray frame and
+    passes it to measure() as it arrives, so frames aren't kept. With an
+    interval (seconds), every frame is decoded and one per interval kept
+    instead, for files with too few keyframes. threads sizes ffmpeg's decoder.
+    Returns (times, measurements).
+    """
+    with LumaReader(video_path, width, height, keyframes_only=interval is None, interval=interval,
+                    timestamps=True, threads=threads) as reader:
+        measurements = [measure(frame) for frame in reader]
+    count = min(len(reader.times), len(measurements))
+    return reader.times[:count], measurements[:count]
+
+
+def flagged_ranges(times, flagged, duration):
+    # A flagged sample stands for the stretch up to the next sample
+    ranges = []
+    for index in np.flatnonzero(flagged):
+        start = times[index]
+        end = times[index + 1] if index + 1 < len(times) else duration
+        if ranges and start <= ranges[-1][1]:
+            ranges[-1][1] = end
+        else:
+            ranges.append([start, end])
+    return [(round(start, 2), round(end, 2)) for start, end in ranges]
+
+
+def triage_file(video_path, threshold=10, min_bar_width=1, sides=SIDES, interval=None):
+    """
+    Scans one video. Returns a dict with the flagged share of samples, the
+    suspected time ranges and the permanent border of each side (in source
+    pixels), or with an 'error'.
+    """
+    started = time.monotonic()
+    result = {'path': video_path, 'samples': 0, 'flagged': 0, 'score': 0.0, 'ranges': [], 'border': {}}
+    try:
+        info = probe_media(video_path)
+        source_width, source_height = info['width'], info['height']
+        if not source_width or not source_height:
+            raise ValueError("no video stream")
+        height = max(2, int(round(TRIAGE_WIDTH * source_height / source_width / 2)) * 2)
+        scale = source_width / TRIAGE_WIDTH
+        detector = BarDetector(threshold)
+
+        def measure(frame):
+            geometry = detector.measure(frame)
+            return [geometry[side] for side in sides]
+
+        # Scans share the host's thread budget with running jobs
+        with thread_budget.allocation() as threads, \
+                profiling.span("triage scan", file=os.path.basename(video_path)):
+            times, widths = scan_keyframes(video_path, TRIAGE_WIDTH, height, measure, interval, threads)
+    except (OSError, ValueError, KeyError, subprocess.CalledProcessError) as e:
+        result['error'] = str(e) or e.__class__.__name__
+        return result
+    duration = info.get('duration') or (times[-1] if times else 0)
+    result.update(duration=duration, samples=len(times))
+    if not times:
+        return result
+    widths = np.array(widths)
+    border = np.percentile(widths, BORDER_PERCENTILE, axis=0).astype(int)
+    min_width = max(1, int(round(min_bar_width / scale)))
+    flagged = ((widths - border) >= min_width).any(axis=1)
+    result.update(flagged=int(flagged.sum()), score=float(flagged.mean()),
+                  ranges=flagged_ranges(times, flagged, duration),
+                  border={side: int(round(width * scale)) for side, width in zip(sides, border) if width},
+                  speed=duration / max(time.monotonic() - started, 1e-6))
+    return result
+
+
+def triage(paths, max_workers=None, **kwargs):
+    """
+    Scans many videos in parallel. Returns their results, most suspect first.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers or cpu_count()) as pool:
+        return rank(pool.map(lambda path: triage_file(path, **kwargs), paths))
+
+
+def rank(results):
+    # Most of the file flagged first, longer files first among equals
+    return sorted(results, key=lambda result: (result['score'], result.get('duration') or 0), reverse=True)
+
+
+def format_time(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def describe(results, limit=None):
+    lines = []
+    for result in results[:limit]:
+        name = os.path.relpath(result['path'])
+        if 'error' in result:
+            lines.append(f"   error  {name}: {result['error']}")
+            continue
+        if not result['flagged']:
+            continue
+        ranges = ", ".join(f"{format_time(start)}-{format_time(end)}" for start, end in result['ranges'][:5])
+        more = f" (+{len(result['ranges']) - 5} more)" if len(result['ranges']) > 5 else ""
+        lines.append(f"{result['score']:>7.1%}  {name}: {result['flagged']}/{result['samples']} keyframes, {ranges}{more}")
+    suspected = sum(1 for result in results if result['flagged'])
+    failed = sum(1 for result in results if 'error' in result)
+    lines.append(f"{suspected} of {len(results)} files suspected, {len(results) - suspected - failed} clean, "
+                 f"{failed} not readable")
+    return "\n".join(lines)
+
+
+def save_report(results, report_path):
+    with open(report_path, 'w') as f:
+        json.dump(results, f, indent=4)
@@ -0,0 +1,143 @@
+# verify.py
+#
+# Checks a command's output against its input at the container level before
+# the originals are moved or deleted. ffprobe demuxes both with
+# -count_packets, which reads every packet header without decoding, and each
+# stream kind the command keeps must come out with the same duration and
+# packet count, within a tolerance. Video packets are frames whatever the
+# codec; audio packets are only compared when the audio was copied.
+# The input is counted on a background thread (or task) while the command
+# still encodes, so verifying costs about one demux of the output.
+import asyncio
+import json
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import profiling
+
+VERIFY_TOLERANCE = 1.0  # seconds a stream may differ from the input
+PACKET_SLACK = 2  # packets lost at stream boundaries that are always allowed
+VERIFY_THREADS = 4
+
+_pool = None
+
+
+class VerificationError(Exception):
+    pass
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def count_args(path):
+    return ['ffprobe', '-v', 'error', '-count_packets',
+            '-show_entries', 'stream=codec_type,codec_name,nb_read_packets,duration:format=duration',
+            '-of', 'json', path]
+
+
+def parse_counts(output):
+    """
+    {kind: {'codec', 'packets', 'duration'}} of the first video and audio stream.
+    """
+    data = json.loads(output)
+    format_duration = _to_float(data.get('format', {}).get('duration'))
+    counts = {}
+    for stream in data.get('streams', []):
+        kind = stream.get('codec_type')
+        if kind not in ('video', 'audio') or kind in counts:
+            continue
+        # AVI and Matroska streams often carry no duration of their own
+        counts[kind] = {'codec': stream.get('codec_name'), 'packets': int(stream.get('nb_read_packets') or 0),
+                        'duration': _to_float(stream.get('duration')) or format_duration}
+    return counts
+
+
+def combine(counts_list):
+    # Inputs played back to back (joined parts) add up
+    combined = {}
+    for counts in counts_list:
+        for kind, stream in counts.items():
+            total = combined.setdefault(kind, {'codec': stream['codec'], 'packets': 0, 'duration': 0.0})
+            total['packets'] += stream['packets']
+            total['duration'] += stream['duration'] or 0.0
+    return combined
+
+
+def count_packets(path):
+    with profiling.span("ffprobe count_packets", file=os.path.basename(path)):
+        return parse_counts(subprocess.check_output(count_args(path), stderr=subprocess.PIPE))
+
+
+async def count_packets_async(runner, path):
+    return parse_counts(await runner.check_output(count_args(path)))
+
+
+def compare(expected, actual, streams, tolerance=VERIFY_TOLERANCE):
+    """
+    Returns what is wrong with the output, or None if it matches the input.
+    """
+    for kind in streams:
+        source = expected.get(kind)
+        if source is None:
+            continue  # the input has no such stream
+        output = actual.get(kind)
+        if not output or not output['packets']:
+            return f"no {kind} packets in the output"
+        if source['duration'] and output['duration'] and abs(output['duration'] - source['duration']) > tolerance:
+            return f"{kind} lasts {output['duration']:.2f} s, the input {source['duration']:.2f} s"
+        if kind == 'video' or output['codec'] == source['codec']:
+            rate = source['packets'] / source['duration'] if source['duration'] else 0
+            if abs(output['packets'] - source['packets']) > max(PACKET_SLACK, rate * tolerance):
+                return f"{output['packets']} {kind} packets in the output, {source['packets']} in the input"
+    return None
+
+
+def start_counting(command):
+    """
+    Counts the command's inputs in the background. Returns a future, or None
+    when the command's output isn't verified.
+    """
+    global _pool
+    if not command.verify_streams:
+        return None
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=VERIFY_THREADS)
+    return _pool.submit(lambda: combine([count_packets(path) for path in command.verify_sources()]))
+
+
+def start_counting_async(command, runner):
+    if not command.verify_streams:
+        return None
+
+    async def _count():
+        return combine(await asyncio.gather(*(count_packets_async(runner, path)
+                                              for path in command.verify_sources())))
+    return asyncio.ensure_future(_count())
+
+
+def verify_output(command, output_path, counting):
+    """
+    Compares output_path with the counts of start_counting() and raises
+    VerificationError if they don't match.
+    """
+    if counting is None:
+        return
+    problem = compare(counting.result(), count_packets(output_path), command.verify_streams,
+                      command.verify_tolerance())
+    if problem:
+        raise VerificationError(f"Verification failed: {problem}")
+
+
+async def verify_output_async(command, output_path, counting, runner):
+    if counting is None:
+        return
+    expected = await counting
+    problem = compare(expected, await count_packets_async(runner, output_path), command.verify_streams,
+                      command.verify_tolerance())
+    if problem:
+        raise VerificationError(f"Verification failed: {problem}")